@@ -0,0 +1,134 @@
+"""partition tg_message_log by month on created_at
+
+Revision ID: 0984b414103f
+Revises: g1a2b3c4d5e6
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0984b414103f'
+down_revision = 'g1a2b3c4d5e6'
+branch_labels = None
+depends_on = None
+
+
+def _create_foreign_keys():
+    op.create_foreign_key('tg_message_log_chat_id_fkey', 'tg_message_log', 'tg_chat', ['chat_id'], ['id'])
+    op.create_foreign_key('tg_message_log_user_id_fkey', 'tg_message_log', 'tg_user', ['user_id'], ['id'])
+    op.create_foreign_key('tg_message_log_reporting_id_fkey', 'tg_message_log', 'tg_user', ['reporting_id'], ['id'])
+
+
+def _create_indexes():
+    op.create_index('ix_tg_message_log_message_id', 'tg_message_log', ['message_id'])
+    op.create_index('ix_tg_message_log_manually_verified', 'tg_message_log', ['manually_verified'])
+    op.create_index('ix_tg_message_log_spam_prediction_probability', 'tg_message_log', ['spam_prediction_probability'])
+    op.create_index('ix_tg_message_log_is_spam', 'tg_message_log', ['is_spam'])
+    op.execute(
+        'CREATE INDEX ix_tg_message_log_embedding_not_null ON tg_message_log (id) WHERE embedding IS NOT NULL'
+    )
+    op.create_index(
+        'ix_tg_message_log_training_filter',
+        'tg_message_log',
+        ['manually_verified', 'spam_prediction_probability', 'is_spam']
+    )
+    # Per-user lookups (/info, /spam, CAS listener) can now prune by created_at inside each partition
+    op.create_index('ix_tg_message_log_user_id_created_at', 'tg_message_log', ['user_id', 'created_at'])
+
+
+def _reown_id_sequence(table_name):
+    # tg_message_log was created as tg_spamreportlog, so the id sequence name is not predictable.
+    # Move its ownership to the new table before the old one (and its owned sequence) is dropped.
+    op.execute(f"""
+        DO $$
+        DECLARE
+            seq text := pg_get_serial_sequence('tg_message_log', 'id');
+        BEGIN
+            IF seq IS NOT NULL THEN
+                EXECUTE format('ALTER SEQUENCE %s OWNED BY {table_name}.id', seq);
+            END IF;
+        END $$;
+    """)
+
+
+def upgrade() -> None:
+    # Partition bounds are month starts in UTC, the maintenance cron uses the same convention
+    op.execute("SET LOCAL timezone = 'UTC'")
+
+    # The dispatcher and the CAS listener write to tg_message_log on every message. Block their writes (reads
+    # still work) until the migration commits, so no row lands in the old table after the copy and is dropped with it.
+    op.execute("LOCK TABLE tg_message_log IN EXCLUSIVE MODE")
+
+    # The partition key has to be NOT NULL
+    op.execute("UPDATE tg_message_log SET created_at = COALESCE(message_timestamp, now()) WHERE created_at IS NULL")
+
+    op.execute("CREATE TABLE tg_message_log_partitioned (LIKE tg_message_log INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+    op.execute("ALTER TABLE tg_message_log_partitioned ALTER COLUMN created_at SET NOT NULL")
+
+    # One partition per month of existing history and three months ahead.
+    # The default partition only catches rows the maintenance cron did not create a partition for in time.
+    op.execute("""
+        DO $$
+        DECLARE
+            month_start timestamptz := date_trunc('month', COALESCE((SELECT min(created_at) FROM tg_message_log), now()));
+            last_month timestamptz := date_trunc('month', now() + interval '3 months');
+        BEGIN
+            WHILE month_start <= last_month LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF tg_message_log_partitioned FOR VALUES FROM (%L) TO (%L)',
+                    'tg_message_log_p' || to_char(month_start, 'YYYYMM'),
+                    month_start,
+                    month_start + interval '1 month'
+                );
+                month_start := month_start + interval '1 month';
+            END LOOP;
+        END $$;
+    """)
+    op.execute("CREATE TABLE tg_message_log_default PARTITION OF tg_message_log_partitioned DEFAULT")
+
+    op.execute("INSERT INTO tg_message_log_partitioned SELECT * FROM tg_message_log")
+
+    # A unique constraint on a partitioned table must include the partition key, so (message_id, chat_id)
+    # uniqueness across partitions is kept in a small side table that also maps a message to its partition
+    op.create_table(
+        'tg_message_log_key',
+        sa.Column('message_id', sa.BigInteger(), nullable=False),
+        sa.Column('chat_id', sa.BigInteger(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('message_id', 'chat_id', name='message_log_key_pkey')
+    )
+    op.execute("""
+        INSERT INTO tg_message_log_key (message_id, chat_id, created_at)
+        SELECT message_id, chat_id, created_at FROM tg_message_log WHERE message_id IS NOT NULL
+    """)
+
+    _reown_id_sequence('tg_message_log_partitioned')
+    op.execute("DROP TABLE tg_message_log")
+    op.execute("ALTER TABLE tg_message_log_partitioned RENAME TO tg_message_log")
+
+    op.create_primary_key('message_log_pkey', 'tg_message_log', ['id', 'created_at'])
+    op.create_unique_constraint('uix_message_id_chat_id_created_at', 'tg_message_log', ['message_id', 'chat_id', 'created_at'])
+    _create_foreign_keys()
+    _create_indexes()
+
+
+def downgrade() -> None:
+    # Partitions that were already moved to the archive schema are not brought back
+    op.execute("LOCK TABLE tg_message_log IN EXCLUSIVE MODE")
+    op.execute("CREATE TABLE tg_message_log_plain (LIKE tg_message_log INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO tg_message_log_plain SELECT * FROM tg_message_log")
+
+    _reown_id_sequence('tg_message_log_plain')
+    op.execute("DROP TABLE tg_message_log")
+    op.drop_table('tg_message_log_key')
+    op.execute("ALTER TABLE tg_message_log_plain RENAME TO tg_message_log")
+    op.execute("ALTER TABLE tg_message_log ALTER COLUMN created_at DROP NOT NULL")
+
+    op.create_primary_key('message_log_pkey', 'tg_message_log', ['id'])
+    op.create_unique_constraint('uix_message_id_chat_id', 'tg_message_log', ['message_id', 'chat_id'])
+    _create_foreign_keys()
+    _create_indexes()
+    op.drop_index('ix_tg_message_log_user_id_created_at', table_name='tg_message_log')
@@ -0,0 +1,43 @@
+"""add media_group_id to message_log
+
+Revision ID: 5e1f7c2a9d34
+Revises: 0984b414103f
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e1f7c2a9d34'
+down_revision = '0984b414103f'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 50000
+
+
+def upgrade() -> None:
+    op.add_column('tg_message_log', sa.Column('media_group_id', sa.String(), nullable=True))
+
+    # Backfill from raw_message in id ranges, committing each batch so the table is never locked for the whole run
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        min_id, max_id = conn.execute(sa.text("SELECT min(id), max(id) FROM tg_message_log")).fetchone()
+        if min_id is not None:
+            for batch_start in range(min_id, max_id + 1, BACKFILL_BATCH_SIZE):
+                conn.execute(sa.text("""
+                    UPDATE tg_message_log
+                    SET media_group_id = raw_message::jsonb->>'media_group_id'
+                    WHERE id >= :batch_start AND id < :batch_end
+                      AND raw_message IS NOT NULL
+                      AND raw_message::jsonb ? 'media_group_id'
+                """), {'batch_start': batch_start, 'batch_end': batch_start + BACKFILL_BATCH_SIZE})
+
+    op.create_index('ix_tg_message_log_chat_id_media_group_id', 'tg_message_log', ['chat_id', 'media_group_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tg_message_log_chat_id_media_group_id', table_name='tg_message_log')
+    op.drop_column('tg_message_log', 'media_group_id')
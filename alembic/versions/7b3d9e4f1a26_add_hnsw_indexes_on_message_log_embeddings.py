@@ -0,0 +1,60 @@
+"""add hnsw indexes on message_log embeddings
+
+Revision ID: 7b3d9e4f1a26
+Revises: 5e1f7c2a9d34
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3d9e4f1a26'
+down_revision = '5e1f7c2a9d34'
+branch_labels = None
+depends_on = None
+
+# The column is declared as dimensionless `vector`, HNSW needs a fixed dimension, so the index is built on a
+# cast. Queries have to use the same expression (see message_helper.find_near_duplicate_messages) to hit it.
+EMBEDDING_DIMENSIONS = 1536
+
+
+def _create_hnsw_index(conn, index_name, column_name):
+    """
+    A plain CREATE INDEX would hold a SHARE lock on every partition, blocking message log writes, for the whole
+    HNSW build. Create the parent index ON ONLY (invalid until complete), build each partition's index
+    concurrently and attach it, like quantize_message_log_embeddings.create_index_concurrently.
+    Partitions created later inherit the index.
+    """
+    definition = (
+        f"USING hnsw (({column_name}::vector({EMBEDDING_DIMENSIONS})) vector_cosine_ops) "
+        f"WHERE {column_name} IS NOT NULL"
+    )
+    conn.execute(sa.text(f"CREATE INDEX IF NOT EXISTS {index_name} ON ONLY tg_message_log {definition}"))
+    partitions = conn.execute(sa.text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'tg_message_log'::regclass
+        ORDER BY c.relname
+    """)).scalars().all()
+    suffix = index_name.removeprefix('ix_tg_message_log_')
+    for partition in partitions:
+        child_name = f"{partition}_{suffix}"
+        conn.execute(sa.text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child_name} ON {partition} {definition}"))
+        conn.execute(sa.text(f"ALTER INDEX {index_name} ATTACH PARTITION {child_name}"))
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        conn.execute(sa.text("SET maintenance_work_mem = '1GB'"))
+        # Only `embedding` is searched by similarity; image_description_embedding is just a model feature
+        _create_hnsw_index(conn, 'ix_tg_message_log_embedding_hnsw', 'embedding')
+        conn.execute(sa.text("RESET maintenance_work_mem"))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tg_message_log_embedding_hnsw', table_name='tg_message_log')
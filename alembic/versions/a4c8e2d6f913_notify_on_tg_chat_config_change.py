@@ -0,0 +1,44 @@
+"""notify on tg_chat config change
+
+Revision ID: a4c8e2d6f913
+Revises: 7b3d9e4f1a26
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c8e2d6f913'
+down_revision = '7b3d9e4f1a26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The bot caches merged per-chat configs and drops them when it receives the chat id on tg_chat_config
+    op.execute("""
+        CREATE OR REPLACE FUNCTION tg_chat_notify_config_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('tg_chat_config', COALESCE(NEW.id, OLD.id)::text);
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER tg_chat_config_changed
+        AFTER UPDATE ON tg_chat
+        FOR EACH ROW WHEN (OLD.config::text IS DISTINCT FROM NEW.config::text)
+        EXECUTE FUNCTION tg_chat_notify_config_change()
+    """)
+    op.execute("""
+        CREATE TRIGGER tg_chat_config_inserted_or_deleted
+        AFTER INSERT OR DELETE ON tg_chat
+        FOR EACH ROW EXECUTE FUNCTION tg_chat_notify_config_change()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER tg_chat_config_inserted_or_deleted ON tg_chat")
+    op.execute("DROP TRIGGER tg_chat_config_changed ON tg_chat")
+    op.execute("DROP FUNCTION tg_chat_notify_config_change()")
@@ -0,0 +1,24 @@
+"""add background to moderation job
+
+Revision ID: a7c3e9f1d5b4
+Revises: f3a9d6b2c8e1
+Create Date: 2026-10-19 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e9f1d5b4'
+down_revision = 'f3a9d6b2c8e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('tg_moderation_job', sa.Column('background', sa.Boolean(), server_default=sa.text('false'), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('tg_moderation_job', 'background')
@@ -0,0 +1,24 @@
+"""add merged requests to moderation job
+
+Revision ID: b8d4f0a2e6c3
+Revises: a7c3e9f1d5b4
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d4f0a2e6c3'
+down_revision = 'a7c3e9f1d5b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('tg_moderation_job', sa.Column('merged_requests', sa.JSON(), server_default=sa.text("'[]'::json"), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('tg_moderation_job', 'merged_requests')
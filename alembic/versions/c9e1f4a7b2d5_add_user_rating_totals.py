@@ -0,0 +1,56 @@
+"""add user rating totals
+
+Revision ID: c9e1f4a7b2d5
+Revises: a4c8e2d6f913
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e1f4a7b2d5'
+down_revision = 'a4c8e2d6f913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('tg_user_rating_total',
+    sa.Column('user_id', sa.BigInteger(), nullable=False),
+    sa.Column('chat_id', sa.BigInteger(), nullable=False),
+    sa.Column('total', sa.BigInteger(), server_default=sa.text('0'), nullable=False),
+    sa.ForeignKeyConstraint(['chat_id'], ['tg_chat.id'], onupdate='CASCADE', ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['tg_user.id'], onupdate='CASCADE', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'chat_id', name='user_rating_total_pkey')
+    )
+    op.create_table('tg_user_group_rating_total',
+    sa.Column('user_id', sa.BigInteger(), nullable=False),
+    sa.Column('group_id', sa.Integer(), nullable=False),
+    sa.Column('total', sa.BigInteger(), server_default=sa.text('0'), nullable=False),
+    sa.ForeignKeyConstraint(['group_id'], ['tg_chat_group.id'], onupdate='CASCADE', ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['tg_user.id'], onupdate='CASCADE', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'group_id', name='user_group_rating_total_pkey')
+    )
+
+    # Backfill from the ledger; the bot must be stopped while this runs or ratings given meanwhile are lost
+    op.execute("""
+        INSERT INTO tg_user_rating_total (user_id, chat_id, total)
+        SELECT user_id, chat_id, sum(change_value)
+        FROM tg_user_rating
+        GROUP BY user_id, chat_id
+    """)
+    op.execute("""
+        INSERT INTO tg_user_group_rating_total (user_id, group_id, total)
+        SELECT r.user_id, c.group_id, sum(r.change_value)
+        FROM tg_user_rating r
+        JOIN tg_chat c ON c.id = r.chat_id
+        WHERE c.group_id IS NOT NULL
+        GROUP BY r.user_id, c.group_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('tg_user_group_rating_total')
+    op.drop_table('tg_user_rating_total')
@@ -0,0 +1,27 @@
+"""add pending message deletion index
+
+Revision ID: c9e5a1b3f7d4
+Revises: b8d4f0a2e6c3
+Create Date: 2026-10-20 00:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e5a1b3f7d4'
+down_revision = 'b8d4f0a2e6c3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_tg_message_deletion_pending', 'tg_message_deletion', ['scheduled_deletion_time'], unique=False,
+        postgresql_where=sa.text("status = 'scheduled' AND scheduled_deletion_time IS NOT NULL")
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tg_message_deletion_pending', table_name='tg_message_deletion')
@@ -0,0 +1,26 @@
+"""add rating total leaderboard indexes
+
+Revision ID: d2f7a9c3e6b8
+Revises: c9e1f4a7b2d5
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f7a9c3e6b8'
+down_revision = 'c9e1f4a7b2d5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_tg_user_rating_total_chat_id_total', 'tg_user_rating_total', ['chat_id', 'total'], unique=False)
+    op.create_index('ix_tg_user_group_rating_total_group_id_total', 'tg_user_group_rating_total', ['group_id', 'total'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tg_user_group_rating_total_group_id_total', table_name='tg_user_group_rating_total')
+    op.drop_index('ix_tg_user_rating_total_chat_id_total', table_name='tg_user_rating_total')
@@ -0,0 +1,49 @@
+"""notify on scheduled message config change
+
+Revision ID: d6f2b8e4a1c9
+Revises: c9e5a1b3f7d4
+Create Date: 2026-10-20 01:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6f2b8e4a1c9'
+down_revision = 'c9e5a1b3f7d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The dispatcher keeps the next due time of every active scheduled message in memory and reloads them when it
+    # receives a config id on tg_scheduled_message_config. Its own last_sent / error_count updates don't notify.
+    op.execute("""
+        CREATE OR REPLACE FUNCTION tg_scheduled_message_config_notify_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('tg_scheduled_message_config', COALESCE(NEW.id, OLD.id)::text);
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER tg_scheduled_message_config_changed
+        AFTER UPDATE ON tg_scheduled_message_config
+        FOR EACH ROW WHEN (
+            (OLD.status, OLD.frequency_seconds, OLD.time_of_the_day, OLD.day_of_the_week, OLD.day_of_the_month)
+            IS DISTINCT FROM
+            (NEW.status, NEW.frequency_seconds, NEW.time_of_the_day, NEW.day_of_the_week, NEW.day_of_the_month)
+        )
+        EXECUTE FUNCTION tg_scheduled_message_config_notify_change()
+    """)
+    op.execute("""
+        CREATE TRIGGER tg_scheduled_message_config_inserted_or_deleted
+        AFTER INSERT OR DELETE ON tg_scheduled_message_config
+        FOR EACH ROW EXECUTE FUNCTION tg_scheduled_message_config_notify_change()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER tg_scheduled_message_config_inserted_or_deleted ON tg_scheduled_message_config")
+    op.execute("DROP TRIGGER tg_scheduled_message_config_changed ON tg_scheduled_message_config")
+    op.execute("DROP FUNCTION tg_scheduled_message_config_notify_change()")
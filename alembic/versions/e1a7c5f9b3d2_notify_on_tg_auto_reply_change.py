@@ -0,0 +1,52 @@
+"""notify on tg_auto_reply change
+
+Revision ID: e1a7c5f9b3d2
+Revises: d6f2b8e4a1c9
+Create Date: 2026-10-20 02:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a7c5f9b3d2'
+down_revision = 'd6f2b8e4a1c9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The bot compiles each chat's auto-reply triggers once and drops them when it receives the chat id on
+    # tg_chat_config (the channel that already invalidates the chat's config). Usage updates don't notify.
+    op.execute("""
+        CREATE OR REPLACE FUNCTION tg_auto_reply_notify_change() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'UPDATE' AND OLD.chat_id IS DISTINCT FROM NEW.chat_id THEN
+                PERFORM pg_notify('tg_chat_config', OLD.chat_id::text);
+            END IF;
+            PERFORM pg_notify('tg_chat_config', COALESCE(NEW.chat_id, OLD.chat_id)::text);
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER tg_auto_reply_changed
+        AFTER UPDATE ON tg_auto_reply
+        FOR EACH ROW WHEN (
+            (OLD.chat_id, OLD.trigger, OLD.reply, OLD.reply_delay, OLD.enabled)
+            IS DISTINCT FROM
+            (NEW.chat_id, NEW.trigger, NEW.reply, NEW.reply_delay, NEW.enabled)
+        )
+        EXECUTE FUNCTION tg_auto_reply_notify_change()
+    """)
+    op.execute("""
+        CREATE TRIGGER tg_auto_reply_inserted_or_deleted
+        AFTER INSERT OR DELETE ON tg_auto_reply
+        FOR EACH ROW EXECUTE FUNCTION tg_auto_reply_notify_change()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER tg_auto_reply_inserted_or_deleted ON tg_auto_reply")
+    op.execute("DROP TRIGGER tg_auto_reply_changed ON tg_auto_reply")
+    op.execute("DROP FUNCTION tg_auto_reply_notify_change()")
@@ -0,0 +1,55 @@
+"""add moderation job tables
+
+Revision ID: e5b8c1d4f7a2
+Revises: d2f7a9c3e6b8
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8c1d4f7a2'
+down_revision = 'd2f7a9c3e6b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('tg_moderation_job',
+    sa.Column('id', sa.BigInteger(), sa.Identity(always=False, start=1, increment=1), nullable=False),
+    sa.Column('action', sa.String(), nullable=False),
+    sa.Column('user_id', sa.BigInteger(), nullable=False),
+    sa.Column('reason', sa.String(), nullable=True),
+    sa.Column('until_date', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('status', sa.String(), server_default=sa.text("'pending'::character varying"), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('lease_until', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('chats_total', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.Column('chats_done', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.Column('chats_skipped', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.Column('chats_failed', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.PrimaryKeyConstraint('id', name='moderation_job_pkey')
+    )
+    op.create_index('ix_tg_moderation_job_status', 'tg_moderation_job', ['status'], unique=False)
+    op.create_index(op.f('ix_tg_moderation_job_user_id'), 'tg_moderation_job', ['user_id'], unique=False)
+    op.create_table('tg_moderation_job_chat',
+    sa.Column('job_id', sa.BigInteger(), nullable=False),
+    sa.Column('chat_id', sa.BigInteger(), nullable=False),
+    sa.Column('status', sa.String(), server_default=sa.text("'pending'::character varying"), nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['job_id'], ['tg_moderation_job.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('job_id', 'chat_id', name='moderation_job_chat_pkey')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('tg_moderation_job_chat')
+    op.drop_index(op.f('ix_tg_moderation_job_user_id'), table_name='tg_moderation_job')
+    op.drop_index('ix_tg_moderation_job_status', table_name='tg_moderation_job')
+    op.drop_table('tg_moderation_job')
@@ -0,0 +1,33 @@
+"""add chat bot capability
+
+Revision ID: f3a9d6b2c8e1
+Revises: e5b8c1d4f7a2
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d6b2c8e1'
+down_revision = 'e5b8c1d4f7a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('tg_chat_bot_capability',
+    sa.Column('chat_id', sa.BigInteger(), nullable=False),
+    sa.Column('chat_type', sa.String(), nullable=True),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('can_restrict', sa.Boolean(), server_default=sa.text('false'), nullable=False),
+    sa.Column('can_delete', sa.Boolean(), server_default=sa.text('false'), nullable=False),
+    sa.Column('migrated_to_chat_id', sa.BigInteger(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('chat_id', name='chat_bot_capability_pkey')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('tg_chat_bot_capability')
@@ -11,6 +11,7 @@ import telegram.request
 import src.helpers.logging_helper as logging_helper
 import src.helpers.db_helper as db_helper
 import src.helpers.chat_helper as chat_helper
+import src.helpers.cache_helper as cache_helper
 
 dotenv.load_dotenv("config/.env")
 logger = logging_helper.get_logger()
@@ -26,6 +27,8 @@ bot = telegram.Bot(
     request=telegram.request.HTTPXRequest(http_version="1.1"),
 )
 
+CAS_CACHE_BANNED_SECONDS = 3000  # same as the dispatcher's CAS check
+
 CAS_PATTERN = re.compile(r"User\s+#(\d+)\s+has been CAS banned\b", re.IGNORECASE)
 
 async def main():
@@ -67,8 +70,12 @@ async def main():
                 if count:
                     logger.info(f"Marked {count} messages as spam for user {user_id}")
 
+            # With a shared cache backend the dispatcher sees the ban right away instead of a cached "ok"
+            cache_helper.set_key(f"cas_status:{user_id}", "banned", CAS_CACHE_BANNED_SECONDS, invalidate=True)
+
             try:
-                await chat_helper.mute_user(bot, 0, user_id, global_mute=True, reason="CAS-banned")
+                # The chats the user was found in are done first, the other chats follow in the background
+                await chat_helper.mute_user(bot, 0, user_id, global_mute=True, reason="CAS-banned", known_chat_ids=chat_ids)
                 logger.info(f"🚨 CAS-banned user id: {user_id} globally muted")
             except Exception as e:
                 logger.error(f"Failed to global-mute user {user_id}: {e}")
@@ -4,7 +4,7 @@ sys.path.insert(0, '../')  # add parent directory to the path
 import asyncio
 from datetime import datetime, timedelta, timezone
 import telegram
-from telegram.error import BadRequest, Forbidden
+from telegram.error import BadRequest, ChatMigrated, Forbidden
 import traceback
 import psycopg2
 import psycopg2.extras
@@ -50,23 +50,28 @@ async def admin_permissions_check():
                     await chat_helper.set_last_admin_permissions_check(chat_id, now)
 
                     # Now only chats that were not checked in the last day are processed
-                    chat_administrators = await chat_helper.get_chat_administrators(bot, chat_id)
-                    bot_is_admin = any(admin["user_id"] == bot.id for admin in chat_administrators)
+                    # The check also stores what the bot may do there, global actions skip chats where it can't act
+                    bot_member = await chat_helper.refresh_bot_capability(bot, chat_id)
 
-                    if not bot_is_admin:
+                    if bot_member.status not in chat_helper.ADMIN_STATUSES:
                         message_text = "Bot is not an admin in this chat. Please make me an admin to operate fully."
                         await chat_helper.send_message(bot, chat_id, message_text)
                         logger.info(f"Notification sent to chat {chat_name} ({chat_id}): {message_text}")
                     else:
                         logger.info(f"Bot is an admin in chat {chat_name} ({chat_id})")
+                except ChatMigrated as e:
+                    chat_helper.set_chat_migrated(chat_id, e.new_chat_id)
+                    logger.info(f"Chat {chat_name} ({chat_id}) migrated to supergroup {e.new_chat_id}.")
                 except BadRequest as e:
                     if "Chat not found" in str(e):
+                        chat_helper.set_bot_capability(chat_id, 'left')
                         logger.info(f"Chat not found for {chat_name} ({chat_id}).")
                     elif "Topic_closed" in str(e):
                         logger.info(f"Topic is closed in chat {chat_name} ({chat_id}). Skipping admin check for this chat.")
                     else:
                         logger.error(f"Error checking admin permissions for {chat_name} ({chat_id}): {e.message}")
                 except Forbidden as e:
+                    chat_helper.set_bot_capability(chat_id, 'left')
                     logger.info(f"Forbidden: Bot is not a member of the group chat {chat_name} ({chat_id}).")
                 except Exception as e:
                     logger.error(f"Unexpected error for {chat_name} ({chat_id}): {traceback.format_exc()}")
@@ -0,0 +1,153 @@
+import sys
+sys.path.insert(0, '../')  # add parent directory to the path
+
+import os
+import re
+import traceback
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+import src.helpers.db_helper as db_helper
+import src.helpers.logging_helper as logging_helper
+
+logger = logging_helper.get_logger()
+
+logger.info(f"Starting {__file__} in {os.getenv('ENV_BOT_MODE')} mode at {os.uname()}")
+
+# How many monthly partitions to keep created ahead of the current month
+PARTITIONS_AHEAD = int(os.getenv('ENV_MESSAGE_LOG_PARTITIONS_AHEAD', '3'))
+# Partitions older than this lose raw_message and image_description_embedding
+COLD_AFTER_MONTHS = int(os.getenv('ENV_MESSAGE_LOG_COLD_AFTER_MONTHS', '6'))
+# Partitions older than this are detached from tg_message_log and moved to the archive schema. 0 disables archiving
+ARCHIVE_AFTER_MONTHS = int(os.getenv('ENV_MESSAGE_LOG_ARCHIVE_AFTER_MONTHS', '24'))
+ARCHIVE_SCHEMA = os.getenv('ENV_MESSAGE_LOG_ARCHIVE_SCHEMA', 'archive')
+
+BATCH_SIZE = 5000
+COLD_MARKER = 'cold'
+
+PARTITION_NAME_RE = re.compile(r'^tg_message_log_p(\d{4})(\d{2})$')
+
+
+def add_months(month_start, months):
+    month_index = month_start.year * 12 + month_start.month - 1 + months
+    return month_start.replace(year=month_index // 12, month=month_index % 12 + 1)
+
+
+def partition_name(month_start):
+    return f"tg_message_log_p{month_start.strftime('%Y%m')}"
+
+
+def get_partitions(conn):
+    """Return {month_start: (partition_name, comment)} for the monthly partitions attached to tg_message_log."""
+    rows = conn.execute(text("""
+        SELECT c.relname, obj_description(c.oid, 'pg_class') AS comment
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'tg_message_log'::regclass
+    """)).fetchall()
+
+    partitions = {}
+    for name, comment in rows:
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            month_start = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+            partitions[month_start] = (name, comment)
+    return partitions
+
+
+def create_future_partitions(conn, partitions, current_month):
+    for offset in range(PARTITIONS_AHEAD + 1):
+        month_start = add_months(current_month, offset)
+        if month_start in partitions:
+            continue
+        name = partition_name(month_start)
+        try:
+            conn.execute(text(
+                f"CREATE TABLE {name} PARTITION OF tg_message_log "
+                f"FOR VALUES FROM ('{month_start.isoformat()}') TO ('{add_months(month_start, 1).isoformat()}')"
+            ))
+            logger.info(f"Created partition {name}")
+        except Exception:
+            # Usually means the default partition already holds rows for this month
+            logger.error(f"Could not create partition {name}: {traceback.format_exc()}")
+
+
+def compact_cold_partition(conn, name):
+    """Drop raw_message and image vectors from a cold partition in batches, then vacuum it."""
+    total = 0
+    while True:
+        updated = conn.execute(text(f"""
+            UPDATE {name} SET raw_message = NULL, image_description_embedding = NULL
+            WHERE id IN (
+                SELECT id FROM {name}
+                WHERE raw_message IS NOT NULL OR image_description_embedding IS NOT NULL
+                LIMIT :batch_size
+            )
+        """), {'batch_size': BATCH_SIZE}).rowcount
+        total += updated
+        if updated < BATCH_SIZE:
+            break
+
+    conn.execute(text(f"COMMENT ON TABLE {name} IS '{COLD_MARKER}'"))
+    conn.execute(text(f"VACUUM (ANALYZE) {name}"))
+    logger.info(f"Partition {name} moved to the cold tier, {total} rows compacted")
+
+
+def archive_partition(conn, name, month_start):
+    """Detach a partition from tg_message_log, move it to the archive schema and forget its keys."""
+    conn.execute(text(f"ALTER TABLE tg_message_log DETACH PARTITION {name}"))
+    conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+    conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+
+    deleted = 0
+    while True:
+        batch = conn.execute(text("""
+            DELETE FROM tg_message_log_key
+            WHERE (message_id, chat_id) IN (
+                SELECT message_id, chat_id FROM tg_message_log_key
+                WHERE created_at >= :month_start AND created_at < :month_end
+                LIMIT :batch_size
+            )
+        """), {
+            'month_start': month_start,
+            'month_end': add_months(month_start, 1),
+            'batch_size': BATCH_SIZE
+        }).rowcount
+        deleted += batch
+        if batch < BATCH_SIZE:
+            break
+
+    logger.info(f"Partition {name} archived to {ARCHIVE_SCHEMA}.{name}, {deleted} message keys removed")
+
+
+def maintain_partitions():
+    now = datetime.now(timezone.utc)
+    current_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    cold_before = add_months(current_month, -COLD_AFTER_MONTHS)
+    archive_before = add_months(current_month, -ARCHIVE_AFTER_MONTHS) if ARCHIVE_AFTER_MONTHS > 0 else None
+
+    # Every statement commits on its own, so long batch loops never hold one big transaction and VACUUM can run
+    with db_helper.db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        partitions = get_partitions(conn)
+        create_future_partitions(conn, partitions, current_month)
+
+        for month_start, (name, comment) in sorted(partitions.items()):
+            try:
+                if archive_before is not None and month_start < archive_before:
+                    archive_partition(conn, name, month_start)
+                elif month_start < cold_before and comment != COLD_MARKER:
+                    compact_cold_partition(conn, name)
+            except Exception:
+                logger.error(f"Error maintaining partition {name}: {traceback.format_exc()}")
+
+        default_rows = conn.execute(text("SELECT count(*) FROM tg_message_log_default")).scalar()
+        if default_rows:
+            logger.warning(f"tg_message_log_default holds {default_rows} rows, a monthly partition is missing")
+
+
+if __name__ == '__main__':
+    try:
+        maintain_partitions()
+    except Exception:
+        logger.error(f"Error during message log partition maintenance: {traceback.format_exc()}")
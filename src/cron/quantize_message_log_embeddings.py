@@ -0,0 +1,221 @@
+import sys
+sys.path.insert(0, '../')  # add parent directory to the path
+
+import os
+import traceback
+
+from sqlalchemy import text
+
+import src.helpers.db_helper as db_helper
+import src.helpers.logging_helper as logging_helper
+
+logger = logging_helper.get_logger()
+
+logger.info(f"Starting {__file__} in {os.getenv('ENV_BOT_MODE')} mode at {os.uname()}")
+
+# Switches the storage type of the tg_message_log embedding columns between `vector` (float32, 6 KB per
+# 1536-dimension value) and `halfvec` (float16, 3 KB). Readers are unaffected: db_helper.Embedding always
+# returns float32. Set ENV_EMBEDDING_STORAGE to the new type once the conversion is done.
+#
+#   python quantize_message_log_embeddings.py [convert|compact|measure] [halfvec|vector]
+#
+# convert  adds a shadow column kept in sync by a trigger, backfills it in batches (resumable), swaps it in
+#          under a short lock and rebuilds the indexes partition by partition without blocking writes
+# compact  rewrites closed partitions with VACUUM FULL so the dropped full precision values free their space
+# measure  logs table, index and per-value sizes
+COLUMNS = ('embedding', 'image_description_embedding')
+BATCH_SIZE = int(os.getenv('ENV_EMBEDDING_QUANTIZE_BATCH_SIZE', '20000'))
+STORAGE_TYPES = ('vector', 'halfvec')
+
+
+def get_column_type(conn, column):
+    return conn.execute(text("""
+        SELECT format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = 'tg_message_log'::regclass AND attname = :column AND NOT attisdropped
+    """), {'column': column}).scalar()
+
+
+def get_partitions(conn):
+    return [row[0] for row in conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'tg_message_log'::regclass
+        ORDER BY c.relname
+    """)).fetchall()]
+
+
+def add_shadow_column(column, shadow, target_type):
+    """
+    Add the shadow column and a trigger that keeps it in sync with writes made during the backfill. One
+    transaction, so every row is either already there for the backfill or written with the trigger in place.
+    """
+    with db_helper.db_engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE tg_message_log ADD COLUMN IF NOT EXISTS {shadow} {target_type}"))
+        conn.execute(text(f"""
+            CREATE OR REPLACE FUNCTION tg_message_log_sync_{shadow}() RETURNS trigger AS $$
+            BEGIN
+                NEW.{shadow} := NEW.{column}::{target_type};
+                RETURN NEW;
+            END $$ LANGUAGE plpgsql
+        """))
+        conn.execute(text(f"DROP TRIGGER IF EXISTS tg_message_log_sync_{shadow} ON tg_message_log"))
+        conn.execute(text(f"""
+            CREATE TRIGGER tg_message_log_sync_{shadow}
+            BEFORE INSERT OR UPDATE ON tg_message_log
+            FOR EACH ROW EXECUTE FUNCTION tg_message_log_sync_{shadow}()
+        """))
+
+
+def backfill_shadow_column(conn, column, shadow, target_type):
+    """Copy existing values in id ranges; already copied rows are skipped, so an interrupted run can be resumed."""
+    min_id, max_id = conn.execute(text("SELECT min(id), max(id) FROM tg_message_log")).fetchone()
+    if min_id is None:
+        return
+
+    total = 0
+    for batch_start in range(min_id, max_id + 1, BATCH_SIZE):
+        total += conn.execute(text(f"""
+            UPDATE tg_message_log SET {shadow} = {column}::{target_type}
+            WHERE id >= :batch_start AND id < :batch_end
+              AND {column} IS NOT NULL AND {shadow} IS NULL
+        """), {'batch_start': batch_start, 'batch_end': batch_start + BATCH_SIZE}).rowcount
+        if (batch_start - min_id) // BATCH_SIZE % 50 == 0:
+            logger.info(f"{column}: backfilled up to id {batch_start + BATCH_SIZE} of {max_id}, {total} rows so far")
+    logger.info(f"{column}: backfill done, {total} rows copied")
+
+
+def swap_columns(column, shadow, target_type):
+    """
+    Replace the column with its shadow. Dropping the column also drops its indexes, they are rebuilt after.
+    Nothing is copied under the lock: the trigger and the backfill already cover every row.
+    """
+    # One transaction on a separate connection, the main one runs in autocommit
+    with db_helper.db_engine.begin() as conn:
+        conn.execute(text("LOCK TABLE tg_message_log IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text(f"DROP TRIGGER tg_message_log_sync_{shadow} ON tg_message_log"))
+        conn.execute(text(f"DROP FUNCTION tg_message_log_sync_{shadow}()"))
+        conn.execute(text(f"ALTER TABLE tg_message_log DROP COLUMN {column}"))
+        conn.execute(text(f"ALTER TABLE tg_message_log RENAME COLUMN {shadow} TO {column}"))
+    logger.info(f"{column}: now stored as {target_type}")
+
+
+def create_index_concurrently(conn, index_name, definition):
+    """
+    CREATE INDEX CONCURRENTLY is not available on a partitioned table: create the parent index with ON ONLY
+    (invalid until complete), build each partition's index concurrently and attach it.
+    """
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index_name} ON ONLY tg_message_log {definition}"))
+    suffix = index_name.removeprefix('ix_tg_message_log_')
+    for partition in get_partitions(conn):
+        has_index = conn.execute(text("""
+            SELECT 1
+            FROM pg_inherits i
+            JOIN pg_index x ON x.indexrelid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:index_name) AND x.indrelid = to_regclass(:partition)
+        """), {'index_name': index_name, 'partition': partition}).scalar()
+        if has_index:
+            continue
+        child_name = f"{partition}_{suffix}"
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child_name} ON {partition} {definition}"))
+        conn.execute(text(f"ALTER INDEX {index_name} ATTACH PARTITION {child_name}"))
+    logger.info(f"Index {index_name} rebuilt")
+
+
+def rebuild_indexes(conn, column, storage):
+    # Only `embedding` is searched by similarity (find_near_duplicate_messages), the other column has no indexes
+    if column != 'embedding':
+        return
+    type_name = f"{storage}({db_helper.EMBEDDING_DIMENSIONS})"
+    create_index_concurrently(
+        conn,
+        "ix_tg_message_log_embedding_hnsw",
+        f"USING hnsw ((embedding::{type_name}) {storage}_cosine_ops) WHERE embedding IS NOT NULL"
+    )
+    create_index_concurrently(conn, 'ix_tg_message_log_embedding_not_null', "(id) WHERE embedding IS NOT NULL")
+
+
+def convert(conn, storage):
+    target_type = f"{storage}({db_helper.EMBEDDING_DIMENSIONS})"
+    for column in COLUMNS:
+        if get_column_type(conn, column) == target_type:
+            logger.info(f"{column} is already stored as {target_type}")
+        else:
+            shadow = f"{column}_{storage}"
+            add_shadow_column(column, shadow, target_type)
+            backfill_shadow_column(conn, column, shadow, target_type)
+            swap_columns(column, shadow, target_type)
+        # Also finishes the indexes of a run that was interrupted after the swap
+        rebuild_indexes(conn, column, storage)
+
+    logger.info(f"Conversion finished, set ENV_EMBEDDING_STORAGE={storage} and run 'compact' to reclaim the space")
+
+
+def compact(conn):
+    """VACUUM FULL every partition but the current and future months, which are still being written to."""
+    closed_partitions = [row[0] for row in conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'tg_message_log'::regclass
+          AND c.relname ~ '^tg_message_log_p[0-9]{6}$'
+          AND c.relname < 'tg_message_log_p' || to_char(now() AT TIME ZONE 'UTC', 'YYYYMM')
+        ORDER BY c.relname
+    """)).fetchall()]
+
+    for partition in closed_partitions:
+        try:
+            size_before = conn.execute(text("SELECT pg_total_relation_size(CAST(:p AS regclass))"), {'p': partition}).scalar()
+            conn.execute(text(f"VACUUM (FULL, ANALYZE) {partition}"))
+            size_after = conn.execute(text("SELECT pg_total_relation_size(CAST(:p AS regclass))"), {'p': partition}).scalar()
+            logger.info(f"Compacted {partition}: {size_before / 2**20:.1f} MB -> {size_after / 2**20:.1f} MB")
+        except Exception:
+            logger.error(f"Error compacting partition {partition}: {traceback.format_exc()}")
+
+
+def measure(conn):
+    partitions = get_partitions(conn)
+    table_bytes, index_bytes = conn.execute(text("""
+        SELECT sum(pg_table_size(p::regclass)), sum(pg_indexes_size(p::regclass))
+        FROM unnest(CAST(:partitions AS text[])) AS p
+    """), {'partitions': partitions}).fetchone()
+    logger.info(f"tg_message_log: {len(partitions)} partitions, table {(table_bytes or 0) / 2**30:.2f} GB, "
+                f"indexes {(index_bytes or 0) / 2**30:.2f} GB")
+
+    for column in COLUMNS:
+        avg_bytes, values = conn.execute(text(f"""
+            SELECT avg(pg_column_size({column})), count({column})
+            FROM tg_message_log TABLESAMPLE SYSTEM (1)
+        """)).fetchone()
+        logger.info(f"{column}: stored as {get_column_type(conn, column)}, "
+                    f"{avg_bytes or 0:.0f} bytes per value (1% sample of {values} values)")
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'convert'
+    storage = sys.argv[2] if len(sys.argv) > 2 else db_helper.EMBEDDING_STORAGE
+    if storage not in STORAGE_TYPES:
+        logger.error(f"Unknown embedding storage '{storage}', expected one of {STORAGE_TYPES}")
+        return
+
+    # Every statement commits on its own, CREATE INDEX CONCURRENTLY and VACUUM need it
+    with db_helper.db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if command == 'convert':
+            measure(conn)
+            convert(conn, storage)
+            measure(conn)
+        elif command == 'compact':
+            compact(conn)
+            measure(conn)
+        elif command == 'measure':
+            measure(conn)
+        else:
+            logger.error(f"Unknown command '{command}', expected convert, compact or measure")
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception:
+        logger.error(f"Error during embedding storage conversion: {traceback.format_exc()}")
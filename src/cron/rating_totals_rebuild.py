@@ -0,0 +1,26 @@
+import sys
+sys.path.insert(0, '../')  # add parent directory to the path
+
+import os
+import traceback
+
+import src.helpers.rating_helper as rating_helper
+import src.helpers.logging_helper as logging_helper
+
+logger = logging_helper.get_logger()
+
+logger.info(f"Starting {__file__} in {os.getenv('ENV_BOT_MODE')} mode at {os.uname()}")
+
+# Brings tg_user_rating_total / tg_user_group_rating_total back in line with the tg_user_rating ledger.
+# Run it after changing a chat's group_id; running it at any other time only reports drift.
+
+if __name__ == '__main__':
+    try:
+        fixed = rating_helper.rebuild_rating_totals()
+        for table, rows in fixed.items():
+            if rows:
+                logger.warning(f"{table}: {rows} rows did not match the rating ledger and were fixed")
+            else:
+                logger.info(f"{table}: consistent with the rating ledger")
+    except Exception:
+        logger.error(f"Error during rating totals rebuild: {traceback.format_exc()}")
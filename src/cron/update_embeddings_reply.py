@@ -2,8 +2,6 @@ import sys
 sys.path.insert(0, '../') # add parent directory to the pat
 
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
 import openai
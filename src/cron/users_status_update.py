@@ -46,7 +46,8 @@ async def status_update():
 
     updates = []
 
-    with db_helper.connect() as conn:
+    # Sampling users and their statuses is a read the replica can serve; only the status changes go to the primary
+    with db_helper.read_replica(), db_helper.connect() as conn:
         with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
             sql = "SELECT id FROM tg_user ORDER BY RANDOM() LIMIT 1000"
             cur.execute(sql)
@@ -58,49 +59,48 @@ async def status_update():
             cur.execute(user_status_sql, (user_ids,))
             user_status_rows = cur.fetchall()
 
-            for user_status_row in user_status_rows:
-                user_display = user_dict.get(user_status_row['user_id']) or user_status_row['user_id']
-                chat_id = user_status_row['chat_id']
-                user_id = user_status_row['user_id']
-                try:
-                    chat_member = await bot.get_chat_member(chat_id, user_id)
-                    status = chat_member.status
-
-                    if status != user_status_row['status']:
-                        updates.append((status, user_id, chat_id))
-                        logger.debug(f"(get_chat_member) Status change detected for user {'@' if not (isinstance(user_display, int) or user_display.isdigit()) else ''}{user_display} in chat {chat_id} to {status}")
-                except BadRequest as bad_request_error:
-                    error_message = str(bad_request_error)
-                    where = f"(get_chat_member, chat_id={chat_id}, user_id={user_id})"
-                    if "User not found" in error_message:
-                        updates.append(("User not found", user_id, chat_id))
-                        logger.debug(f"{where} User not found: {error_message}")
-                    elif "Chat not found" in error_message:
-                        logger.debug(f"{where} Chat not found: {error_message}")
-                    elif "Member not found" in error_message:
-                        updates.append(("Member not found", user_id, chat_id))
-                        logger.debug(f"{where} Member not found: {error_message}")
-                    elif "Participant_id_invalid" in error_message:
-                        updates.append(("Participant ID invalid", user_id, chat_id))
-                        logger.debug(f"{where} Participant ID invalid: {error_message}")
-                    elif "Chat_admin_required" in error_message:
-                        logger.debug(f"{where} Chat_admin_required - not an error: {error_message}")
-                    else:
-                        logger.error(f"{where} BadRequest error: {traceback.format_exc()}")
-                except Forbidden as forbidden_error:
-                    where = f"(get_chat_member, chat_id={chat_id}, user_id={user_id})"
-                    logger.debug(f"{where} Forbidden: {forbidden_error}")
-                except Exception:
-                    where = f"(get_chat_member, chat_id={chat_id}, user_id={user_id})"
-                    logger.error(f"{where} Exception: {traceback.format_exc()}")
-
-            if updates:
+    for user_status_row in user_status_rows:
+        user_display = user_dict.get(user_status_row['user_id']) or user_status_row['user_id']
+        chat_id = user_status_row['chat_id']
+        user_id = user_status_row['user_id']
+        try:
+            chat_member = await bot.get_chat_member(chat_id, user_id)
+            status = chat_member.status
+
+            if status != user_status_row['status']:
+                updates.append((status, user_id, chat_id))
+                logger.debug(f"(get_chat_member) Status change detected for user {'@' if not (isinstance(user_display, int) or user_display.isdigit()) else ''}{user_display} in chat {chat_id} to {status}")
+        except BadRequest as bad_request_error:
+            error_message = str(bad_request_error)
+            where = f"(get_chat_member, chat_id={chat_id}, user_id={user_id})"
+            if "User not found" in error_message:
+                updates.append(("User not found", user_id, chat_id))
+                logger.debug(f"{where} User not found: {error_message}")
+            elif "Chat not found" in error_message:
+                logger.debug(f"{where} Chat not found: {error_message}")
+            elif "Member not found" in error_message:
+                updates.append(("Member not found", user_id, chat_id))
+                logger.debug(f"{where} Member not found: {error_message}")
+            elif "Participant_id_invalid" in error_message:
+                updates.append(("Participant ID invalid", user_id, chat_id))
+                logger.debug(f"{where} Participant ID invalid: {error_message}")
+            elif "Chat_admin_required" in error_message:
+                logger.debug(f"{where} Chat_admin_required - not an error: {error_message}")
+            else:
+                logger.error(f"{where} BadRequest error: {traceback.format_exc()}")
+        except Forbidden as forbidden_error:
+            where = f"(get_chat_member, chat_id={chat_id}, user_id={user_id})"
+            logger.debug(f"{where} Forbidden: {forbidden_error}")
+        except Exception:
+            where = f"(get_chat_member, chat_id={chat_id}, user_id={user_id})"
+            logger.error(f"{where} Exception: {traceback.format_exc()}")
+
+    if updates:
+        with db_helper.connect() as conn:
+            with conn.cursor() as cur:
                 user_update_sql = "UPDATE tg_user_status set status = %s WHERE user_id = %s AND chat_id = %s"
                 cur.executemany(user_update_sql, updates)
 
-            conn.commit()
-
-
 
 
 async def main() -> None:
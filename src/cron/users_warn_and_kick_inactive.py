@@ -26,7 +26,7 @@ bot = telegram.Bot(token=os.getenv('ENV_BOT_KEY'),
 
 async def warn_inactive(chat_id, inactivity_period_in_days_to_warn):
     try:
-        with db_helper.session_scope() as session:
+        with db_helper.read_replica(), db_helper.session_scope() as session:
             inactive_users = session.query(db_helper.User_Status).filter(
                 and_(
                     db_helper.User_Status.last_message_datetime < datetime.now() - timedelta(days=inactivity_period_in_days_to_warn),
@@ -36,7 +36,7 @@ async def warn_inactive(chat_id, inactivity_period_in_days_to_warn):
                 )
             ).all()
 
-            mentions = [user_helper.get_user_mention(user.user.id) for user in inactive_users]
+            mentions = list(user_helper.get_user_mentions([user.user_id for user in inactive_users]).values())
             joined_mentions = ', '.join(mentions[:-1]) + f" and {mentions[-1]}" if mentions else ""
             warn_text = f"❗️ List of potential inactive candidates for deletion this month: {joined_mentions}. ..."
             await bot.send_message(chat_id=chat_id, text=warn_text)
@@ -54,9 +54,10 @@ async def kick_inactive(chat_id, inactivity_period_in_days_to_kick):
                 )
             ).all()
 
+            mentions = user_helper.get_user_mentions([user_status.user_id for user_status in inactive_users])
             for user_status in inactive_users:
                 try:
-                    user_mention = user_helper.get_user_mention(user_status.user.id)
+                    user_mention = mentions[user_status.user_id]
                     await bot.ban_chat_member(chat_id, user_status.user_id)
                     await bot.send_message(chat_id,f"User {user_mention} was kicked for inactivity")
                     user_status.status = 'kicked' # Updating the user status after they're kicked
@@ -15,7 +15,8 @@ def sentry_profile(name=None):
         @functools.wraps(func)
         async def wrapper(*args, **kwargs):
             tx_name = name or func.__name__
-            with sentry_sdk.start_transaction(name=tx_name):
+            update_id = getattr(args[0], 'update_id', None) if args else None
+            with sentry_sdk.start_transaction(name=tx_name), db_helper.query_scope(tx_name, update_id):
                 return await func(*args, **kwargs)
         return wrapper
     return decorator
@@ -37,7 +38,7 @@ import ssl
 import signal
 import sys
 import json
-from re import findall
+import time
 import logging
 
 from langdetect import detect
@@ -48,13 +49,20 @@ import src.helpers.logging_helper as logging_helper
 import src.helpers.openai_helper as openai_helper
 import src.helpers.chat_helper as chat_helper
 import src.helpers.db_helper as db_helper
+import src.helpers.db_pool_helper as db_pool_helper
 import src.helpers.user_helper as user_helper
 import src.helpers.rating_helper as rating_helper
+import src.helpers.leaderboard_helper as leaderboard_helper
 import src.helpers.reporting_helper as reporting_helper
 import src.helpers.message_helper as message_helper
 import src.helpers.spamcheck_helper as spamcheck_helper
 import src.helpers.embeddings_reply_helper as embeddings_reply_helpero
 import src.helpers.cache_helper as cache_helper
+import src.helpers.fanout_helper as fanout_helper
+import src.helpers.deletion_helper as deletion_helper
+import src.helpers.scheduled_message_helper as scheduled_message_helper
+import src.helpers.keyword_helper as keyword_helper
+import src.helpers.auto_reply_helper as auto_reply_helper
 import src.helpers.trigger_action_helper as trigger_action_helper
 
 logger = logging_helper.get_logger()
@@ -89,6 +97,7 @@ async def tg_help(update, context):
         user_commands = [
             "/report or /r - Report a message (reply to message)",
             "/get_rating or /gr - Get user rating (reply to message or specify @username)",
+            "/top [N] - Show the N highest rated users (default 10)",
             "/help or /h - Show this help message",
             "/info or /i - Show bot information",
             "/ping - Check bot status"
@@ -165,8 +174,8 @@ async def tg_report(update, context):
         if message:
             await chat_helper.schedule_message_deletion(chat_id, message.message_id, message.from_user.id, trigger_id=reported_message_id, delay_seconds=2 * 60 * 60)  # use reported_message_id as trigger_id
 
-        chat_administrators = await chat_helper.get_chat_administrators(context.bot, chat_id)
-        if any(admin["user_id"] == reported_user_id for admin in chat_administrators):
+        admin_ids = await chat_helper.get_chat_admin_ids(context.bot, chat_id)
+        if reported_user_id in admin_ids:
             await chat_helper.send_message(context.bot, chat_id, "You cannot report an admin.", delete_after=120)
             return
 
@@ -175,7 +184,7 @@ async def tg_report(update, context):
         report_power = 1 if user_rating_to_power_ratio == 0 else max(1, reporting_user_rating // user_rating_to_power_ratio)
 
         # Check if the reporting user is not an admin (if he is an admin he can report several times)
-        if not any(admin["user_id"] == reporting_user_id for admin in chat_administrators):
+        if reporting_user_id not in admin_ids:
             # If the reported user has already been reported by the reporting user, send a message and return
             if await reporting_helper.check_existing_report(chat_id, reported_user_id, reporting_user_id):
                 await chat_helper.send_message(context.bot, chat_id, "This user has already been reported by you.", reply_to_message_id=message.message_id, delete_after=120)
@@ -194,7 +203,9 @@ async def tg_report(update, context):
         number_of_reports_to_warn = int(chat_helper.get_chat_config(chat_id, 'number_of_reports_to_warn'))
         number_of_reports_to_ban = int(chat_helper.get_chat_config(chat_id, 'number_of_reports_to_ban'))
 
-        reported_user_mention = user_helper.get_user_mention(reported_user_id, chat_id)
+        mentions = user_helper.get_user_mentions([reported_user_id, reporting_user_id], chat_id)
+        reported_user_mention = mentions[reported_user_id]
+        reporting_user_mention = mentions[reporting_user_id]
         chat_mention = await chat_helper.get_chat_mention(context.bot, chat_id)
 
         # Get spam detection info from message log
@@ -213,7 +224,7 @@ async def tg_report(update, context):
 
         # Inform admins about the report
         report_text = (
-            f"User {reported_user_mention} has been reported by {user_helper.get_user_mention(reporting_user_id, chat_id)} "
+            f"User {reported_user_mention} has been reported by {reporting_user_mention} "
             f"in chat {chat_mention} {report_sum}/{number_of_reports_to_ban} times."
             f"{spam_prob_text}"
             f"\nReported message (ID: {reported_message_id}): {reported_message_content}"
@@ -236,7 +247,7 @@ async def tg_report(update, context):
             reply_markup=report_keyboard
         )
         logger.info(
-            f"User {reported_user_id} has been reported by {user_helper.get_user_mention(reporting_user_id, chat_id)} in chat {chat_id} {report_sum}/{number_of_reports_to_ban} times. Reported message: {reported_message_content}"
+            f"User {reported_user_id} has been reported by {reporting_user_mention} in chat {chat_id} {report_sum}/{number_of_reports_to_ban} times. Reported message: {reported_message_content}"
         )
 
         if report_sum >= number_of_reports_to_ban:
@@ -343,7 +354,7 @@ async def tg_info(update, context):
         message = update.message
 
         #delete the command message after 120 seconds
-        asyncio.create_task(chat_helper.delete_message(context.bot, chat_id, message.message_id, delay_seconds=60))
+        await chat_helper.delete_message(context.bot, chat_id, message.message_id, delay_seconds=60)
 
         # determine target_user_id
         is_dm = update.effective_chat.type == "private"
@@ -420,7 +431,7 @@ async def tg_offtop(update, context):
     try:
         chat_id = update.effective_chat.id
         message = update.message
-        admin_ids = [admin["user_id"] for admin in await chat_helper.get_chat_administrators(bot, chat_id)]
+        admin_ids = await chat_helper.get_chat_admin_ids(bot, chat_id)
 
         await chat_helper.delete_message(bot, chat_id, message.message_id, delay_seconds=120)  # clean up the command message
 
@@ -456,8 +467,9 @@ async def tg_offtop(update, context):
 
             number_of_reports_to_ban = int(chat_helper.get_chat_config(chat_id, 'number_of_reports_to_ban'))
 
-            warned_user_mention = user_helper.get_user_mention(warned_user_id, chat_id)
-            warning_admin_mention = user_helper.get_user_mention(message.from_user.id, chat_id)
+            mentions = user_helper.get_user_mentions([warned_user_id, message.from_user.id], chat_id)
+            warned_user_mention = mentions[warned_user_id]
+            warning_admin_mention = mentions[message.from_user.id]
 
             if warn_count >= number_of_reports_to_ban:
                 await chat_helper.delete_media_group_messages(bot, chat_id, message.reply_to_message)
@@ -499,8 +511,7 @@ async def tg_set_report(update, context):
         message = update.message
 
         # Verify if the command issuer is an administrator
-        chat_administrators = await chat_helper.get_chat_administrators(context.bot, chat_id)
-        is_admin = any(admin["user_id"] == message.from_user.id for admin in chat_administrators)
+        is_admin = await chat_helper.is_chat_admin(context.bot, chat_id, message.from_user.id)
         if not is_admin:
             await chat_helper.send_message(context.bot, chat_id, "You must be an admin to use this command.", reply_to_message_id=message.message_id, delete_after=120)
             return
@@ -556,8 +567,7 @@ async def tg_ur(update, context):
         message = update.message
 
         # Verify if the command issuer is an administrator
-        chat_administrators = await chat_helper.get_chat_administrators(context.bot, chat_id)
-        is_admin = any(admin["user_id"] == message.from_user.id for admin in chat_administrators)
+        is_admin = await chat_helper.is_chat_admin(context.bot, chat_id, message.from_user.id)
         if not is_admin:
             await chat_helper.send_message(context.bot, chat_id, "You must be an admin to use this command.", reply_to_message_id=message.message_id, delete_after=120)
             return
@@ -632,7 +642,7 @@ async def tg_warn(update, context):
         with sentry_sdk.start_span(op="warn_admins", description="Get chat administrators"):
             chat_id = update.effective_chat.id
             message = update.message
-            admin_ids = [admin["user_id"] for admin in await chat_helper.get_chat_administrators(bot, chat_id)]
+            admin_ids = await chat_helper.get_chat_admin_ids(bot, chat_id)
 
         with sentry_sdk.start_span(op="warn_delete_command_msg", description="Delete command message"):
             await chat_helper.delete_message(bot, chat_id, message.message_id, delay_seconds=120)  # clean up the command message
@@ -671,8 +681,9 @@ async def tg_warn(update, context):
 
                 number_of_reports_to_ban = int(chat_helper.get_chat_config(chat_id, 'number_of_reports_to_ban'))
 
-                warned_user_mention = user_helper.get_user_mention(warned_user_id, chat_id)
-                warning_admin_mention = user_helper.get_user_mention(message.from_user.id, chat_id)
+                mentions = user_helper.get_user_mentions([warned_user_id, message.from_user.id], chat_id)
+                warned_user_mention = mentions[warned_user_id]
+                warning_admin_mention = mentions[message.from_user.id]
 
                 if warn_count >= number_of_reports_to_ban:
                     with sentry_sdk.start_span(op="warn_ban", description="Ban and notify"):
@@ -721,10 +732,10 @@ async def tg_ban(update, context):
             await chat_helper.delete_message(bot, chat_id, message.message_id)  # clean up the command message
 
             # Check if the command was sent by an admin of the chat
-            chat_administrators = await chat_helper.get_chat_administrators(bot, chat_id)
+            admin_ids = await chat_helper.get_chat_admin_ids(bot, chat_id)
 
             # TODO:MED: We should find the way how to identify admin if he answers from channel
-            if message.from_user.id not in [admin["user_id"] for admin in chat_administrators]:
+            if message.from_user.id not in admin_ids:
                 await chat_helper.send_message(bot, chat_id, "You must be an admin to use this command.", reply_to_message_id=message.message_id, delete_after=120)
                 return
 
@@ -751,10 +762,9 @@ async def tg_ban(update, context):
                 await chat_helper.delete_media_group_messages(bot, chat_id, message.reply_to_message)
 
             # Check if the user to ban is an admin of the chat
-            for admin in chat_administrators:
-                if admin["user_id"] == ban_user_id:
-                    await message.reply_text("You cannot ban an admin.")
-                    return
+            if ban_user_id in admin_ids:
+                await message.reply_text("You cannot ban an admin.")
+                return
 
             # Determine the content of the reported message: Use text if available, otherwise use caption
             reported_message_content = message.reply_to_message.text or message.reply_to_message.caption
@@ -783,6 +793,49 @@ async def tg_ban(update, context):
         update_str = json.dumps(update.to_dict() if hasattr(update, 'to_dict') else {'info': 'Update object has no to_dict method'}, indent=4, sort_keys=True, default=str)
         logger.error(f"Error: {traceback.format_exc()} | Update: {update_str}")
 
+async def sweep_near_duplicate_spam(bot, source_chat_id, source_message_id, target_user_id, reason):
+    """
+    Mark messages of other users that are near-duplicates of a spam message as verified spam and delete the ones
+    from the last 24 hours. Returns (marked_count, deleted_count); both are 0 for messages without text.
+    """
+    # The spam message itself is read from the primary, it may have been logged seconds ago
+    with db_helper.session_scope() as session:
+        source_log = session.query(
+            db_helper.Message_Log.message_content,
+            db_helper.Message_Log.embedding
+        ).filter(
+            db_helper.Message_Log.message_id == source_message_id,
+            db_helper.Message_Log.chat_id == source_chat_id
+        ).first()
+
+    if not source_log or source_log.embedding is None or not (source_log.message_content or '').strip():
+        return 0, 0
+
+    started_at = time.perf_counter()
+    near_duplicates = message_helper.find_near_duplicate_messages(source_log.embedding, exclude_user_id=target_user_id)
+    lookup_ms = (time.perf_counter() - started_at) * 1000
+
+    message_helper.relabel_messages(
+        [dict(log_data, reason_for_action=f"{reason} (cosine distance {log_data['distance']:.4f})") for log_data in near_duplicates],
+        is_spam=True,
+        manually_verified=True
+    )
+
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=24)
+    deleted_count = await chat_helper.delete_messages(bot, [
+        (log_data["chat_id"], log_data["message_id"])
+        for log_data in near_duplicates
+        if log_data["created_at"] is not None and log_data["created_at"] >= cutoff
+    ])
+
+    if near_duplicates:
+        logger.info(
+            f"Marked {len(near_duplicates)} near-duplicates of message {source_message_id} in chat {source_chat_id} as spam "
+            f"(max distance {near_duplicates[-1]['distance']:.4f}, lookup {lookup_ms:.1f} ms), deleted {deleted_count}"
+        )
+    return len(near_duplicates), deleted_count
+
+
 @sentry_profile()
 async def tg_spam(update, context):
     try:
@@ -797,8 +850,7 @@ async def tg_spam(update, context):
         is_chat_admin = False
 
         if not is_global:
-            chat_administrators = await chat_helper.get_chat_administrators(bot, chat_id)
-            is_chat_admin = invoker_user_id in [admin["user_id"] for admin in chat_administrators]
+            is_chat_admin = await chat_helper.is_chat_admin(bot, chat_id, invoker_user_id)
 
         if not is_global and not is_chat_admin:
             await chat_helper.send_message(
@@ -856,113 +908,34 @@ async def tg_spam(update, context):
             )
 
             # Mark ALL messages from this user as verified spam
-            with db_helper.session_scope() as session:
-                logs = session.query(db_helper.Message_Log).filter(
-                    db_helper.Message_Log.user_id == target_user_id
-                ).all()
-                logs_data = [
-                    {"chat_id": log.chat_id, "message_id": log.message_id}
-                    for log in logs
-                ]
-            for log_data in logs_data:
-                message_helper.insert_or_update_message_log(
-                    chat_id=log_data["chat_id"],
-                    message_id=log_data["message_id"],
-                    user_id=target_user_id,
-                    is_spam=True,
-                    manually_verified=True,
-                    reason_for_action="User was globally banned due to /spam command issued by global admin"
-                )
+            logs_data = message_helper.relabel_user_messages(
+                target_user_id,
+                is_spam=True,
+                manually_verified=True,
+                reason_for_action="User was globally banned due to /spam command issued by global admin"
+            )
 
-            # Find and mark messages with identical embeddings from other users (global admin only)
-            identical_embedding_logs_data = []
+            # Find and mark near-duplicates of the replied message sent by other users (global admin only)
+            near_duplicates_count, near_duplicates_deleted_count = 0, 0
             if replied_message_id and replied_chat_id:
-                with db_helper.session_scope() as session:
-                    replied_log = session.query(db_helper.Message_Log).filter(
-                        db_helper.Message_Log.message_id == replied_message_id,
-                        db_helper.Message_Log.chat_id == replied_chat_id
-                    ).first()
-
-                    has_text_content = (
-                        replied_log and
-                        replied_log.message_content and
-                        replied_log.message_content.strip()
-                    )
-
-                    if replied_log and replied_log.embedding is not None and has_text_content:
-                        matching_logs = session.query(db_helper.Message_Log).filter(
-                            db_helper.Message_Log.embedding == replied_log.embedding,
-                            db_helper.Message_Log.user_id != target_user_id
-                        ).all()
-
-                        identical_embedding_logs_data = [
-                            {"chat_id": log.chat_id, "message_id": log.message_id, "user_id": log.user_id}
-                            for log in matching_logs
-                        ]
-
-                for log_data in identical_embedding_logs_data:
-                    message_helper.insert_or_update_message_log(
-                        chat_id=log_data["chat_id"],
-                        message_id=log_data["message_id"],
-                        user_id=log_data["user_id"],
-                        is_spam=True,
-                        manually_verified=True,
-                        reason_for_action="Message has identical embedding to spam message marked via /spam command"
-                    )
-                if identical_embedding_logs_data:
-                    logger.info(f"Marked {len(identical_embedding_logs_data)} messages with identical embeddings as spam")
+                near_duplicates_count, near_duplicates_deleted_count = await sweep_near_duplicate_spam(
+                    context.bot,
+                    replied_chat_id,
+                    replied_message_id,
+                    target_user_id,
+                    reason="Message is a near-duplicate of a spam message marked via /spam command"
+                )
 
             # Delete recent messages (last 24 hours) from all chats
-            cutoff = datetime.now() - timedelta(hours=24)
-            with db_helper.session_scope() as session:
-                recent_logs = session.query(db_helper.Message_Log).filter(
-                    db_helper.Message_Log.user_id == target_user_id,
-                    db_helper.Message_Log.created_at >= cutoff
-                ).all()
-                recent_logs_data = [
-                    {"chat_id": log.chat_id, "message_id": log.message_id}
-                    for log in recent_logs
-                ]
-            for log_data in recent_logs_data:
-                try:
-                    await chat_helper.delete_message(context.bot, log_data["chat_id"], log_data["message_id"])
-                except Exception as exc:
-                    logger.error(f"Error deleting message {log_data['message_id']} in chat {log_data['chat_id']}: {exc}")
-
-            # Delete recent messages with identical embeddings
-            recent_identical_data = []
-            if identical_embedding_logs_data:
-                with db_helper.session_scope() as session:
-                    identical_message_ids = [log["message_id"] for log in identical_embedding_logs_data]
-                    identical_chat_ids = [log["chat_id"] for log in identical_embedding_logs_data]
-
-                    recent_identical_logs = session.query(db_helper.Message_Log).filter(
-                        db_helper.Message_Log.message_id.in_(identical_message_ids),
-                        db_helper.Message_Log.chat_id.in_(identical_chat_ids),
-                        db_helper.Message_Log.created_at >= cutoff
-                    ).all()
-
-                    recent_identical_data = [
-                        {"chat_id": log.chat_id, "message_id": log.message_id}
-                        for log in recent_identical_logs
-                    ]
-
-                for log_data in recent_identical_data:
-                    try:
-                        await chat_helper.delete_message(context.bot, log_data["chat_id"], log_data["message_id"])
-                    except Exception as exc:
-                        logger.error(f"Error deleting identical embedding message {log_data['message_id']} in chat {log_data['chat_id']}: {exc}")
-
-                if recent_identical_data:
-                    logger.info(f"Deleted {len(recent_identical_data)} recent messages with identical embeddings")
+            cutoff = datetime.now(timezone.utc) - timedelta(hours=24)
+            recent_logs_data = [log_data for log_data in logs_data if log_data["created_at"] >= cutoff]
+            await chat_helper.delete_messages(context.bot, [(log_data["chat_id"], log_data["message_id"]) for log_data in recent_logs_data])
 
             target_mention = user_helper.get_user_mention(target_user_id, chat_id)
 
             # Send summary DM to global admins
             same_user_messages_count = len(logs_data)
             same_user_deleted_count = len(recent_logs_data)
-            identical_messages_count = len(identical_embedding_logs_data)
-            identical_deleted_count = len(recent_identical_data)
 
             summary_lines = [
                 f"<b>Spam command executed (global)</b>",
@@ -974,10 +947,10 @@ async def tg_spam(update, context):
                 f"Same user: {same_user_messages_count} marked, {same_user_deleted_count} deleted",
             ]
 
-            if identical_messages_count > 0:
-                summary_lines.append(f"Identical (other users): {identical_messages_count} marked, {identical_deleted_count} deleted")
+            if near_duplicates_count > 0:
+                summary_lines.append(f"Near-duplicates (other users): {near_duplicates_count} marked, {near_duplicates_deleted_count} deleted")
             elif replied_message_id:
-                summary_lines.append(f"Identical (other users): none found")
+                summary_lines.append(f"Near-duplicates (other users): none found")
 
             summary_text = "\n".join(summary_lines)
 
@@ -999,42 +972,18 @@ async def tg_spam(update, context):
             )
 
             # Mark messages from this user in THIS CHAT ONLY as spam (not verified)
-            with db_helper.session_scope() as session:
-                logs = session.query(db_helper.Message_Log).filter(
-                    db_helper.Message_Log.user_id == target_user_id,
-                    db_helper.Message_Log.chat_id == chat_id
-                ).all()
-                logs_data = [
-                    {"chat_id": log.chat_id, "message_id": log.message_id}
-                    for log in logs
-                ]
-            for log_data in logs_data:
-                message_helper.insert_or_update_message_log(
-                    chat_id=log_data["chat_id"],
-                    message_id=log_data["message_id"],
-                    user_id=target_user_id,
-                    is_spam=True,
-                    manually_verified=False,  # Chat admin spam is NOT verified
-                    reason_for_action="User was banned in chat due to /spam command issued by chat admin"
-                )
+            logs_data = message_helper.relabel_user_messages(
+                target_user_id,
+                is_spam=True,
+                manually_verified=False,  # Chat admin spam is NOT verified
+                reason_for_action="User was banned in chat due to /spam command issued by chat admin",
+                chat_id=chat_id
+            )
 
             # Delete recent messages (last 24 hours) from THIS CHAT ONLY
-            cutoff = datetime.now() - timedelta(hours=24)
-            with db_helper.session_scope() as session:
-                recent_logs = session.query(db_helper.Message_Log).filter(
-                    db_helper.Message_Log.user_id == target_user_id,
-                    db_helper.Message_Log.chat_id == chat_id,
-                    db_helper.Message_Log.created_at >= cutoff
-                ).all()
-                recent_logs_data = [
-                    {"chat_id": log.chat_id, "message_id": log.message_id}
-                    for log in recent_logs
-                ]
-            for log_data in recent_logs_data:
-                try:
-                    await chat_helper.delete_message(context.bot, log_data["chat_id"], log_data["message_id"])
-                except Exception as exc:
-                    logger.error(f"Error deleting message {log_data['message_id']} in chat {log_data['chat_id']}: {exc}")
+            cutoff = datetime.now(timezone.utc) - timedelta(hours=24)
+            recent_logs_data = [log_data for log_data in logs_data if log_data["created_at"] >= cutoff]
+            await chat_helper.delete_messages(context.bot, [(log_data["chat_id"], log_data["message_id"]) for log_data in recent_logs_data])
 
             target_mention = user_helper.get_user_mention(target_user_id, chat_id)
 
@@ -1096,8 +1045,7 @@ async def tg_spam_callback(update, context):
     is_global_admin = user_helper.is_global_admin(admin_id)
 
     if not is_global_admin:
-        chat_administrators = await chat_helper.get_chat_administrators(context.bot, chat_id)
-        is_chat_admin = any(admin["user_id"] == admin_id for admin in chat_administrators)
+        is_chat_admin = await chat_helper.is_chat_admin(context.bot, chat_id, admin_id)
         if not is_chat_admin:
             await query.answer("❌ Not authorized", show_alert=True)
             return
@@ -1120,49 +1068,39 @@ async def tg_spam_callback(update, context):
         )
 
         # 2. Mark all messages from this user as spam with manually_verified=True
-        with db_helper.session_scope() as session:
-            logs = session.query(db_helper.Message_Log).filter(
-                db_helper.Message_Log.user_id == target_user_id
-            ).all()
-            logs_data = [
-                {"chat_id": log.chat_id, "message_id": log.message_id}
-                for log in logs
-            ]
-        for log_data in logs_data:
-            message_helper.insert_or_update_message_log(
-                chat_id=log_data["chat_id"],
-                message_id=log_data["message_id"],
-                user_id=target_user_id,
-                is_spam=True,
-                manually_verified=True,
-                reason_for_action="User was globally banned via spam button from report notification"
+        logs_data = message_helper.relabel_user_messages(
+            target_user_id,
+            is_spam=True,
+            manually_verified=True,
+            reason_for_action="User was globally banned via spam button from report notification"
+        )
+
+        # 3. Global admins also sweep near-duplicates of the reported message sent by other users
+        near_duplicates_count = 0
+        if is_global_admin:
+            near_duplicates_count, _ = await sweep_near_duplicate_spam(
+                context.bot,
+                chat_id,
+                reported_message_id,
+                target_user_id,
+                reason="Message is a near-duplicate of a spam message marked via report button"
             )
 
-        # 3. Delete messages less than 24 hours old
-        cutoff = datetime.now() - timedelta(hours=24)
-        with db_helper.session_scope() as session:
-            recent_logs = session.query(db_helper.Message_Log).filter(
-                db_helper.Message_Log.user_id == target_user_id,
-                db_helper.Message_Log.created_at >= cutoff
-            ).all()
-            recent_logs_data = [
-                {"chat_id": log.chat_id, "message_id": log.message_id}
-                for log in recent_logs
-            ]
-        deleted_count = 0
-        for log_data in recent_logs_data:
-            try:
-                await chat_helper.delete_message(context.bot, log_data["chat_id"], log_data["message_id"])
-                deleted_count += 1
-            except Exception as exc:
-                logger.error(f"Error deleting message {log_data['message_id']} in chat {log_data['chat_id']}: {exc}")
+        # 4. Delete messages less than 24 hours old
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=24)
+        deleted_count = await chat_helper.delete_messages(context.bot, [
+            (log_data["chat_id"], log_data["message_id"])
+            for log_data in logs_data
+            if log_data["created_at"] >= cutoff
+        ])
 
-        # 4. Update button to show success
+        # 5. Update button to show success
         admin_mention = user_helper.get_user_mention(admin_id, chat_id)
-        success_keyboard = InlineKeyboardMarkup([[InlineKeyboardButton(f"✅ Spam ({len(logs_data)} msgs, {deleted_count} del)", callback_data="noop")]])
+        near_duplicates_text = f", {near_duplicates_count} similar" if near_duplicates_count else ""
+        success_keyboard = InlineKeyboardMarkup([[InlineKeyboardButton(f"✅ Spam ({len(logs_data)} msgs, {deleted_count} del{near_duplicates_text})", callback_data="noop")]])
         await query.edit_message_reply_markup(reply_markup=success_keyboard)
 
-        logger.info(f"Admin {admin_id} marked user {target_user_id} as spam via report button. {len(logs_data)} messages marked, {deleted_count} deleted.")
+        logger.info(f"Admin {admin_id} marked user {target_user_id} as spam via report button. {len(logs_data)} messages marked, {deleted_count} deleted, {near_duplicates_count} near-duplicates marked.")
 
     except Exception as e:
         logger.error(f"Error in tg_spam_callback: {traceback.format_exc()}")
@@ -1196,8 +1134,7 @@ async def tg_notspam_callback(update, context):
     is_global_admin = user_helper.is_global_admin(admin_id)
 
     if not is_global_admin:
-        chat_administrators = await chat_helper.get_chat_administrators(context.bot, chat_id)
-        is_chat_admin = any(admin["user_id"] == admin_id for admin in chat_administrators)
+        is_chat_admin = await chat_helper.is_chat_admin(context.bot, chat_id, admin_id)
         if not is_chat_admin:
             await query.answer("❌ Not authorized", show_alert=True)
             return
@@ -1298,25 +1235,8 @@ async def tg_unspam(update, context):
         await chat_helper.unmute_user(context.bot, chat_id, target_user_id, global_unmute=True)
         logger.info(f"User {target_user_id} has been unmuted globally.")
 
-        # Step 3: Update all message logs for the user.
-        # Materialize the log values from a session before closing it.
-        with db_helper.session_scope() as session:
-            logs = session.query(db_helper.Message_Log).filter(
-                db_helper.Message_Log.user_id == target_user_id,
-                db_helper.Message_Log.manually_verified == False
-            ).all()
-            logs_data = [
-                {"chat_id": log.chat_id, "message_id": log.message_id}
-                for log in logs
-            ]
-        # Now update each log without needing the detached ORM objects.
-        for log_data in logs_data:
-            message_helper.insert_or_update_message_log(
-                chat_id=log_data["chat_id"],
-                message_id=log_data["message_id"],
-                is_spam=False,
-                manually_verified=True
-            )
+        # Step 3: Mark the user's messages that weren't manually verified yet as verified not spam.
+        message_helper.relabel_user_messages(target_user_id, is_spam=False, manually_verified=True, only_unverified=True)
 
         # Step 4: Clear all reports for the user across all chats
         reports_cleared = 0
@@ -1825,43 +1745,23 @@ async def tg_auto_reply(update, context):
     try:
         if update.message and update.message.text:
             chat_id = update.effective_chat.id
-            message_text = update.message.text.lower()
         else:
             return  # Skip processing if there's no text message
 
-        # Fetch auto replies that are not currently delayed
-        auto_replies = await chat_helper.get_auto_replies(chat_id, filter_delayed=True)
-
-        for auto_reply in auto_replies:
-            try:
-                triggers_raw = auto_reply['trigger']
-                triggers = json.loads(triggers_raw)
-                triggers = [trigger.lower() for trigger in triggers]
-            except json.JSONDecodeError:
-                logger.warning(f"Failed to parse auto-reply trigger: {auto_reply['trigger']}")
-                continue
-
-            matched = False
-            for trigger in triggers:
-                if trigger.startswith("#"):
-                    # Match hashtags using simple space split (handles "#успех", not "#успех!" or "#успех.")
-                    if trigger in message_text.split():
-                        matched = True
-                        break
-                else:
-                    if findall(r'\b' + re.escape(trigger) + r'\b', message_text):
-                        matched = True
-                        break
+        # One pass over the text with the chat's compiled triggers; hashtags must be whole space separated
+        # tokens (matches "#успех", not "#успех!" or "#успех."), other triggers whole words
+        matched_replies = keyword_helper.match_auto_replies(chat_id, update.message.text)
+        if not matched_replies:
+            return
 
-            if matched:
+        # First matched auto reply that is not currently delayed; its usage is flushed to the DB in batches
+        for auto_reply in matched_replies:
+            if auto_reply_helper.try_claim(auto_reply):
                 await chat_helper.send_message(
                     context.bot, chat_id, auto_reply['reply'],
                     reply_to_message_id=update.message.message_id
                 )
-                await chat_helper.update_last_reply_time_and_increment_count(
-                    chat_id, auto_reply['id'], datetime.now(timezone.utc)
-                )
-                logger.info(f"Auto-reply sent in chat {chat_id} for triggers '{', '.join(triggers)}': {auto_reply['reply']}")
+                logger.info(f"Auto-reply sent in chat {chat_id} for triggers '{', '.join(map(str, auto_reply['triggers']))}': {auto_reply['reply']}")
                 break  # Stop after first match to avoid sending multiple replies
 
     except Exception as error:
@@ -1963,8 +1863,7 @@ async def tg_handle_forwarded_messages(update, context):
             return
 
         # Check if the user is an admin; if so, don't process their messages
-        chat_administrators = await chat_helper.get_chat_administrators(context.bot, message.chat.id)
-        is_admin = any(admin["user_id"] == message.from_user.id for admin in chat_administrators)
+        is_admin = await chat_helper.is_chat_admin(context.bot, message.chat.id, message.from_user.id)
         if is_admin:
             return
 
@@ -2104,8 +2003,7 @@ async def tg_spam_check(update, context):
         message = update.message if update.message else update.edited_message
 
         #check if user is admin so don't check spam for them
-        chat_administrators = await chat_helper.get_chat_administrators(context.bot, message.chat.id)
-        is_admin = any(admin["user_id"] == message.from_user.id for admin in chat_administrators)
+        is_admin = await chat_helper.is_chat_admin(context.bot, message.chat.id, message.from_user.id)
         if is_admin:
             return
 
@@ -2239,7 +2137,7 @@ async def tg_ai_spamcheck(update, context):
             # ───────────── feature-toggle / admin-skip ─────────────
             if chat_helper.get_chat_config(chat_id, "ai_spamcheck_enabled") is not True:
                 return
-            if any(adm["user_id"] == user_id for adm in await chat_helper.get_chat_administrators(context.bot, chat_id)):
+            if await chat_helper.is_chat_admin(context.bot, chat_id, user_id):
                 return
             if user_id == 777000:
                 return
@@ -2395,28 +2293,16 @@ async def tg_ai_spamcheck(update, context):
                 action = "delete"
 
                 if spam_prob >= mute_thr:
-                    with sentry_sdk.start_span(op="moderation_db_query", description="Query user status chats"):
-                        with db_helper.session_scope() as session:
-                            rows = session.query(db_helper.User_Status.chat_id) \
-                                        .filter_by(user_id=user_id) \
-                                        .all()
-                        chat_ids = [cid for (cid,) in rows]
-
-                    if not chat_ids:
-                        with sentry_sdk.start_span(op="moderation_db_query_msglog", description="Query message log chats"):
-                            with db_helper.session_scope() as session:
-                                rows = session.query(db_helper.Message_Log.chat_id) \
-                                            .filter(db_helper.Message_Log.user_id == user_id) \
-                                            .distinct() \
-                                            .all()
-                            chat_ids = [cid for (cid,) in rows]
+                    with sentry_sdk.start_span(op="moderation_db_query", description="Query user chats"):
+                        chat_ids = user_helper.get_user_chat_ids(user_id)
 
                     try:
                         with sentry_sdk.start_span(op="moderation_mute", description="Mute user"):
                             await chat_helper.mute_user(
                                 context.bot, chat_id, user_id,
                                 duration_in_seconds=21*24*60*60,
-                                global_mute=True, reason="AI spam detection"
+                                global_mute=True, reason="AI spam detection",
+                                known_chat_ids=chat_ids
                             )
                     except Exception as e:
                         logger.error(f"global_mute failed for {user_id}: {e}")
@@ -2490,8 +2376,7 @@ async def tg_cas_spamcheck(update, context):
 
     async with aiohttp.ClientSession() as session:
         for user_id, message_id, nickname in checks:
-            admins = await chat_helper.get_chat_administrators(context.bot, chat_id)
-            if any(a["user_id"] == user_id for a in admins):
+            if await chat_helper.is_chat_admin(context.bot, chat_id, user_id):
                 continue
 
             if nickname == "GroupAnonymousBot":  # Anonymous group admin
@@ -2616,59 +2501,43 @@ async def tg_thankyou_message(update, context):
         if not content:
             return
 
-        # Load lists (might be None)
-        like_words    = chat_helper.get_chat_config(msg.chat.id, "like_words")    or []
-        dislike_words = chat_helper.get_chat_config(msg.chat.id, "dislike_words") or []
+        # +1 for a like word, -1 for a dislike word, found in one pass over the text
+        rating_change = keyword_helper.match_rating_word(msg.chat.id, content)
+        if rating_change is None:
+            return
 
-        for category, word_list in (("like_words", like_words), ("dislike_words", dislike_words)):
-            for word in word_list:
-                if not word:
-                    continue
-                if word.lower() in content.lower():
-                    # Ensure the replied-to user exists in our DB
-                    with db_helper.session_scope() as db_session:
-                        target = msg.reply_to_message.from_user
-                        user = db_session.query(db_helper.User).get(target.id)
-                        if user is None:
-                            user = db_helper.User(
-                                id=target.id,
-                                first_name=target.first_name or "",
-                                last_name=target.last_name  or "",
-                                username=target.username  # NULL if not set
-                            )
-                            db_session.add(user)
-                        # Ensure the reacting user exists
-                        reactor = msg.from_user
-                        judge = db_session.query(db_helper.User).get(reactor.id)
-                        if judge is None:
-                            judge = db_helper.User(
-                                id=reactor.id,
-                                first_name=reactor.first_name or "",
-                                last_name=reactor.last_name  or "",
-                                username=reactor.username  # NULL if not set
-                            )
-                            db_session.add(judge)
-
-                    # Apply rating change
-                    if category == "like_words":
-                        await rating_helper.change_rating(
-                            msg.reply_to_message.from_user.id,
-                            msg.from_user.id,
-                            msg.chat.id,
-                            +1,
-                            msg.message_id,
-                            delete_message_delay=5*60
-                        )
-                    else:  # dislike_words
-                        await rating_helper.change_rating(
-                            msg.reply_to_message.from_user.id,
-                            msg.from_user.id,
-                            msg.chat.id,
-                            -1,
-                            msg.message_id,
-                            delete_message_delay=5*60
-                        )
-                    return
+        # Ensure the replied-to user exists in our DB
+        with db_helper.session_scope() as db_session:
+            target = msg.reply_to_message.from_user
+            user = db_session.query(db_helper.User).get(target.id)
+            if user is None:
+                user = db_helper.User(
+                    id=target.id,
+                    first_name=target.first_name or "",
+                    last_name=target.last_name  or "",
+                    username=target.username  # NULL if not set
+                )
+                db_session.add(user)
+            # Ensure the reacting user exists
+            reactor = msg.from_user
+            judge = db_session.query(db_helper.User).get(reactor.id)
+            if judge is None:
+                judge = db_helper.User(
+                    id=reactor.id,
+                    first_name=reactor.first_name or "",
+                    last_name=reactor.last_name  or "",
+                    username=reactor.username  # NULL if not set
+                )
+                db_session.add(judge)
+
+        await rating_helper.change_rating(
+            msg.reply_to_message.from_user.id,
+            msg.from_user.id,
+            msg.chat.id,
+            rating_change,
+            msg.message_id,
+            delete_message_delay=5*60
+        )
     except Exception as error:
         update_str = (
             json.dumps(update.to_dict(), indent=2, sort_keys=True)
@@ -2785,8 +2654,7 @@ async def tg_set_rating(update, context):
             return
 
         # Check if the user is an administrator
-        chat_administrators = await chat_helper.get_chat_administrators(context.bot, chat_id)
-        is_admin = any(admin["user_id"] == message.from_user.id for admin in chat_administrators)
+        is_admin = await chat_helper.is_chat_admin(context.bot, chat_id, message.from_user.id)
         if not is_admin:
             await chat_helper.send_message(context.bot, chat_id, "You must be an admin to use this command.", reply_to_message_id=message.message_id, delete_after=120)
             return
@@ -2838,6 +2706,36 @@ async def tg_set_rating(update, context):
         update_str = json.dumps(update.to_dict() if hasattr(update, 'to_dict') else {'info': 'Update object has no to_dict method'}, indent=4, sort_keys=True, default=str)
         logger.error(f"Error: {traceback.format_exc()} | Update: {update_str}")
 
+@sentry_profile()
+async def tg_top(update, context):
+    try:
+        chat_id = update.effective_chat.id
+        message = update.message
+
+        await chat_helper.delete_message(context.bot, chat_id, message.message_id, delay_seconds=120)
+
+        command_parts = message.text.split()
+        limit = int(command_parts[1]) if len(command_parts) > 1 and command_parts[1].isdigit() else 10
+        limit = max(1, min(limit, 50))
+
+        top = leaderboard_helper.get_top(chat_id, limit)
+        if not top:
+            await chat_helper.send_message(context.bot, chat_id, "Nobody has a rating here yet.", reply_to_message_id=message.message_id, delete_after=120)
+            return
+
+        mentions = user_helper.get_user_mentions([user_id for user_id, _ in top], show_user_id=False, show_account_age=False, show_rating=False)
+        lines = [f"{position}. {mentions[user_id]} ({total})" for position, (user_id, total) in enumerate(top, start=1)]
+
+        rank, rated_users = leaderboard_helper.get_rank(chat_id, message.from_user.id)
+        if rank is not None and rank > limit:
+            lines.append(f"\nYour place: {rank} of {rated_users}")
+
+        await chat_helper.send_message(context.bot, chat_id, "🏆 Top rated users:\n" + "\n".join(lines), reply_to_message_id=message.message_id, disable_web_page_preview=True, delete_after=120)
+
+    except Exception as error:
+        update_str = json.dumps(update.to_dict() if hasattr(update, 'to_dict') else {'info': 'Update object has no to_dict method'}, indent=4, sort_keys=True, default=str)
+        logger.error(f"Error: {traceback.format_exc()} | Update: {update_str}")
+
 @sentry_profile()
 async def tg_get_rating(update, context):
     try:
@@ -2919,6 +2817,23 @@ from telegram.ext import ChatMemberHandler
 
 async def on_member_update(update, context):
     logger.info(f"on_member_update: {update.to_dict()}")
+    try:
+        # promotions / demotions (including the bot's own, via my_chat_member) keep the admin cache current
+        chat_helper.apply_chat_member_update(update.chat_member or update.my_chat_member)
+    except Exception as e:
+        logger.error(f"Error applying chat member update to the admin cache: {traceback.format_exc()}")
+    if update.chat_member:
+        try:
+            # joins and leaves that come without a service message still reach the user -> chats index
+            user_helper.record_chat_member_update(update.chat_member)
+        except Exception as e:
+            logger.error(f"Error recording chat member update: {traceback.format_exc()}")
+    if update.my_chat_member:
+        try:
+            # the bot's own rights, so global actions know where they can be applied without asking Telegram
+            chat_helper.apply_bot_member_update(update.my_chat_member)
+        except Exception as e:
+            logger.error(f"Error recording the bot's capability from my_chat_member: {traceback.format_exc()}")
     # cmu = update.chat_member            # a ChatMemberUpdated
     # old, new = cmu.old_chat_member, cmu.new_chat_member
 
@@ -3090,8 +3005,26 @@ from aiohttp import web
 def start_health_server():
     async def handle(request):
         return web.Response(text="OK")
+    async def handle_db_pool(request):
+        return web.json_response(db_pool_helper.get_pool_stats())
+    async def handle_db_queries(request):
+        return web.json_response(db_helper.get_query_stats())
+    async def handle_cache(request):
+        return web.json_response(cache_helper.get_stats())
+    async def handle_fanout(request):
+        return web.json_response(fanout_helper.get_stats())
+    async def handle_deletions(request):
+        return web.json_response(deletion_helper.get_stats())
+    async def handle_scheduled_messages(request):
+        return web.json_response(scheduled_message_helper.get_stats())
     app = web.Application()
     app.router.add_get("/healthz", handle)
+    app.router.add_get("/db_pool", handle_db_pool)
+    app.router.add_get("/db_queries", handle_db_queries)
+    app.router.add_get("/cache", handle_cache)
+    app.router.add_get("/fanout", handle_fanout)
+    app.router.add_get("/deletions", handle_deletions)
+    app.router.add_get("/scheduled_messages", handle_scheduled_messages)
     runner = web.AppRunner(app)
     async def run():
         await runner.setup()
@@ -3107,6 +3040,32 @@ def start_health_server():
 async def tg_heartbeat(context):
     logger.debug("💓 heartbeat")
 
+async def tg_verify_ratings(context):
+    # Only the in-memory leaderboards; the rating total tables are rebuilt by cron/rating_totals_rebuild.py.
+    # The ledger scans run in a thread so the bot keeps handling updates meanwhile.
+    try:
+        checked, replaced = await asyncio.to_thread(leaderboard_helper.verify_leaderboards)
+        logger.info(f"Verified {checked} leaderboards against the rating ledger, {replaced} reloaded")
+    except Exception as e:
+        logger.error(f"Error verifying ratings: {traceback.format_exc()}")
+
+async def tg_flush_auto_reply_usage(context):
+    try:
+        auto_reply_helper.flush_usage()
+    except Exception as e:
+        logger.error(f"Error flushing auto reply usage: {traceback.format_exc()}")
+
+async def tg_refresh_chat_metadata(context):
+    try:
+        await chat_helper.refresh_chat_metadata(context.bot)
+    except Exception as e:
+        logger.error(f"Error refreshing chat metadata: {traceback.format_exc()}")
+
+async def tg_resume_moderation_jobs(context):
+    resumed = await fanout_helper.resume_jobs(context.bot)
+    if resumed:
+        logger.info(f"Resumed {resumed} moderation jobs")
+
 async def global_error(update, context):
     logger.error("unhandled error", exc_info=context.error)
 
@@ -3116,6 +3075,35 @@ async def on_startup(app):
     # schedule heartbeat after application and JobQueue are ready
     app.job_queue.run_repeating(tg_heartbeat, interval=60, first=60, job_kwargs={"misfire_grace_time": 8})
 
+    # drop cached chat configs as soon as tg_chat changes
+    chat_helper.start_chat_config_listener()
+
+    # load admin lists up front so the first messages after a restart don't all miss the cache at once
+    app.create_task(chat_helper.warm_up_chat_administrators(app.bot))
+
+    # global mutes / bans interrupted by a restart (or by another process dying) continue where they stopped,
+    # and background phases left by processes that exit early (crons, the CAS listener) are picked up
+    app.job_queue.run_repeating(tg_resume_moderation_jobs, interval=fanout_helper.LEASE_SECONDS * 2, first=10)
+
+    # timed message deletions (delete_after / delay_seconds), including the ones pending before the restart
+    app.create_task(deletion_helper.scheduler.run(app.bot))
+
+    # scheduled messages: one JobQueue job armed for the next due config, reloaded when configs change
+    scheduled_message_helper.start(app.job_queue)
+
+    # auto reply usage counts / last reply times, kept in memory between flushes
+    app.job_queue.run_repeating(tg_flush_auto_reply_usage, interval=auto_reply_helper.USAGE_FLUSH_SECONDS, first=auto_reply_helper.USAGE_FLUSH_SECONDS)
+
+    # chat titles / invite links for get_chat_mention, written to tg_chat only when they change
+    app.job_queue.run_repeating(tg_refresh_chat_metadata, interval=chat_helper.CHAT_METADATA_REFRESH_SECONDS, first=300)
+
+    # nightly: rating totals and leaderboards against the tg_user_rating ledger
+    app.job_queue.run_daily(tg_verify_ratings, time=datetime.strptime("03:30", "%H:%M").time().replace(tzinfo=timezone.utc))
+
+async def on_shutdown(app):
+    # don't lose the auto reply usage counted since the last flush
+    auto_reply_helper.flush_usage()
+
 @sentry_profile()
 async def tg_ping(update, context):
     try:
@@ -3134,6 +3122,7 @@ def create_application():
         .concurrent_updates(int(os.getenv("ENV_BOT_CONCURRENCY", "1")))
         .job_queue(JobQueue())
         .post_init(on_startup)
+        .post_shutdown(on_shutdown)
         .build()
     )
     application.add_error_handler(global_error)
@@ -3141,7 +3130,7 @@ def create_application():
     # Add handlers
     application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, tg_new_member), group=0)
     application.add_handler(TypeHandler(object, debug_all_updates), group=1)
-    application.add_handler(ChatMemberHandler(on_member_update, ChatMemberHandler.CHAT_MEMBER), group=1)
+    application.add_handler(ChatMemberHandler(on_member_update, ChatMemberHandler.ANY_CHAT_MEMBER), group=1)
     application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, tg_cas_spamcheck), group=1)
     application.add_handler(MessageHandler(filters.ALL & filters.ChatType.GROUPS, tg_update_user_status), group=2)
     application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, tg_update_user_status), group=2)
@@ -3153,6 +3142,7 @@ def create_application():
     application.add_handler(CommandHandler(["set_report"], tg_set_report, filters.ChatType.GROUPS), group=4)
     application.add_handler(CommandHandler(["ur", "unreport"], tg_ur, filters.ChatType.GROUPS), group=4)
     application.add_handler(CommandHandler(["get_rating", "gr"], tg_get_rating, filters.ChatType.GROUPS), group=4)
+    application.add_handler(CommandHandler(["top"], tg_top, filters.ChatType.GROUPS), group=4)
     application.add_handler(ChatJoinRequestHandler(tg_join_request), group=5)
     application.add_handler(CommandHandler(["ban", "b"], tg_ban, filters.ChatType.GROUPS), group=6)
     application.add_handler(CommandHandler(["gban", "g", "gb"], tg_gban), group=6)
@@ -0,0 +1,82 @@
+import os
+import threading
+import traceback
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+from sqlalchemy import func
+
+import src.helpers.db_helper as db_helper
+import src.helpers.logging_helper as logging_helper
+
+logger = logging_helper.get_logger()
+
+# Auto-reply cooldowns live in memory: the dispatcher is the only process sending auto replies, so it knows when
+# each one was last sent. Usage counts and last reply times are written to tg_auto_reply in one UPDATE every
+# USAGE_FLUSH_SECONDS instead of a read-modify-write commit per reply.
+USAGE_FLUSH_SECONDS = int(os.getenv('ENV_AUTO_REPLY_FLUSH_INTERVAL', '60'))
+
+_last_reply_times = {}  # auto reply id -> when it was last sent by this process
+_pending_usage = {}  # auto reply id -> [replies sent since the last flush, last reply time]
+_lock = threading.Lock()
+
+
+def try_claim(auto_reply, now=None):
+    """
+    Record a reply and return True if the auto reply is off cooldown, otherwise return False. `auto_reply` is a
+    keyword_helper reply: its last_reply_time is the one stored when the chat's matcher was built.
+    """
+    now = now or datetime.now(timezone.utc)
+    reply_id = auto_reply['id']
+    with _lock:
+        last_reply_time = _last_reply_times.get(reply_id)
+        stored = auto_reply.get('last_reply_time')
+        if stored is not None and (last_reply_time is None or stored > last_reply_time):
+            last_reply_time = stored
+        if last_reply_time is not None:
+            # Same rule as before: without a reply_delay an auto reply is only sent once
+            delay = auto_reply.get('reply_delay')
+            if delay is None or (now - last_reply_time).total_seconds() <= delay:
+                return False
+
+        _last_reply_times[reply_id] = now
+        pending = _pending_usage.setdefault(reply_id, [0, now])
+        pending[0] += 1
+        pending[1] = now
+        return True
+
+
+def flush_usage():
+    """Write the pending usage counts and last reply times in one statement. Returns the number of rows updated."""
+    with _lock:
+        pending = dict(_pending_usage)
+        _pending_usage.clear()
+    if not pending:
+        return 0
+
+    table = db_helper.Auto_Reply.__table__
+    usage = sa.values(
+        sa.column('id', sa.BigInteger),
+        sa.column('replies', sa.Integer),
+        sa.column('last_reply_time', sa.DateTime(timezone=True)),
+        name='usage'
+    ).data([(reply_id, replies, last_reply_time) for reply_id, (replies, last_reply_time) in pending.items()])
+    stmt = sa.update(table).where(table.c.id == usage.c.id).values(
+        usage_count=func.coalesce(table.c.usage_count, 0) + usage.c.replies,
+        last_reply_time=func.greatest(table.c.last_reply_time, usage.c.last_reply_time)
+    )
+    try:
+        with db_helper.session_scope() as db_session:
+            updated = db_session.execute(stmt).rowcount
+            db_session.commit()
+            return updated
+    except Exception:
+        logger.error(f"Error flushing usage of {len(pending)} auto replies: {traceback.format_exc()}")
+        # Keep the counts for the next flush
+        with _lock:
+            for reply_id, (replies, last_reply_time) in pending.items():
+                current = _pending_usage.setdefault(reply_id, [0, last_reply_time])
+                current[0] += replies
+                current[1] = max(current[1], last_reply_time)
+        return 0
+
@@ -1,40 +1,347 @@
-from time import time
+import os
+import json
+import pickle
+import threading
+import traceback
+import uuid
+from collections import OrderedDict
+from time import time, sleep
 
 from src.helpers.logging_helper import get_logger
 
 logger = get_logger()
 
-# In-memory cache dictionary
-# Now storing each value as a tuple (actual_value, expiration_timestamp)
-cache = {}
+# In-process LRU + TTL cache. Keys are "namespace:rest" (e.g. "chat_admins:-100123"); every namespace has its
+# own size cap and counters, so one busy namespace can't push everything else out. Values are stored as
+# native Python objects and returned as is, callers must not mutate them.
+
+DEFAULT_MAX_SIZE = int(os.getenv('ENV_CACHE_MAX_SIZE', '10000'))
+SWEEP_INTERVAL_SECONDS = int(os.getenv('ENV_CACHE_SWEEP_INTERVAL', '60'))
+
+# Optional shared backend: any Redis-protocol server (Redis, Valkey, KeyDB, a local redis-server for testing).
+# When set, every process keeps the local LRU in front of it and drops local copies on invalidation messages.
+REDIS_URL = os.getenv('ENV_CACHE_REDIS_URL')
+REDIS_KEY_PREFIX = os.getenv('ENV_CACHE_REDIS_PREFIX', 'tg_community_manager:')
+REDIS_TIMEOUT_SECONDS = float(os.getenv('ENV_CACHE_REDIS_TIMEOUT', '0.5'))
+# After a failed call the server is skipped for this long, so an outage doesn't cost a timeout on every lookup
+REDIS_RETRY_SECONDS = float(os.getenv('ENV_CACHE_REDIS_RETRY_SECONDS', '30'))
+INVALIDATION_CHANNEL = f"{REDIS_KEY_PREFIX}invalidate"
+
+# Per-namespace caps, namespaces not listed here get DEFAULT_MAX_SIZE
+NAMESPACE_MAX_SIZES = {
+    'default_chat_config': 200,
+    'chat_config': 20000,
+    'chat_admins': 5000,
+    'chat_metadata': 20000,
+    'user_upsert': 50000,
+    'cas_status': 50000,
+}
+
+
+def get_namespace(key):
+    return str(key).split(':', 1)[0]
+
+
+class Namespace:
+    def __init__(self, name, max_size):
+        self.name = name
+        self.max_size = max_size
+        self.entries = OrderedDict()  # key -> (value, expire_at), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, now):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expire_at = entry
+        if now > expire_at:
+            del self.entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, expire_at):
+        self.entries[key] = (value, expire_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def sweep(self, now):
+        expired = [key for key, (_, expire_at) in self.entries.items() if now > expire_at]
+        for key in expired:
+            del self.entries[key]
+        self.expirations += len(expired)
+        return len(expired)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class LocalCache:
+    def __init__(self):
+        self.namespaces = {}
+        self.lock = threading.Lock()
+        self.sweeper = None
+        self.stop_sweeper = threading.Event()
+
+    def _namespace(self, name):
+        namespace = self.namespaces.get(name)
+        if namespace is None:
+            namespace = self.namespaces[name] = Namespace(name, NAMESPACE_MAX_SIZES.get(name, DEFAULT_MAX_SIZE))
+        return namespace
+
+    def get(self, key):
+        with self.lock:
+            return self._namespace(get_namespace(key)).get(key, time())
+
+    def set(self, key, value, expire=None, invalidate=False):
+        expire_at = time() + expire if expire is not None else float('inf')  # Use 'inf' for no expiration
+        with self.lock:
+            self._namespace(get_namespace(key)).set(key, value, expire_at)
+        self._start_sweeper()
+
+    def delete(self, key):
+        with self.lock:
+            return self._namespace(get_namespace(key)).entries.pop(key, None) is not None
+
+    def clear_namespace(self, name):
+        with self.lock:
+            self._namespace(name).entries.clear()
+
+    def clear(self):
+        with self.lock:
+            for namespace in self.namespaces.values():
+                namespace.entries.clear()
+
+    def sweep(self):
+        now = time()
+        with self.lock:
+            return sum(namespace.sweep(now) for namespace in self.namespaces.values())
+
+    def stats(self):
+        with self.lock:
+            return {name: namespace.stats() for name, namespace in self.namespaces.items()}
+
+    def _start_sweeper(self):
+        if self.sweeper is not None:
+            return
+        with self.lock:
+            if self.sweeper is not None:
+                return
+            self.sweeper = threading.Thread(target=self._sweep_forever, name='cache-sweeper', daemon=True)
+            self.sweeper.start()
+
+    def _sweep_forever(self):
+        while not self.stop_sweeper.wait(SWEEP_INTERVAL_SECONDS):
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.debug(f"Cache sweep removed {removed} expired entries")
+            except Exception:
+                logger.error(f"Cache sweep failed: {traceback.format_exc()}")
+
+
+class SharedCache:
+    """
+    Local LRU in front of a Redis-protocol server shared by all processes (dispatcher, CAS listener, crons).
+
+    Deletes, namespace clears and sets made with invalidate=True are published on INVALIDATION_CHANNEL, and every
+    other process drops its local copy as soon as the message arrives. Plain sets only fill caches with what was
+    loaded, so they aren't published. If the server is unreachable, reads and writes fall back to the local cache
+    and the server is left alone for REDIS_RETRY_SECONDS.
+    Values are pickled, so the server must only be reachable by this application.
+    """
+
+    def __init__(self, url):
+        import redis  # only needed when ENV_CACHE_REDIS_URL is set
+
+        self.redis = redis
+        self.local = LocalCache()
+        self.client = redis.Redis.from_url(url, socket_timeout=REDIS_TIMEOUT_SECONDS,
+                                           socket_connect_timeout=REDIS_TIMEOUT_SECONDS)
+        # The subscriber blocks on reads, so it gets its own connection without a socket timeout
+        self.subscriber_client = redis.Redis.from_url(url, health_check_interval=30)
+        self.origin = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.errors = 0
+        self.skipped = 0
+        self.unavailable_until = 0.0
+        self.invalidations_received = 0
+        self.listener = threading.Thread(target=self._listen, name='cache-invalidation', daemon=True)
+        self.listener.start()
+
+    def _key(self, key):
+        return f"{REDIS_KEY_PREFIX}{key}"
+
+    def _count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _available(self):
+        if time() < self.unavailable_until:
+            self._count('skipped')
+            return False
+        return True
+
+    def _failed(self, action, error):
+        self._count('errors')
+        self.unavailable_until = time() + REDIS_RETRY_SECONDS
+        logger.warning(f"Shared cache {action} failed, using the local cache for {REDIS_RETRY_SECONDS:g}s: {error}")
+
+    def _publish(self, message):
+        message['origin'] = self.origin
+        self.client.publish(INVALIDATION_CHANNEL, json.dumps(message))
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None or not self._available():
+            return value
+        try:
+            with self.client.pipeline(transaction=False) as pipe:
+                payload, ttl_ms = pipe.get(self._key(key)).pttl(self._key(key)).execute()
+        except self.redis.RedisError as e:
+            self._failed(f"get of {key}", e)
+            return None
+        if payload is None:
+            self._count('shared_misses')
+            return None
+        self._count('shared_hits')
+        value = pickle.loads(payload)
+        self.local.set(key, value, ttl_ms / 1000 if ttl_ms and ttl_ms > 0 else None)
+        return value
+
+    def set(self, key, value, expire=None, invalidate=False):
+        self.local.set(key, value, expire)
+        if not self._available():
+            return
+        try:
+            px = max(1, int(expire * 1000)) if expire is not None else None
+            self.client.set(self._key(key), pickle.dumps(value), px=px)
+            if invalidate:
+                self._publish({'key': key})
+        except self.redis.RedisError as e:
+            self._failed(f"set of {key}", e)
+
+    def delete(self, key):
+        deleted = self.local.delete(key)
+        if not self._available():
+            return deleted
+        try:
+            deleted = bool(self.client.delete(self._key(key))) or deleted
+            self._publish({'key': key})
+        except self.redis.RedisError as e:
+            self._failed(f"delete of {key}", e)
+        return deleted
+
+    def clear_namespace(self, name):
+        self.local.clear_namespace(name)
+        if not self._available():
+            return
+        try:
+            keys = list(self.client.scan_iter(match=f"{self._key(name)}:*", count=1000))
+            for start in range(0, len(keys), 1000):
+                self.client.delete(*keys[start:start + 1000])
+            self._publish({'namespace': name})
+        except self.redis.RedisError as e:
+            self._failed(f"clear of namespace {name}", e)
+
+    def sweep(self):
+        return self.local.sweep()
+
+    def stats(self):
+        stats = self.local.stats()
+        with self.lock:
+            stats['_shared'] = {
+                'shared_hits': self.shared_hits,
+                'shared_misses': self.shared_misses,
+                'errors': self.errors,
+                'skipped': self.skipped,
+                'invalidations_received': self.invalidations_received,
+            }
+        return stats
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.subscriber_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Invalidations may have been missed while disconnected
+                self.local.clear()
+                for message in pubsub.listen():
+                    data = json.loads(message['data'])
+                    if data.get('origin') == self.origin:
+                        continue
+                    if 'key' in data:
+                        self.local.delete(data['key'])
+                    elif 'namespace' in data:
+                        self.local.clear_namespace(data['namespace'])
+                    self._count('invalidations_received')
+            except Exception:
+                logger.error(f"Cache invalidation listener failed, reconnecting: {traceback.format_exc()}")
+                sleep(1)
+
+
+def create_backend():
+    if REDIS_URL:
+        try:
+            return SharedCache(REDIS_URL)
+        except Exception:
+            logger.error(f"Could not set up the shared cache, using the local one: {traceback.format_exc()}")
+    return LocalCache()
+
+
+backend = create_backend()
+
 
 def get_key(key):
     try:
-        if key in cache:
-            value, expire_at = cache[key]
-            if time() > expire_at:
-                # Key has expired, so remove it and return None
-                del cache[key]
-                return None
-            return value
-        return None
+        return backend.get(key)
     except Exception as e:
         logger.error(f"Failed to get key {key} from cache: {e}")
         return None
 
-def set_key(key, value, expire=None):
+def set_key(key, value, expire=None, invalidate=False):
+    """
+    Cache a value. Pass invalidate=True when it replaces a value that changed (not just one loaded after a miss),
+    so other processes drop their copies.
+    """
     try:
-        expire_at = time() + expire if expire is not None else float('inf')  # Use 'inf' for no expiration
-        cache[key] = (value, expire_at)
-        # logger.info(f"Set key {key} in cache with value {value} and expiration {expire_at}")
+        backend.set(key, value, expire, invalidate)
     except Exception as e:
         logger.error(f"Failed to set key {key} in cache: {e}")
 
 def delete_key(key):
     try:
-        # Check if the key exists and remove it
-        if key in cache:
-            del cache[key]
+        if backend.delete(key):
             logger.info(f"Deleted key {key} from cache.")
     except Exception as e:
         logger.error(f"Failed to delete key {key} from cache: {e}")
+
+def clear_namespace(namespace):
+    try:
+        backend.clear_namespace(namespace)
+    except Exception as e:
+        logger.error(f"Failed to clear cache namespace {namespace}: {e}")
+
+def get_stats():
+    """Per-namespace size, hit/miss, eviction and expiration counters."""
+    return backend.stats()
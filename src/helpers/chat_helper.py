@@ -1,5 +1,6 @@
 import sentry_sdk
 import psycopg2
+import psycopg2.extensions
 import os
 import configparser
 import os
@@ -9,6 +10,7 @@ import pytz
 
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql import func, or_, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import sqlalchemy as sa
 
 
@@ -17,11 +19,19 @@ from telegram.error import BadRequest, TelegramError, RetryAfter
 from datetime import datetime, timedelta, timezone
 import traceback
 import re
+import select
+import threading
+import time
+import types
 
 import src.helpers.logging_helper as logging_helper
 import src.helpers.db_helper as db_helper
+import src.helpers.db_pool_helper as db_pool_helper
 import src.helpers.chat_helper as chat_helper
 import src.helpers.cache_helper as cache_helper
+import src.helpers.fanout_helper as fanout_helper
+import src.helpers.deletion_helper as deletion_helper
+import src.helpers.keyword_helper as keyword_helper
 
 
 import functools
@@ -101,78 +111,158 @@ async def send_report_to_admin(bot, chat_id, text: str, photo_file_id: str = Non
         except Exception as error:
             logger.error(f"Error: {traceback.format_exc()}")
 
-def get_default_chat(config_param=None):
-    cache_key = f"default_chat_config:{config_param}"
-    config_value = cache_helper.get_key(cache_key)
+CHAT_CONFIG_CACHE_SECONDS = 86400  # safety net only, changes arrive through NOTIFY (see start_chat_config_listener)
+CHAT_CONFIG_CHANNEL = 'tg_chat_config'
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return types.MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, types.MappingProxyType):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+class ChatConfig:
+    """
+    Read-only config of one chat merged over the defaults of chat 0. Parameters are attributes:
+    `config.cas_enabled`; a parameter missing from both reads as None. Lists become tuples and dicts
+    read-only mappings, so a cached snapshot can be shared safely.
+    """
+    __slots__ = ('chat_id', '_values')
+
+    def __init__(self, chat_id, values):
+        object.__setattr__(self, 'chat_id', chat_id)
+        object.__setattr__(self, '_values', _freeze(values))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._values.get(name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ChatConfig is read-only")
 
-    if config_value:
-        return json.loads(config_value)  # Deserialize JSON string back into Python object
+    def __reduce__(self):
+        return ChatConfig, (self.chat_id, _thaw(self._values))
 
+    def get(self, name, default=None):
+        value = self._values.get(name)
+        return default if value is None else value
+
+    def as_dict(self):
+        """A mutable copy of the merged config."""
+        return _thaw(self._values)
+
+
+def _load_chat_config(chat_id):
+    """Build the snapshot for chat_id: chat 0 defaults overlaid with the chat's own config."""
     with db_helper.session_scope() as db_session:
-        try:
-            chat = db_session.query(db_helper.Chat).filter(db_helper.Chat.id == 0).one_or_none()
-
-            if chat is not None:
-                if config_param is not None:
-                    if config_param in chat.config:
-                        cache_helper.set_key(cache_key, json.dumps(chat.config[config_param]), expire=86400)  # Cache result
-                        return chat.config[config_param]
-                    else:
-                        return None
-                else:
-                    cache_helper.set_key(cache_key, json.dumps(chat.config), expire=3600)  # Cache entire config
-                    return chat.config
-            else:
-                return None
-        except Exception as e:
-            logger.error(f"Error: {traceback.format_exc()}")
-            return None
+        rows = dict(db_session.query(db_helper.Chat.id, db_helper.Chat.config).filter(
+            db_helper.Chat.id.in_({0, chat_id})
+        ).all())
+        if chat_id not in rows and chat_id < 0:
+            # Register a new chat once (tg_message_log references it); its config stays empty and the
+            # defaults are merged at read time instead of being copied into the row
+            db_session.execute(
+                pg_insert(db_helper.Chat).values(id=chat_id, config={}).on_conflict_do_nothing(index_elements=['id'])
+            )
+
+    values = dict(rows.get(0) or {}) if chat_id != 0 else {}
+    values.update(rows.get(chat_id) or {})
+    return ChatConfig(chat_id, values)
+
+
+def get_config(chat_id):
+    """
+    Cached ChatConfig for chat_id. Chats without a row (and parameters without a value) are cached as well,
+    so misses don't hit the database again until the chat or the defaults change.
+    """
+    cache_key = f"chat_config:{chat_id}"
+    config = cache_helper.get_key(cache_key)
+    if config is None:
+        config = _load_chat_config(chat_id)
+        cache_helper.set_key(cache_key, config, expire=CHAT_CONFIG_CACHE_SECONDS)
+    return config
+
+
+def get_default_chat(config_param=None):
+    try:
+        config = get_config(0)
+        return config.as_dict() if config_param is None else config.get(config_param)
+    except Exception as e:
+        logger.error(f"Error: {traceback.format_exc()}")
+        return None
 
 def get_chat_config(chat_id=None, config_param=None, default=None):
-    
+
     # skip DM chats
     if chat_id > 0:
         return default
 
-    cache_key = f"chat_config:{chat_id}:{config_param}"
-    config_value = cache_helper.get_key(cache_key)
+    try:
+        config = get_config(chat_id)
+        return config.as_dict() if config_param is None else config.get(config_param, default)
+    except Exception as e:
+        logger.error(f"Error: {traceback.format_exc()}")
+        return default  # Return the default value in case of any error
 
-    if config_value:
-        return json.loads(config_value)  # Deserialize JSON string back into Python object
 
-    with db_helper.session_scope() as db_session:
+def invalidate_chat_config(chat_id):
+    if chat_id == 0:
+        # Defaults changed: every merged snapshot is stale
+        cache_helper.clear_namespace('chat_config')
+        keyword_helper.clear()
+    else:
+        cache_helper.delete_key(f"chat_config:{chat_id}")
+        # like/dislike words come from the config, auto-reply triggers notify on the same channel
+        keyword_helper.invalidate(chat_id)
+
+
+def _listen_for_chat_config_changes():
+    while True:
+        conn = None
         try:
-            chat = db_session.query(db_helper.Chat).filter(db_helper.Chat.id == chat_id).one_or_none()
+            conn = psycopg2.connect(db_pool_helper.get_database_url())
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {CHAT_CONFIG_CHANNEL}")
+            # Notifications may have been missed while not listening
+            cache_helper.clear_namespace('chat_config')
+            keyword_helper.clear()
+
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    invalidate_chat_config(int(notify.payload))
+        except Exception:
+            logger.error(f"Chat config listener failed, reconnecting: {traceback.format_exc()}")
+            time.sleep(5)
+        finally:
+            if conn is not None:
+                conn.close()
 
-            if chat is not None:
-                if config_param is not None:
-                    if config_param in chat.config:
-                        cache_helper.set_key(cache_key, json.dumps(chat.config[config_param]), expire=3600)  # Cache result
-                        return chat.config[config_param]
-                    else:
-                        default_config_param_value = get_default_chat(config_param)
-                        if default_config_param_value is not None:
-                            chat.config[config_param] = default_config_param_value
-                            db_session.commit()
-                            cache_helper.set_key(cache_key, json.dumps(default_config_param_value), expire=3600)  # Cache result
-                            return default_config_param_value
-                else:
-                    cache_helper.set_key(cache_key, json.dumps(chat.config), expire=3600)  # Cache entire config
-                    return chat.config
-            else:
-                # If chat_id is not found, handle accordingly without attempting to access attributes of None
-                default_config_param_value = get_default_chat(config_param)
-                if default_config_param_value is not None:
-                    logger.info(f"Default config param {config_param} value: {default_config_param_value} for chat_id {chat_id}")
-                    # Let's insert the chat into the database but with empty config
-                    db_session.add(db_helper.Chat(id=chat_id, config={}))
-
-                    return default_config_param_value
-                else:
-                    return default  # Return the default value in case of any error
-        except Exception as e:
-            logger.error(f"Error: {traceback.format_exc()}")
-            return default  # Return the default value in case of any error
+
+def start_chat_config_listener():
+    """
+    Keep cached chat configs fresh: a trigger on tg_chat sends NOTIFY tg_chat_config with the chat id on every
+    config change. LISTEN needs a session-level connection, so this uses its own connection outside the pool
+    (point it at Postgres directly, not at a transaction-mode PgBouncer).
+    """
+    thread = threading.Thread(target=_listen_for_chat_config_changes, name='chat-config-listener', daemon=True)
+    thread.start()
+    return thread
 
 @sentry_profile()
 async def get_last_admin_permissions_check(chat_id):
@@ -201,50 +291,55 @@ async def set_last_admin_permissions_check(chat_id, timestamp):
         logger.error(f"Error updating last admin permissions check for chat_id {chat_id}: {traceback.format_exc()}")
         return False
 
-@sentry_profile()
-async def get_chat_administrators(bot, chat_id, cache_ttl=3600, max_retries=3):
-    """
-    Get chat administrators with caching. Caches per chat_id for cache_ttl seconds.
-    Returns a list of dicts: [{user_id, is_bot, status}]
 
-    Handles RetryAfter exceptions with automatic retry logic.
-    """
-    # Validate chat_id (0 is not a valid Telegram chat ID)
-    if chat_id == 0:
-        logger.error(f"Invalid chat_id 0 passed to get_chat_administrators. Returning empty list.")
-        return []
+ADMIN_CACHE_SECONDS = int(os.getenv('ENV_ADMIN_CACHE_SECONDS', '21600'))  # safety net, chat_member updates keep it current
+ADMIN_WARM_UP_CONCURRENCY = int(os.getenv('ENV_ADMIN_WARM_UP_CONCURRENCY', '5'))
+ADMIN_STATUSES = ('administrator', 'creator')
+
+# chat_id -> task fetching that chat's admins, so concurrent cache misses share one API call
+_admin_fetches = {}
+# chat_id -> bumped on every admin change, a fetch started before the change must not overwrite the cache
+_admin_generations = {}
+
 
+class ChatAdmins(tuple):
+    """Cached admin list: a tuple of {user_id, is_bot, status} dicts plus a frozenset of their ids."""
+
+    def __new__(cls, admins):
+        return super().__new__(cls, admins)
+
+    def __init__(self, admins):
+        self.ids = frozenset(admin["user_id"] for admin in self)
+
+    def __reduce__(self):
+        return (ChatAdmins, (tuple(self),))
+
+
+async def _fetch_chat_administrators(bot, chat_id, cache_ttl, max_retries):
     cache_key = f"chat_admins:{chat_id}"
-    admins_json = cache_helper.get_key(cache_key)
-    if admins_json:
-        try:
-            admins_data = json.loads(admins_json)
-            if admins_data:
-                return admins_data
-            # If cached list is empty, treat as cache miss (force re-fetch)
-            logger.warning(f"Cached admins for chat {chat_id} is empty, ignoring cache.")
-        except Exception as e:
-            logger.error(f"Error parsing cached admins for chat {chat_id}: {e}")
-            cache_helper.delete_key(cache_key)
+    generation = _admin_generations.get(chat_id, 0)
 
     # Retry logic for rate limiting
     for attempt in range(max_retries):
         try:
             admins = await bot.get_chat_administrators(chat_id)
-            admins_data = [
+            admins_data = ChatAdmins(
                 {
                     "user_id": admin.user.id,
                     "is_bot": admin.user.is_bot,
                     "status": admin.status
                 }
                 for admin in admins
-            ]
+            )
+            if _admin_generations.get(chat_id, 0) != generation:
+                # Admins changed while we were waiting for Telegram, the next lookup fetches again
+                return admins_data
             if not admins_data:
                 logger.error(f"Telegram API returned empty admin list for chat {chat_id}. This should not happen.")
                 # Optionally: Do not cache, or cache for 5 seconds to avoid rapid re-requests
-                cache_helper.set_key(cache_key, "[]", expire=5)
+                cache_helper.set_key(cache_key, admins_data, expire=5)
             else:
-                cache_helper.set_key(cache_key, json.dumps(admins_data), expire=cache_ttl)
+                cache_helper.set_key(cache_key, admins_data, expire=cache_ttl)
             return admins_data
         except RetryAfter as e:
             retry_after = e.retry_after
@@ -253,18 +348,201 @@ async def get_chat_administrators(bot, chat_id, cache_ttl=3600, max_retries=3):
                 await asyncio.sleep(retry_after)
             else:
                 logger.error(f"Max retries reached for chat {chat_id} after rate limiting.")
-                return []
+                return ChatAdmins(())
         except BadRequest as e:
             if "Topic_closed" in str(e):
                 logger.warning(f"Topic is closed in chat {chat_id}. Cannot get administrators. Returning empty list.")
             else:
                 logger.error(f"BadRequest getting chat administrators for chat {chat_id}: {e}")
-            return []
+            return ChatAdmins(())
         except Exception as e:
             logger.error(f"Error getting chat administrators for chat {chat_id}: {traceback.format_exc()}")
-            return []
+            return ChatAdmins(())
+
+    return ChatAdmins(())
+
+
+@sentry_profile()
+async def get_chat_administrators(bot, chat_id, cache_ttl=None, max_retries=3):
+    """
+    Get chat administrators with caching. Returns a tuple of dicts: [{user_id, is_bot, status}], with the
+    admin ids as a frozenset in `.ids`.
+
+    The cache is kept current by chat_member updates (see apply_chat_member_update) and only expires after
+    cache_ttl seconds (ADMIN_CACHE_SECONDS) as a safety net. Concurrent misses for the same chat share a
+    single get_chat_administrators call. Handles RetryAfter exceptions with automatic retry logic.
+    """
+    # Validate chat_id (0 is not a valid Telegram chat ID)
+    if chat_id == 0:
+        logger.error(f"Invalid chat_id 0 passed to get_chat_administrators. Returning empty list.")
+        return ChatAdmins(())
+
+    cache_key = f"chat_admins:{chat_id}"
+    admins_data = cache_helper.get_key(cache_key)
+    if admins_data:
+        return admins_data
+    if admins_data is not None:
+        # If cached list is empty, treat as cache miss (force re-fetch)
+        logger.warning(f"Cached admins for chat {chat_id} is empty, ignoring cache.")
+
+    fetch = _admin_fetches.get(chat_id)
+    if fetch is None:
+        fetch = asyncio.create_task(_fetch_chat_administrators(bot, chat_id, cache_ttl or ADMIN_CACHE_SECONDS, max_retries))
+        _admin_fetches[chat_id] = fetch
+        fetch.add_done_callback(lambda task: _admin_fetches.pop(chat_id, None) if _admin_fetches.get(chat_id) is task else None)
+    # shield: a cancelled caller must not cancel the fetch the other callers are waiting on
+    return await asyncio.shield(fetch)
+
+
+async def get_chat_admin_ids(bot, chat_id):
+    """Frozenset of the chat's admin user ids."""
+    return (await get_chat_administrators(bot, chat_id)).ids
+
+
+async def is_chat_admin(bot, chat_id, user_id):
+    return user_id in await get_chat_admin_ids(bot, chat_id)
+
+
+def apply_chat_member_update(chat_member_updated):
+    """
+    Keep the cached admin list in step with a chat_member / my_chat_member update.
+
+    Promotions, demotions and ownership transfers are applied to the cached list directly, so admin checks
+    never have to call Telegram again. Updates that don't touch admin status are ignored.
+    """
+    chat_id = chat_member_updated.chat.id
+    old_status = chat_member_updated.old_chat_member.status
+    new_member = chat_member_updated.new_chat_member
+    if old_status == new_member.status or (old_status not in ADMIN_STATUSES and new_member.status not in ADMIN_STATUSES):
+        return
+
+    _admin_generations[chat_id] = _admin_generations.get(chat_id, 0) + 1
+    _admin_fetches.pop(chat_id, None)
+
+    cache_key = f"chat_admins:{chat_id}"
+    admins_data = cache_helper.get_key(cache_key)
+    if not admins_data:
+        return  # nothing cached, the next lookup fetches the current list
+
+    user = new_member.user
+    admins = [admin for admin in admins_data if admin["user_id"] != user.id]
+    if new_member.status in ADMIN_STATUSES:
+        admins.append({"user_id": user.id, "is_bot": user.is_bot, "status": new_member.status})
+    cache_helper.set_key(cache_key, ChatAdmins(admins), expire=ADMIN_CACHE_SECONDS)
+    logger.info(f"Admin list of chat {chat_id} updated: user {user.id} {old_status} -> {new_member.status}")
+
+
+async def warm_up_chat_administrators(bot, concurrency=None):
+    """Load the admin lists of all active chats, at most `concurrency` requests at a time."""
+    try:
+        with db_helper.session_scope() as db_session:
+            chat_ids = [row[0] for row in db_session.query(db_helper.Chat.id).filter(
+                db_helper.Chat.id < 0,
+                db_helper.Chat.active == True
+            ).all()]
+
+        semaphore = asyncio.Semaphore(concurrency or ADMIN_WARM_UP_CONCURRENCY)
+
+        async def warm_up(chat_id):
+            async with semaphore:
+                await get_chat_administrators(bot, chat_id)
+
+        started_at = time.monotonic()
+        await asyncio.gather(*(warm_up(chat_id) for chat_id in chat_ids))
+        logger.info(f"Warmed up admin lists of {len(chat_ids)} chats in {time.monotonic() - started_at:.1f}s")
+    except Exception:
+        logger.error(f"Error warming up chat administrators: {traceback.format_exc()}")
+
+
+# Restricting members only works in supergroups, banning works in basic groups too
+SUPERGROUP_ONLY_ACTIONS = ('mute', 'unmute')
+
+
+def _bot_capability_from_member(member):
+    """(can_restrict, can_delete) of the bot described by a ChatMember."""
+    if member.status == 'creator':
+        return True, True
+    if member.status == 'administrator':
+        return bool(member.can_restrict_members), bool(member.can_delete_messages)
+    return False, False
+
+
+def set_bot_capability(chat_id, status, can_restrict=False, can_delete=False, chat_type=None, migrated_to_chat_id=None):
+    """Upsert the bot's capability record of a chat. A chat_type of None keeps the type already known."""
+    try:
+        with db_helper.session_scope() as db_session:
+            stmt = pg_insert(db_helper.Chat_Bot_Capability).values(
+                chat_id=chat_id,
+                chat_type=chat_type,
+                status=status,
+                can_restrict=can_restrict,
+                can_delete=can_delete,
+                migrated_to_chat_id=migrated_to_chat_id
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['chat_id'],
+                set_={
+                    'chat_type': func.coalesce(stmt.excluded.chat_type, db_helper.Chat_Bot_Capability.chat_type),
+                    'status': stmt.excluded.status,
+                    'can_restrict': stmt.excluded.can_restrict,
+                    'can_delete': stmt.excluded.can_delete,
+                    'migrated_to_chat_id': stmt.excluded.migrated_to_chat_id,
+                    'updated_at': func.now(),
+                }
+            )
+            db_session.execute(stmt)
+            db_session.commit()
+    except Exception:
+        logger.error(f"Error storing bot capability of chat {chat_id}: {traceback.format_exc()}")
+
+
+def set_chat_migrated(chat_id, new_chat_id):
+    """The basic group chat_id became the supergroup new_chat_id, nothing can be done under the old id any more."""
+    set_bot_capability(chat_id, 'left', chat_type='group', migrated_to_chat_id=new_chat_id)
+
+
+def apply_bot_member_update(chat_member_updated):
+    """Record the bot's new status and rights from a my_chat_member update."""
+    member = chat_member_updated.new_chat_member
+    can_restrict, can_delete = _bot_capability_from_member(member)
+    set_bot_capability(chat_member_updated.chat.id, member.status, can_restrict, can_delete, chat_type=chat_member_updated.chat.type)
+
 
-    return []
+async def refresh_bot_capability(bot, chat_id):
+    """Ask Telegram what the bot may do in the chat, store it and return the bot's ChatMember. API errors propagate."""
+    chat = await bot.get_chat(chat_id)
+    member = await bot.get_chat_member(chat_id, bot.id)
+    can_restrict, can_delete = _bot_capability_from_member(member)
+    set_bot_capability(chat_id, member.status, can_restrict, can_delete, chat_type=chat.type)
+    return member
+
+
+def get_ineligible_chats(chat_ids, action):
+    """
+    {chat_id: reason} for the chats among chat_ids where the recorded capability says the bot can't apply
+    `action` (mute / unmute / ban / unban). Chats without a record are left out, the action is tried there.
+    """
+    chat_ids = set(chat_ids)
+    ineligible = {}
+    with db_helper.session_scope() as db_session:
+        rows = db_session.query(db_helper.Chat_Bot_Capability).filter(or_(
+            db_helper.Chat_Bot_Capability.migrated_to_chat_id.isnot(None),
+            db_helper.Chat_Bot_Capability.status.notin_(ADMIN_STATUSES),
+            db_helper.Chat_Bot_Capability.can_restrict == False,
+            db_helper.Chat_Bot_Capability.chat_type == 'group'
+        )).all()
+        for row in rows:
+            if row.chat_id not in chat_ids:
+                continue
+            if row.migrated_to_chat_id is not None:
+                ineligible[row.chat_id] = f"chat migrated to {row.migrated_to_chat_id}"
+            elif row.status not in ADMIN_STATUSES:
+                ineligible[row.chat_id] = f"bot is not an admin ({row.status})"
+            elif not row.can_restrict:
+                ineligible[row.chat_id] = "bot has no right to restrict members"
+            elif row.chat_type == 'group' and action in SUPERGROUP_ONLY_ACTIONS:
+                ineligible[row.chat_id] = "restrictions need a supergroup"
+    return ineligible
 
 
 @sentry_profile()
@@ -288,83 +566,12 @@ async def send_message(
     )
 
     if delete_after is not None:
-        asyncio.create_task(delete_message(bot, chat_id, message.message_id, delay_seconds=delete_after))
+        deletion_helper.schedule_deletion(chat_id, message.message_id, delay_seconds=delete_after)
 
     return message
 
 
 
-@sentry_profile()
-async def send_scheduled_messages(bot):
-    try:
-        with db_helper.session_scope() as db_session:
-            now = datetime.now(pytz.utc)
-            current_day_of_week = now.weekday()  # Monday is 0 and Sunday is 6
-            current_day_of_month = now.day
-            current_time = now.time()
-
-            # Construct the due condition
-            due_condition = or_(
-                db_helper.Scheduled_Message_Config.last_sent == None,
-                db_helper.Scheduled_Message_Config.last_sent + db_helper.Scheduled_Message_Config.frequency_seconds * text("INTERVAL '1 second'") <= now
-            )
-
-            potential_messages_to_send = db_session.query(db_helper.Scheduled_Message_Config).join(
-                db_helper.Scheduled_Message_Content
-            ).filter(
-                db_helper.Scheduled_Message_Config.status == 'active',
-                or_(
-                    db_helper.Scheduled_Message_Config.time_of_the_day == None,
-                    db_helper.Scheduled_Message_Config.time_of_the_day <= current_time
-                ),
-                or_(
-                    db_helper.Scheduled_Message_Config.day_of_the_week == None,
-                    db_helper.Scheduled_Message_Config.day_of_the_week == current_day_of_week
-                ),
-                or_(
-                    db_helper.Scheduled_Message_Config.day_of_the_month == None,
-                    db_helper.Scheduled_Message_Config.day_of_the_month == current_day_of_month
-                ),
-                due_condition
-            ).all()
-
-            if len(potential_messages_to_send) == 0:
-                logger.debug("No scheduled messages to send.")
-            else:
-                logger.info(f"Found {len(potential_messages_to_send)} messages due to be sent.")
-
-            for scheduled_config in potential_messages_to_send:
-                message_content = scheduled_config.message_content.content
-                parse_mode = scheduled_config.message_content.parse_mode
-
-                logger.info(f"Sending message ID {scheduled_config.id}: {message_content[:50]}...")
-
-                try:
-                    await send_message(
-                        bot,
-                        scheduled_config.chat_id,
-                        message_content,
-                        parse_mode=parse_mode
-                    )
-                    scheduled_config.last_sent = now
-                    scheduled_config.error_count = 0
-                    scheduled_config.error_message = None
-                except Exception as e:
-                    logger.error(f"Error sending scheduled message ID {scheduled_config.id}: {traceback.format_exc()}")
-                    scheduled_config.error_count += 1
-                    scheduled_config.error_message = str(e)
-                    ERROR_THRESHOLD = 3
-                    if scheduled_config.error_count >= ERROR_THRESHOLD:
-                        scheduled_config.status = 'error'
-                        logger.error(f"Scheduled message ID {scheduled_config.id} set to 'error' status after {ERROR_THRESHOLD} failures.")
-
-            db_session.commit()
-
-    except Exception as error:
-        logger.error(f"Error while fetching and sending scheduled messages: {traceback.format_exc()}")
-
-
-
 @sentry_profile()
 async def warn_user(bot, chat_id: int, user_id: int) -> None:
     # bot.send_message(chat_id, text=f"User {user_id} has been warned due to multiple reports.")
@@ -377,8 +584,13 @@ async def mute_user(
     user_id: int,
     duration_in_seconds: float = None,
     global_mute: bool = False,
-    reason: str = None
+    reason: str = None,
+    known_chat_ids: list = None
 ) -> None:
+    """
+    Mute user_id in chat_id, or everywhere with global_mute. A global mute is applied right away in known_chat_ids
+    (default: the chats the user was seen in) and in the background in every other active chat.
+    """
     from datetime import datetime, timedelta, timezone
     from telegram.error import TelegramError, BadRequest
     import asyncio
@@ -414,69 +626,30 @@ async def mute_user(
                 f"mute_user: UNEXPECTED ERROR muting user={user_id} in chat={chat_id}: {traceback.format_exc()}"
             )
     else:
-        chat_mentions = []
+        try:
+            await fanout_helper.run_fanout(bot, 'mute', user_id, known_chat_ids=known_chat_ids, reason=reason, until_date=until)
+        except Exception:
+            logger.error(
+                f"mute_user: UNEXPECTED ERROR during global mute of user={user_id}: {traceback.format_exc()}"
+            )
 
-        async def mute_in_chat(chat_id_iter, db_session, bot_info):
-            delay = 0
-            try_count = 0
-            while True:
-                try:
-                    chat_admins = await chat_helper.get_chat_administrators(bot, chat_id_iter)
-                    if bot_info.id not in [admin["user_id"] for admin in chat_admins]:
-                        return
-                    await bot.restrict_chat_member(
-                        chat_id=chat_id_iter,
-                        user_id=user_id,
-                        permissions=perms,
-                        until_date=until
-                    )
-                    mention = await chat_helper.get_chat_mention(bot, chat_id_iter)
-                    chat_mentions.append(mention)
-                    return
-                except TelegramError as e:
-                    if "Too Many Requests" in e.message:
-                        retry_after = getattr(e, "retry_after", None)
-                        if not retry_after:
-                            m = re.search(r'retry after (\d+)', e.message)
-                            retry_after = int(m.group(1)) if m else 5
-                        delay = retry_after if delay == 0 else delay * 2
-                        await asyncio.sleep(delay)
-                        try_count += 1
-                        continue
-                    else:
-                        return
-                except BadRequest:
-                    return
-                except Exception:
-                    return
 
-        with db_helper.session_scope() as db_session:
-            all_active_chats = db_session.query(db_helper.Chat.id).filter(
-                db_helper.Chat.id != 0,
-                db_helper.Chat.active == True
-            ).all()
-            bot_info = await bot.get_me()
-
-            # Process chats in smaller batches to avoid overwhelming the API
-            batch_size = 10
-            for i in range(0, len(all_active_chats), batch_size):
-                batch = all_active_chats[i:i + batch_size]
-                tasks = [
-                    mute_in_chat(chat.id, db_session, bot_info)
-                    for chat in batch
-                ]
-                await asyncio.gather(*tasks)
-                # Small delay between batches to prevent rate limiting
-                if i + batch_size < len(all_active_chats):
-                    await asyncio.sleep(0.5)
-
-        if chat_mentions:
-            msg = (
-                f"User {user_id} has been globally muted in chats: "
-                + "; ".join(chat_mentions)
-                + f". {desc}. Reason: {reason}"
-            )
-            logger.info(msg)
+# What unmute_user restores
+DEFAULT_MEMBER_PERMISSIONS = ChatPermissions(
+    can_send_messages=True,
+    can_send_polls=True,
+    can_send_other_messages=True,
+    can_add_web_page_previews=True,
+    can_change_info=True,
+    can_invite_users=True,
+    can_pin_messages=True,
+    can_send_audios=True,
+    can_send_documents=True,
+    can_send_photos=True,
+    can_send_videos=True,
+    can_send_video_notes=True,
+    can_send_voice_notes=True
+)
 
 
 @sentry_profile()
@@ -485,34 +658,15 @@ async def unmute_user(bot, chat_id, user_to_unmute, global_unmute=False):
     Unmute a user by restoring full chat permissions.
     If global_unmute is True, the user is unmuted only in active chats.
     """
-    default_perms = ChatPermissions(
-        can_send_messages=True,
-        can_send_polls=True,
-        can_send_other_messages=True,
-        can_add_web_page_previews=True,
-        can_change_info=True,
-        can_invite_users=True,
-        can_pin_messages=True,
-        can_send_audios=True,
-        can_send_documents=True,
-        can_send_photos=True,
-        can_send_videos=True,
-        can_send_video_notes=True,
-        can_send_voice_notes=True
-    )
     try:
-        with db_helper.session_scope() as session:
-            if global_unmute:
-                all_chats = session.query(db_helper.Chat.id).filter(
-                    db_helper.Chat.id != 0,
-                    db_helper.Chat.active == True
-                ).all()
-                chat_ids = [chat.id for chat in all_chats]
-            else:
-                chat_ids = [chat_id]
+        if global_unmute:
+            await fanout_helper.run_fanout(bot, 'unmute', user_to_unmute)
+            return
+
+        chat_ids = [chat_id]
         for cid in chat_ids:
             try:
-                await bot.restrict_chat_member(cid, user_to_unmute, permissions=default_perms)
+                await bot.restrict_chat_member(cid, user_to_unmute, permissions=DEFAULT_MEMBER_PERMISSIONS)
                 logger.info(f"User {user_to_unmute} unmuted (permissions restored) in chat {cid}")
             except BadRequest as e:
                 if e.message == "Method is available only for supergroups":
@@ -554,73 +708,8 @@ async def ban_user(bot, chat_id, user_to_ban, global_ban=False, reason=None):
                     logger.error(f"Error: {traceback.format_exc()}")
 
             if global_ban:
-                # If global_ban is True, ban the user in all chats
-                all_active_chats = db_session.query(db_helper.Chat.id).filter(
-                    db_helper.Chat.id != 0,
-                    db_helper.Chat.active == True
-                ).all()
-                bot_info = await bot.get_me()
-
-                for chat in all_active_chats:
-                    try:
-                        #check if bot is admin
-                        #logger.info(f"Trying to get admins of chat {chat.id}")
-                        chat_admins = await chat_helper.get_chat_administrators(bot, chat.id)
-                        #logger.info(f"Get admins of chat {chat.id}")
-
-                        #logger.info("Checking if bot is admin in chat")
-                        logger.info(f"Chat {chat_admins} admins: {chat_admins}. Bot info: {bot_info}")
-                        if bot_info.id not in [admin["user_id"] for admin in chat_admins]:
-                            logger.info(f"Bot is not admin in chat {await chat_helper.get_chat_mention(bot, chat.id)}")
-                            continue
-                        else:
-                            #logger.info("Bot is admin in chat")
-                            #logger.info(f"Trying to ban user {user_to_ban} from chat {chat.id}")
-                            await bot.ban_chat_member(chat.id, user_to_ban)
-                            # Add small delay to prevent rate limiting when processing many chats
-                            await asyncio.sleep(0.1)
-                    except TelegramError as e:
-                        if "Bot is not a member of the group chat" in e.message:
-                            logger.info(f"Bot is not a member in chat {await chat_helper.get_chat_mention(bot, chat.id)}")
-                            continue
-                        elif "Group migrated to supergroup. New chat id" in e.message:
-                            # Extract new chat id from the exception message using a regular expression
-                            new_chat_id = int(re.search(r"New chat id: (-\d+)", e.message).group(1))
-
-                            # Check if new chat id already exists in the database
-                            existing_chat = db_session.query(db_helper.Chat).filter(db_helper.Chat.id == new_chat_id).first()
-                            if existing_chat:
-                                # Handle the case where the new chat id already exists
-                                logger.info(f"Cannot update chat id from {await chat_helper.get_chat_mention(bot, chat.id)} to {await chat_helper.get_chat_mention(bot, new_chat_id)} as the new id already exists")
-                            else:
-                                # Update the chat id as before
-                                chat_to_update = db_session.query(db_helper.Chat).filter(db_helper.Chat.id == chat.id).first()
-                                if chat_to_update:
-                                    chat_to_update.id = new_chat_id
-                                    db_session.commit()
-                                    logger.info(f"Updated chat id from {chat.id} to {new_chat_id}")
-                                else:
-                                    logger.error(f"Could not find chat with id {chat.id} to update")
-                        elif "bot was kicked from the supergroup chat" in e.message:
-                            logger.info(f"Bot was kicked from chat {await chat_helper.get_chat_mention(bot, chat.id)}")
-                            continue
-
-
-                    except BadRequest as e:
-                        if "There are no administrators in the private chat" in e.message:
-                            logger.info(f"Bot is not admin in chat {await chat_helper.get_chat_mention(bot, chat.id)}")
-                            continue
-                        elif "User_not_participant" in e.message:
-                            logger.info(f"User {user_to_ban} is not in chat {chat.id}")
-                            continue
-                        logger.error(f"BadRequest. Chat: {await chat_helper.get_chat_mention(bot, chat.id)}. Traceback: {traceback.format_exc()}")
-                        continue
-                    except Exception as e:
-                        if e.message == "Chat not found":
-                            continue
-                        else:
-                            logger.error(f"Error: {traceback.format_exc()}")
-                            continue
+                # If global_ban is True, ban the user in all chats (the current one is already done above)
+                await fanout_helper.run_fanout(bot, 'ban', user_to_ban, exclude_chat_ids=[chat_id], reason=reason)
 
                 # Ensure user exists in tg_user before writing global ban
                 existing_user = (
@@ -697,21 +786,17 @@ async def unban_user(bot, chat_id, user_to_unban, global_unban=False):
     import traceback
 
     try:
-        with db_helper.session_scope() as session:
-            if global_unban:
-                all_chats = session.query(db_helper.Chat.id).filter(
-                    db_helper.Chat.id != 0,
-                    db_helper.Chat.active == True
-                ).all()
-                chat_ids = [chat.id for chat in all_chats]
+        if global_unban:
+            with db_helper.session_scope() as session:
                 # Remove user from global ban list
                 session.query(db_helper.User_Global_Ban).filter(
                     db_helper.User_Global_Ban.user_id == user_to_unban
                 ).delete(synchronize_session=False)
                 session.commit()
-            else:
-                chat_ids = [chat_id]
+            await fanout_helper.run_fanout(bot, 'unban', user_to_unban)
+            return
 
+        chat_ids = [chat_id]
         for cid in chat_ids:
             try:
                 await bot.unban_chat_member(cid, user_to_unban)
@@ -744,7 +829,6 @@ async def unban_user(bot, chat_id, user_to_unban, global_unban=False):
 
 @sentry_profile()
 async def delete_message(bot, chat_id: int, message_id: int, delay_seconds: int = None) -> None:
-    import asyncio
     from telegram.error import BadRequest
     import traceback
 
@@ -759,15 +843,51 @@ async def delete_message(bot, chat_id: int, message_id: int, delay_seconds: int
         except Exception as e:
             logger.error(f"Error: {traceback.format_exc()}")
 
-    async def _delayed():
-        await asyncio.sleep(delay_seconds)
-        await do_delete()
-
     if delay_seconds:
-        asyncio.create_task(_delayed())
+        # handed to the deletion scheduler instead of a sleeping task, so it survives restarts
+        deletion_helper.schedule_deletion(chat_id, message_id, delay_seconds=delay_seconds)
     else:
         await do_delete()
 
+DELETE_MESSAGES_BATCH_SIZE = 100  # Bot API limit of deleteMessages
+
+
+async def delete_messages(bot, messages) -> int:
+    """
+    Delete (chat_id, message_id) pairs with deleteMessages, up to 100 per call and chat. Messages that are
+    already gone are skipped by Telegram; a batch Telegram refuses is retried one message at a time.
+    Returns the number of messages in batches that went through.
+    """
+    message_ids_by_chat = {}
+    for chat_id, message_id in messages:
+        message_ids_by_chat.setdefault(chat_id, []).append(message_id)
+
+    deleted = 0
+    for chat_id, message_ids in message_ids_by_chat.items():
+        message_ids = sorted(set(message_ids))
+        for start in range(0, len(message_ids), DELETE_MESSAGES_BATCH_SIZE):
+            batch = message_ids[start:start + DELETE_MESSAGES_BATCH_SIZE]
+            await fanout_helper.rate_limiter.acquire(chat_id)
+            try:
+                await bot.delete_messages(chat_id, batch)
+                deleted += len(batch)
+            except RetryAfter as e:
+                fanout_helper.rate_limiter.pause(fanout_helper.retry_after_seconds(e))
+                logger.warning(f"Rate limit hit deleting {len(batch)} messages in chat {chat_id}, deleting them one by one after the pause")
+                for message_id in batch:
+                    await fanout_helper.rate_limiter.acquire(chat_id)
+                    await delete_message(bot, chat_id, message_id)
+            except BadRequest as e:
+                logger.info(f"Deleting {len(batch)} messages in chat {chat_id} at once failed ({e.message}), deleting them one by one")
+                for message_id in batch:
+                    await fanout_helper.rate_limiter.acquire(chat_id)
+                    await delete_message(bot, chat_id, message_id)
+            except TelegramError as e:
+                logger.warning(f"Could not delete {len(batch)} messages in chat {chat_id}: {e.message}")
+            except Exception:
+                logger.error(f"Error deleting {len(batch)} messages in chat {chat_id}: {traceback.format_exc()}")
+    return deleted
+
 async def delete_media_group_messages(bot, chat_id: int, message, delay_seconds: int = None) -> None:
     """
     Delete all messages in a media group (album) if the message is part of one.
@@ -794,11 +914,10 @@ async def delete_media_group_messages(bot, chat_id: int, message, delay_seconds:
     # Find all messages in the same media group from database
     try:
         with db_helper.session_scope() as db_session:
-            # Query messages with the same media_group_id from raw_message JSON
-            # Use ->> operator to extract JSON value as text
-            messages = db_session.query(db_helper.Message_Log).filter(
+            # Query messages with the same media_group_id (covered by the (chat_id, media_group_id) index)
+            messages = db_session.query(db_helper.Message_Log.message_id).filter(
                 db_helper.Message_Log.chat_id == chat_id,
-                db_helper.Message_Log.raw_message.op('->>')('media_group_id') == str(media_group_id)
+                db_helper.Message_Log.media_group_id == str(media_group_id)
             ).all()
 
             message_ids = [msg.message_id for msg in messages]
@@ -835,34 +954,10 @@ async def schedule_message_deletion(
     :param message_id: ID of the message to be scheduled for deletion.
     :param user_id: User ID who sent the message (optional).
     :param trigger_id: ID of the trigger/event (optional).
-    :param delay_seconds: Seconds after which the message should be deleted. If None, no automatic deletion time is set.
+    :param delay_seconds: Seconds after which the message should be deleted. If None, no automatic deletion time is set
+        and the message waits for delete_scheduled_messages.
     """
-    try:
-        with db_helper.session_scope() as db_session:
-            from datetime import datetime, timedelta
-
-            scheduled_deletion_time = (
-                datetime.utcnow() + timedelta(seconds=delay_seconds)
-                if delay_seconds is not None else None
-            )
-            new_deletion = db_helper.Message_Deletion(
-                chat_id=chat_id,
-                user_id=user_id,
-                message_id=message_id,
-                trigger_id=trigger_id,
-                status='scheduled',
-                scheduled_deletion_time=scheduled_deletion_time
-            )
-            db_session.add(new_deletion)
-            db_session.commit()
-            if delay_seconds is not None:
-                logger.info(f"Scheduled message {message_id} for deletion at {scheduled_deletion_time}")
-            else:
-                logger.info(f"Message {message_id} scheduled for deletion without a specific time")
-            return True
-    except Exception as e:
-        logger.error(f"Error scheduling message {message_id} for deletion: {traceback.format_exc()}")
-        return False
+    return deletion_helper.schedule_deletion(chat_id, message_id, delay_seconds=delay_seconds, user_id=user_id, trigger_id=trigger_id)
 
 
 @sentry_profile()
@@ -921,117 +1016,116 @@ async def unpin_message(bot, chat_id, message_id):
         logger.error(f"Error unpinning messages in chat {chat_id}: {traceback.format_exc()}")
 
 
+CHAT_METADATA_REFRESH_SECONDS = int(os.getenv('ENV_CHAT_METADATA_REFRESH_INTERVAL', '21600'))
+CHAT_METADATA_REFRESH_CONCURRENCY = int(os.getenv('ENV_CHAT_METADATA_REFRESH_CONCURRENCY', '5'))
 
-@sentry_profile()
-async def get_chat_mention(bot, chat_id: int) -> str:
-    try:
-        # Fetch chat details from the Telegram API
-        chat_details = await bot.get_chat(chat_id)
-    except BadRequest as e:
-        # Handle case if bot has not enough rights to get chat details
-        return str(chat_id)
-    except TelegramError as e:
-        return str(chat_id)
-    except Exception as e:
-        logger.error(f"Error: {traceback.format_exc()}")
-        return str(chat_id)
-
-    with db_helper.session_scope() as db_session:
-        try:
-            # Try to get the chat from the database
-            chat = db_session.query(db_helper.Chat).filter_by(id=chat_id).one()
-
-            # Update the chat name and invite link
-            chat.chat_name = chat_details.title
-            chat.invite_link = chat_details.invite_link  # Store invite link in invite_link field
 
-            db_session.commit()
+def _chat_metadata_key(chat_id):
+    return f"chat_metadata:{chat_id}"
 
-            # Create chat mention
-            chat_mention = chat.chat_name if chat.chat_name else str(chat.id)
-            invite_link = chat.invite_link if chat.invite_link else "No link available"
 
-            return f"{chat_mention} - {invite_link}"
+def _render_chat_mention(chat_id, chat_name, invite_link):
+    return f"{chat_name or chat_id} - {invite_link or 'No link available'}"
 
-        except NoResultFound:
-            # If chat is not found in the database, create a new one with default config
-            default_config = get_default_chat() or {}
-            chat = db_helper.Chat(
-                id=chat_id,
-                chat_name=chat_details.title,
-                invite_link=chat_details.invite_link,  # Store invite link in invite_link field
-                config=default_config
-            )
-            db_session.add(chat)
-            db_session.commit()
 
-            return f"{chat.chat_name} - {chat.invite_link}"
+def _load_chat_metadata(chat_id):
+    """(chat_name, invite_link) stored in tg_chat, None if the chat has no name yet."""
+    with db_helper.session_scope() as db_session:
+        row = db_session.query(db_helper.Chat.chat_name, db_helper.Chat.invite_link).filter(db_helper.Chat.id == chat_id).one_or_none()
+    if row is None or not row.chat_name:
+        return None
+    return (row.chat_name, row.invite_link)
+
+
+def _store_chat_metadata(db_session, chat_id, chat_name, invite_link):
+    """Write the title and invite link only if they changed, creating the chat if it isn't known yet. Returns True on write."""
+    updated = db_session.query(db_helper.Chat).filter(
+        db_helper.Chat.id == chat_id,
+        or_(db_helper.Chat.chat_name.is_distinct_from(chat_name), db_helper.Chat.invite_link.is_distinct_from(invite_link))
+    ).update({'chat_name': chat_name, 'invite_link': invite_link}, synchronize_session=False)
+    if updated:
+        return True
+    inserted = db_session.execute(
+        pg_insert(db_helper.Chat.__table__)
+        .values(id=chat_id, chat_name=chat_name, invite_link=invite_link, config={})  # defaults are merged at read time, see _load_chat_config
+        .on_conflict_do_nothing(index_elements=['id'])
+    ).rowcount
+    return bool(inserted)
+
+
+async def _fetch_chat_metadata(bot, chat_id):
+    """(title, invite_link) from the Telegram API, None if the bot can't see the chat."""
+    try:
+        chat_details = await bot.get_chat(chat_id)
+        return (chat_details.title, chat_details.invite_link)
+    except RetryAfter:
+        raise
+    except TelegramError as e:
+        # Handle case if bot has not enough rights to get chat details
+        logger.debug(f"Could not get chat details of {chat_id}: {e}")
+        return None
 
 
 @sentry_profile()
-async def get_auto_replies(chat_id, filter_delayed=False):
+async def get_chat_mention(bot, chat_id: int) -> str:
     """
-    Fetch auto-reply settings for a specific chat, optionally filtering out replies that are currently delayed.
-    Only returns enabled auto-replies.
+    "<title> - <invite link>" for log lines and admin messages.
+
+    Served from the chat_metadata cache, backed by tg_chat.chat_name / invite_link, which refresh_chat_metadata
+    keeps current in the background. The Telegram API is only called for a chat whose title was never stored.
     """
     try:
-        cache_key = f"auto_replies:{chat_id}:{filter_delayed}"
-        auto_replies = cache_helper.get_key(cache_key)
+        metadata = cache_helper.get_key(_chat_metadata_key(chat_id))
+        if metadata is None:
+            metadata = _load_chat_metadata(chat_id)
+            if metadata is None:
+                metadata = await _fetch_chat_metadata(bot, chat_id)
+                if metadata is None:
+                    return str(chat_id)
+                with db_helper.session_scope() as db_session:
+                    _store_chat_metadata(db_session, chat_id, *metadata)
+                    db_session.commit()
+            cache_helper.set_key(_chat_metadata_key(chat_id), metadata, expire=2 * CHAT_METADATA_REFRESH_SECONDS)
+        return _render_chat_mention(chat_id, *metadata)
+    except Exception as e:
+        logger.error(f"Error: {traceback.format_exc()}")
+        return str(chat_id)
 
-        if auto_replies:
-            return json.loads(auto_replies)  # Deserialize JSON string back into Python object
 
-        with db_helper.session_scope() as db_session:
-            base_query = db_session.query(db_helper.Auto_Reply).filter(
-                db_helper.Auto_Reply.chat_id == chat_id,
-                or_(db_helper.Auto_Reply.enabled == True, db_helper.Auto_Reply.enabled == None)
-            )
+async def refresh_chat_metadata(bot, concurrency=None):
+    """Re-read the title and invite link of every active chat and store the ones that changed."""
+    with db_helper.session_scope() as db_session:
+        stored = {row.id: (row.chat_name, row.invite_link) for row in db_session.query(
+            db_helper.Chat.id, db_helper.Chat.chat_name, db_helper.Chat.invite_link
+        ).filter(db_helper.Chat.id < 0, db_helper.Chat.active == True).all()}
 
-            if filter_delayed:
-                current_time = datetime.now(timezone.utc)
-                auto_replies = base_query.filter(
-                    or_(
-                        db_helper.Auto_Reply.last_reply_time == None,
-                        func.extract('epoch', func.now() - db_helper.Auto_Reply.last_reply_time) > db_helper.Auto_Reply.reply_delay
-                    )
-                ).all()
-            else:
-                auto_replies = base_query.all()
-
-            auto_replies_list = [{
-                'id': ar.id,
-                'trigger': ar.trigger,
-                'reply': ar.reply,
-                'reply_delay': ar.reply_delay,
-                'last_reply_time': ar.last_reply_time.isoformat() if ar.last_reply_time else None,
-                'enabled': getattr(ar, 'enabled', True)  # default to True if not present
-            } for ar in auto_replies]
-
-            cache_helper.set_key(cache_key, json.dumps(auto_replies_list), expire=3600)
-            return auto_replies_list
-    except Exception as e:
-        logger.error(f"Error fetching auto replies for chat_id {chat_id}: {traceback.format_exc()}")
-        return []
+    semaphore = asyncio.Semaphore(concurrency or CHAT_METADATA_REFRESH_CONCURRENCY)
+    fetched = {}
 
-@sentry_profile()
-async def update_last_reply_time_and_increment_count(chat_id, auto_reply_id, new_time):
-    try:
-        with db_helper.session_scope() as db_session:
-            auto_reply = db_session.query(db_helper.Auto_Reply).filter(
-                db_helper.Auto_Reply.chat_id == chat_id,
-                db_helper.Auto_Reply.id == auto_reply_id
-            ).one_or_none()
-
-            if auto_reply:
-                auto_reply.last_reply_time = new_time
-                if auto_reply.usage_count is None:
-                    auto_reply.usage_count = 1  # Initialize it if it's null
-                else:
-                    auto_reply.usage_count += 1  # Otherwise, increment it
-                db_session.commit()
-                cache_helper.delete_key(f"auto_replies:{chat_id}:True")
-                cache_helper.delete_key(f"auto_replies:{chat_id}:False")
-                return True
-    except Exception as e:
-        logger.error(f"Error updating last reply time for chat_id {chat_id}, auto_reply_id {auto_reply_id}, and incrementing usage count: {traceback.format_exc()}")
-        return False
+    async def refresh(chat_id):
+        async with semaphore:
+            for attempt in range(3):
+                try:
+                    fetched[chat_id] = await _fetch_chat_metadata(bot, chat_id)
+                    return
+                except RetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                except Exception:
+                    logger.error(f"Error refreshing metadata of chat {chat_id}: {traceback.format_exc()}")
+                    return
+
+    started_at = time.monotonic()
+    await asyncio.gather(*(refresh(chat_id) for chat_id in stored))
+
+    changed = 0
+    with db_helper.session_scope() as db_session:
+        for chat_id, metadata in fetched.items():
+            if metadata is None:
+                continue
+            if metadata != stored[chat_id]:
+                changed += _store_chat_metadata(db_session, chat_id, *metadata)
+            cache_helper.set_key(_chat_metadata_key(chat_id), metadata, expire=2 * CHAT_METADATA_REFRESH_SECONDS,
+                                 invalidate=metadata != stored[chat_id])
+        db_session.commit()
+
+    logger.info(f"Refreshed metadata of {len(fetched)}/{len(stored)} chats in {time.monotonic() - started_at:.1f}s, {changed} changed")
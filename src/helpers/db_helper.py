@@ -2,7 +2,8 @@ from sqlalchemy import create_engine, BigInteger, Boolean, Column, DateTime, Ide
 from sqlalchemy.orm import Session, DeclarativeBase, declared_attr, relationship, backref
 from sqlalchemy.sql.sqltypes import NullType
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import func
+from sqlalchemy import func, event, cast
+from sqlalchemy.types import TypeDecorator
 from pgvector.sqlalchemy import Vector
 
 import psycopg2
@@ -12,26 +13,55 @@ import inspect #we need this to get current file name path
 import traceback
 import uuid
 import threading
+import time
+import re
+import functools
+import collections
+import contextvars
 from contextlib import contextmanager
 
 import src.helpers.logging_helper as logging_helper
+import src.helpers.db_pool_helper as db_pool_helper
 
 logger = logging_helper.get_logger()
 
+@contextmanager
 def connect():
-    conn = None
+    """
+    Raw psycopg2 connection borrowed from the shared pool, for scripts that work with cursors directly.
+    Commits on success, rolls back on error and always returns the connection to the pool.
+    """
+    conn = (replica_db_engine if use_read_replica.get() else db_engine).raw_connection()
     try:
-        conn = psycopg2.connect(user=os.getenv('ENV_DB_USER'),
-                                password=os.getenv('ENV_DB_PASSWORD'),
-                                host=os.getenv('ENV_DB_HOST'),
-                                port=os.getenv('ENV_DB_PORT'),
-                                database=os.getenv('ENV_DB_DATABASE'))
-        return conn
-    except (Exception, psycopg2.DatabaseError) as error:
-        #write admin log mentioning file name and error
-        logger.error(f"Error: {traceback.format_exc()}")
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+# OpenAI text-embedding-3-small
+EMBEDDING_DIMENSIONS = 1536
+# Physical type of the tg_message_log embedding columns: 'vector' (float32) or 'halfvec' (float16).
+# Switching is done with src/cron/quantize_message_log_embeddings.py, this setting has to match its result.
+EMBEDDING_STORAGE = os.getenv('ENV_EMBEDDING_STORAGE', 'vector')
+
+
+class Embedding(TypeDecorator):
+    """
+    Embedding column stored either as `vector` or as `halfvec`. Values always travel as float32 `vector`:
+    Postgres converts to the storage type on write and back on read, so callers never see the quantized form.
+    """
+    impl = Vector
+    cache_ok = True
 
-        return None
+    def bind_expression(self, bindvalue):
+        return cast(bindvalue, Vector)
+
+    def column_expression(self, col):
+        return cast(col, Vector)
 
 
 class Base(DeclarativeBase):
@@ -168,9 +198,29 @@ class Chat(Base):
     user_statuses = relationship('User_Status', back_populates='chat')
     user_ratings = relationship('User_Rating', back_populates='chat')
 
+
+class Chat_Bot_Capability(Base):
+    """
+    What the bot may do in a chat, as last reported by Telegram (bot_admin_permissions_check cron and
+    my_chat_member updates). Keyed by the Telegram chat id without a foreign key, so the row of a group
+    that migrated to a supergroup survives the tg_chat id change and keeps saying where it went.
+    """
+    __table_args__ = (PrimaryKeyConstraint('chat_id', name='chat_bot_capability_pkey'),)
+
+    chat_id = Column(BigInteger, nullable=False)
+    chat_type = Column(String, nullable=True)  # group / supergroup / channel
+    status = Column(String, nullable=False)  # the bot's ChatMember status: creator, administrator, member, left, kicked...
+    can_restrict = Column(Boolean, nullable=False, server_default=text('false'))
+    can_delete = Column(Boolean, nullable=False, server_default=text('false'))
+    migrated_to_chat_id = Column(BigInteger, nullable=True)
+    updated_at = Column(DateTime(True), server_default=text('now()'))
+
+
 class Message_Deletion(Base):
     __table_args__ = (
         PrimaryKeyConstraint('id', name='message_deletion_pkey'),
+        # Pending timed deletions, polled by the deletion scheduler by due time
+        Index('ix_tg_message_deletion_pending', 'scheduled_deletion_time', postgresql_where=text("status = 'scheduled' AND scheduled_deletion_time IS NOT NULL")),
     )
 
     id = Column(BigInteger, Identity(start=1, increment=1), primary_key=True)
@@ -209,6 +259,30 @@ class User_Rating(Base):
     judge = relationship('User', foreign_keys=[judge_id])
 
 
+# Running sums of tg_user_rating, kept in the same transaction as every insert into it (rating_helper.change_rating).
+# A grouped chat reads its ratings from User_Group_Rating_Total, any other chat from User_Rating_Total.
+class User_Rating_Total(Base):
+    __table_args__ = (
+        PrimaryKeyConstraint('user_id', 'chat_id', name='user_rating_total_pkey'),
+        Index('ix_tg_user_rating_total_chat_id_total', 'chat_id', 'total'),  # loading a chat's leaderboard
+    )
+
+    user_id = Column(BigInteger, ForeignKey(User.__table__.c.id, ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
+    chat_id = Column(BigInteger, ForeignKey(Chat.__table__.c.id, ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
+    total = Column(BigInteger, nullable=False, server_default=text('0'))
+
+
+class User_Group_Rating_Total(Base):
+    __table_args__ = (
+        PrimaryKeyConstraint('user_id', 'group_id', name='user_group_rating_total_pkey'),
+        Index('ix_tg_user_group_rating_total_group_id_total', 'group_id', 'total'),
+    )
+
+    user_id = Column(BigInteger, ForeignKey(User.__table__.c.id, ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
+    group_id = Column(Integer, ForeignKey(Chat_Group.__table__.c.id, ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
+    total = Column(BigInteger, nullable=False, server_default=text('0'))
+
+
 
 
 class User_Status(Base):
@@ -238,6 +312,44 @@ class User_Global_Ban(Base):
     created_at = Column(DateTime(True), server_default=text('now()'))
     reason = Column(String)
 
+# One global mute / ban / unmute / unban and its progress per chat (fanout_helper). Rows stay after the job
+# finishes, so the table doubles as a history of global actions and how long they took.
+class Moderation_Job(Base):
+    __table_args__ = (
+        PrimaryKeyConstraint('id', name='moderation_job_pkey'),
+        Index('ix_tg_moderation_job_status', 'status'),
+    )
+
+    id = Column(BigInteger, Identity(start=1, increment=1), primary_key=True)
+    action = Column(String, nullable=False)  # 'mute', 'ban', 'unmute' or 'unban'
+    user_id = Column(BigInteger, nullable=False, index=True)
+    reason = Column(String, nullable=True)
+    until_date = Column(DateTime(True), nullable=True)  # end of a temporary mute
+    status = Column(String, nullable=False, server_default=text("'pending'::character varying"))  # 'pending', 'running', 'done'
+    created_at = Column(DateTime(True), server_default=text('now()'))
+    started_at = Column(DateTime(True), nullable=True)
+    finished_at = Column(DateTime(True), nullable=True)
+    lease_until = Column(DateTime(True), nullable=True)  # the process running the job renews it; expired means abandoned
+    background = Column(Boolean, nullable=False, server_default=text('false'))  # second phase of a global action: chats the user was never seen in
+    chats_total = Column(Integer, nullable=False, server_default=text('0'))
+    chats_done = Column(Integer, nullable=False, server_default=text('0'))
+    chats_skipped = Column(Integer, nullable=False, server_default=text('0'))
+    chats_failed = Column(Integer, nullable=False, server_default=text('0'))
+    merged_requests = Column(JSON, nullable=False, server_default=text("'[]'::json"))  # later requests this job already covered: [{action, reason, requested_at}]
+
+
+class Moderation_Job_Chat(Base):
+    __table_args__ = (
+        PrimaryKeyConstraint('job_id', 'chat_id', name='moderation_job_chat_pkey'),
+    )
+
+    job_id = Column(BigInteger, ForeignKey(Moderation_Job.__table__.c.id, ondelete='CASCADE'), nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    status = Column(String, nullable=False, server_default=text("'pending'::character varying"))  # 'pending', 'done', 'skipped', 'failed'
+    attempts = Column(Integer, nullable=False, server_default=text('0'))
+    error = Column(String, nullable=True)
+    updated_at = Column(DateTime(True), nullable=True)
+
 #TODO:LOW: rename to User_Report
 class Report(Base):
     __table_args__ = (
@@ -255,8 +367,18 @@ class Report(Base):
 
 
 class Message_Log(Base):
+    """Every message the bot has seen.
+
+    The table is partitioned by month on created_at (see the partition maintenance cron), so the primary key
+    and the unique key include created_at. Uniqueness of (message_id, chat_id) across partitions is enforced
+    by Message_Log_Key.
+    """
     __table_args__ = (
-        UniqueConstraint('message_id', 'chat_id', name='uix_message_id_chat_id'),
+        PrimaryKeyConstraint('id', 'created_at', name='message_log_pkey'),
+        UniqueConstraint('message_id', 'chat_id', 'created_at', name='uix_message_id_chat_id_created_at'),
+        Index('ix_tg_message_log_user_id_created_at', 'user_id', 'created_at'),
+        Index('ix_tg_message_log_chat_id_media_group_id', 'chat_id', 'media_group_id'),  # Album siblings lookup
+        {'postgresql_partition_by': 'RANGE (created_at)'},
     )
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
@@ -273,10 +395,10 @@ class Message_Log(Base):
     reporting_id = Column(BigInteger, ForeignKey(User.__table__.c.id), nullable=True)
     reporting_id_nickname = Column(Text, nullable=True)
     reason_for_action = Column(Text)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    embedding = Column(Vector, nullable=True)  # Column to store message embeddings
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())  # Partition key
+    embedding = Column(Embedding, nullable=True)  # Column to store message embeddings
     image_description = Column(Text, nullable=True)
-    image_description_embedding = Column(Vector, nullable=True)
+    image_description_embedding = Column(Embedding, nullable=True)
     used_for_training = Column(Boolean, default=False, nullable=False)
     manually_verified = Column(Boolean, default=False, nullable=False)
     is_forwarded = Column(Boolean, nullable=True)  # Column to store is message is forwarded
@@ -289,6 +411,7 @@ class Message_Log(Base):
     forwarded_from_channel = Column(Boolean, nullable=True)  # True if forwarded from a channel (vs user/group)
     has_link = Column(Boolean, nullable=True)  # True if message contains URL links
     entity_count = Column(Integer, nullable=True)  # Number of entities (links, mentions, etc.)
+    media_group_id = Column(String, nullable=True)  # Album id, the same for all messages of one media group
 
     # Relationships
     user = relationship("User", foreign_keys=[user_id], backref="message_logs")
@@ -300,6 +423,22 @@ class Message_Log(Base):
 
 
 
+class Message_Log_Key(Base):
+    """(message_id, chat_id) -> created_at of the Message_Log row.
+
+    Keeps (message_id, chat_id) unique across tg_message_log partitions and tells the upsert which partition
+    an already logged message lives in.
+    """
+    __table_args__ = (
+        PrimaryKeyConstraint('message_id', 'chat_id', name='message_log_key_pkey'),
+    )
+
+    message_id = Column(BigInteger, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+
+
 #TODO: MED: I think we need to refactor this to split between trigger+reply and other configs. As a result we don't copy the same trigger+reply for each chat
 class Auto_Reply(Base):
     __table_args__ = (
@@ -505,11 +644,196 @@ class Chain_Execution_Log(Base):
 
 
 
-db_engine = create_engine(f"postgresql://{os.getenv('ENV_DB_USER')}:{os.getenv('ENV_DB_PASSWORD')}@{os.getenv('ENV_DB_HOST')}:{os.getenv('ENV_DB_PORT')}/{os.getenv('ENV_DB_DATABASE')}",
-                          pool_size = 10,
-                          max_overflow = 20)
+# ───────────── SQL instrumentation ─────────────
+# Every statement is timed and grouped by a normalized fingerprint. Statements are attributed to the handler
+# (and update) that issued them through query_scope(); a fingerprint repeated many times inside one scope is
+# flagged as a possible N+1 pattern.
+
+QUERY_STATS_SAMPLE_SIZE = 1000  # latency / per-invocation samples kept per handler
+N_PLUS_ONE_THRESHOLD = int(os.getenv('ENV_DB_N_PLUS_ONE_THRESHOLD', '10'))
+N_PLUS_ONE_LOG_INTERVAL_SECONDS = 3600
+FINGERPRINT_STATS_MAX_SIZE = 2000  # least used fingerprints are dropped beyond this
+
+current_query_scope = contextvars.ContextVar('current_query_scope', default=None)
+
+
+class QueryScope:
+    __slots__ = ('handler', 'update_id', 'query_count', 'fingerprint_counts')
+
+    def __init__(self, handler, update_id=None):
+        self.handler = handler
+        self.update_id = update_id
+        self.query_count = 0
+        self.fingerprint_counts = collections.Counter()
+
+
+class HandlerQueryStats:
+    def __init__(self):
+        self.invocations = 0
+        self.queries = 0
+        self.latencies = collections.deque(maxlen=QUERY_STATS_SAMPLE_SIZE)
+        self.queries_per_invocation = collections.deque(maxlen=QUERY_STATS_SAMPLE_SIZE)
+        self.n_plus_one = collections.Counter()  # fingerprint -> number of scopes it was flagged in
+
+
+handler_query_stats = collections.defaultdict(HandlerQueryStats)
+fingerprint_query_stats = collections.defaultdict(lambda: [0, 0.0])  # fingerprint -> [count, total seconds]
+n_plus_one_last_logged = {}
+query_stats_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=4096)
+def get_statement_fingerprint(statement):
+    """
+    Normalize a SQL statement: literals and parameters become ?, IN lists and multi-row VALUES collapse,
+    whitespace is squashed.
+    """
+    fingerprint = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    fingerprint = re.sub(r"%\(\w+\)s|%s|\$\d+|\b\d+(?:\.\d+)?\b", '?', fingerprint)
+    fingerprint = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", '(?+)', fingerprint)
+    fingerprint = re.sub(r"\(\s*\?\+?\s*\)(?:\s*,\s*\(\s*\?\+?\s*\))+", '(?+)+', fingerprint)
+    return ' '.join(fingerprint.split())
+
+
+def get_query_callers(limit=3):
+    """Innermost project functions (outside db_helper) on the current stack, for N+1 reports."""
+    callers = []
+    for frame in reversed(traceback.extract_stack()):
+        if f"{os.sep}src{os.sep}" in frame.filename and not frame.filename.endswith('db_helper.py'):
+            callers.append(frame.name)
+            if len(callers) == limit:
+                break
+    return callers
+
+
+def evict_fingerprint_stats():
+    """Drop the least used tenth of the fingerprints, so eviction doesn't sort on every new one. Caller holds the lock."""
+    least_used = sorted(fingerprint_query_stats.items(), key=lambda item: item[1][0])
+    for fingerprint, _ in least_used[:max(1, FINGERPRINT_STATS_MAX_SIZE // 10)]:
+        del fingerprint_query_stats[fingerprint]
+
+
+def record_query(statement, elapsed):
+    fingerprint = get_statement_fingerprint(statement)
+    scope = current_query_scope.get()
+    handler = scope.handler if scope is not None else 'unscoped'
+
+    with query_stats_lock:
+        stats = handler_query_stats[handler]
+        stats.queries += 1
+        stats.latencies.append(elapsed)
+        if fingerprint not in fingerprint_query_stats and len(fingerprint_query_stats) >= FINGERPRINT_STATS_MAX_SIZE:
+            evict_fingerprint_stats()
+        fingerprint_stats = fingerprint_query_stats[fingerprint]
+        fingerprint_stats[0] += 1
+        fingerprint_stats[1] += elapsed
+
+        if scope is None:
+            return
+        scope.query_count += 1
+        scope.fingerprint_counts[fingerprint] += 1
+        if scope.fingerprint_counts[fingerprint] != N_PLUS_ONE_THRESHOLD:
+            return
+        stats.n_plus_one[fingerprint] += 1
+        now = time.monotonic()
+        if now - n_plus_one_last_logged.get((handler, fingerprint), -N_PLUS_ONE_LOG_INTERVAL_SECONDS) < N_PLUS_ONE_LOG_INTERVAL_SECONDS:
+            return
+        n_plus_one_last_logged[(handler, fingerprint)] = now
+
+    logger.warning(
+        f"Possible N+1 in {handler} (update {scope.update_id}): {N_PLUS_ONE_THRESHOLD}+ executions of "
+        f"'{fingerprint[:300]}' called from {' <- '.join(get_query_callers())}"
+    )
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_start_time = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start_time = getattr(context, '_query_start_time', None)
+        if start_time is not None:
+            record_query(statement, time.perf_counter() - start_time)
+
+
+@contextmanager
+def query_scope(handler, update_id=None):
+    """Attribute every statement executed inside the block to `handler` (and `update_id`)."""
+    scope = QueryScope(handler, update_id)
+    token = current_query_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        current_query_scope.reset(token)
+        with query_stats_lock:
+            stats = handler_query_stats[handler]
+            stats.invocations += 1
+            stats.queries_per_invocation.append(scope.query_count)
+
+
+def get_percentiles(samples, percentiles=(50, 95, 99)):
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{p}": None for p in percentiles}
+    return {f"p{p}": ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] for p in percentiles}
+
+
+def get_query_stats(top=20):
+    """Per-handler query counts and latency percentiles plus the most expensive fingerprints."""
+    with query_stats_lock:
+        handlers = {}
+        for handler, stats in handler_query_stats.items():
+            latencies_ms = get_percentiles(stats.latencies)
+            handlers[handler] = {
+                'invocations': stats.invocations,
+                'queries': stats.queries,
+                'queries_per_invocation': get_percentiles(stats.queries_per_invocation),
+                'latency_ms': {k: round(v * 1000, 2) if v is not None else None for k, v in latencies_ms.items()},
+                'n_plus_one': dict(stats.n_plus_one.most_common(top)),
+            }
+        fingerprints = sorted(fingerprint_query_stats.items(), key=lambda item: item[1][1], reverse=True)[:top]
+
+    return {
+        'handlers': handlers,
+        'top_fingerprints': [
+            {'fingerprint': fingerprint, 'count': count, 'total_ms': round(total * 1000, 2)}
+            for fingerprint, (count, total) in fingerprints
+        ],
+    }
+
+
+db_engine = db_pool_helper.create_pooled_engine()
+instrument_engine(db_engine)
 Session = sessionmaker(bind=db_engine)
 
+# Optional read replica for heavy, lag-tolerant reads. Without ENV_DB_REPLICA_HOST everything stays on the primary.
+replica_db_engine = None
+replica_url = db_pool_helper.get_replica_database_url()
+if replica_url:
+    replica_db_engine = db_pool_helper.create_pooled_engine(url=replica_url, name='replica')
+    instrument_engine(replica_db_engine)
+    # Also protects a primary-hosted read-only role from accidental writes
+    replica_db_engine = replica_db_engine.execution_options(postgresql_readonly=True)
+ReplicaSession = sessionmaker(bind=replica_db_engine) if replica_db_engine is not None else Session
+
+use_read_replica = contextvars.ContextVar('use_read_replica', default=False)
+
+
+@contextmanager
+def read_replica():
+    """
+    Route session_scope() and connect() inside the block to the read replica.
+    Only wrap reads that tolerate replication lag and never write: the replica connection is read-only.
+    """
+    token = use_read_replica.set(replica_db_engine is not None)
+    try:
+        yield
+    finally:
+        use_read_replica.reset(token)
+
 # Global counter for open sessions
 open_session_count = 0
 session_count_lock = threading.Lock()
@@ -524,7 +848,7 @@ def session_scope():
     #     open_session_count += 1
     # logger.info(f"Starting a new database session {session_id}. Open sessions: {open_session_count}")
 
-    session = Session()
+    session = ReplicaSession() if use_read_replica.get() else Session()
 
     try:
         yield session
@@ -0,0 +1,138 @@
+"""Connection pooling shared by every entry point (dispatcher, CAS feed listener, cron scripts).
+
+Each process type gets its own pool size so overlapping crons can't exhaust Postgres connection slots.
+The pool works behind PgBouncer in transaction mode: psycopg2 does not use server-side prepared
+statements, nothing relies on session state (SET, advisory locks, temp tables), and every connection
+is rolled back when it returns to the pool.
+"""
+import os
+import sys
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+
+import src.helpers.logging_helper as logging_helper
+
+logger = logging_helper.get_logger()
+
+# (pool_size, max_overflow) per process type, overridable with ENV_DB_POOL_SIZE / ENV_DB_MAX_OVERFLOW
+POOL_SETTINGS = {
+    'dispatcher': (10, 20),
+    'cas_feed_listener': (2, 3),
+    'cron': (2, 2),
+}
+
+SATURATION_LOG_INTERVAL_SECONDS = 60
+
+
+def get_process_type():
+    """ENV_DB_PROCESS_TYPE if set, otherwise guessed from the script that started the process."""
+    process_type = os.getenv('ENV_DB_PROCESS_TYPE')
+    if process_type:
+        return process_type
+
+    script = os.path.abspath(sys.argv[0]) if sys.argv and sys.argv[0] else ''
+    if os.path.basename(script) == 'cas_feed_listener.py':
+        return 'cas_feed_listener'
+    if f"{os.sep}cron{os.sep}" in script:
+        return 'cron'
+    return 'dispatcher'
+
+
+def get_database_url():
+    return (f"postgresql://{os.getenv('ENV_DB_USER')}:{os.getenv('ENV_DB_PASSWORD')}"
+            f"@{os.getenv('ENV_DB_HOST')}:{os.getenv('ENV_DB_PORT')}/{os.getenv('ENV_DB_DATABASE')}")
+
+
+def get_replica_database_url():
+    """URL of the optional read replica (ENV_DB_REPLICA_HOST), None when no replica is configured.
+
+    Any ENV_DB_REPLICA_* setting that is not set falls back to the primary's value, so a read-only role
+    on the primary only needs ENV_DB_REPLICA_HOST plus ENV_DB_REPLICA_USER / ENV_DB_REPLICA_PASSWORD.
+    """
+    host = os.getenv('ENV_DB_REPLICA_HOST')
+    if not host:
+        return None
+
+    def setting(name):
+        return os.getenv(f'ENV_DB_REPLICA_{name}') or os.getenv(f'ENV_DB_{name}')
+
+    return (f"postgresql://{setting('USER')}:{setting('PASSWORD')}"
+            f"@{host}:{setting('PORT')}/{setting('DATABASE')}")
+
+
+class PoolStats:
+    """Saturation counters for one engine's pool, updated from pool events."""
+
+    def __init__(self, engine, pool_size, max_overflow):
+        self.engine = engine
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.checkouts = 0
+        self.saturated_checkouts = 0
+        self.peak_checked_out = 0
+        self.last_saturation_log = 0.0
+        self.lock = threading.Lock()
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        checked_out = self.engine.pool.checkedout()
+        with self.lock:
+            self.checkouts += 1
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+            saturated = checked_out >= self.pool_size + self.max_overflow
+            if saturated:
+                self.saturated_checkouts += 1
+                should_log = time.monotonic() - self.last_saturation_log > SATURATION_LOG_INTERVAL_SECONDS
+                if should_log:
+                    self.last_saturation_log = time.monotonic()
+        if saturated and should_log:
+            logger.warning(f"DB pool saturated: {checked_out}/{self.pool_size + self.max_overflow} connections checked out")
+
+    def as_dict(self):
+        pool = self.engine.pool
+        with self.lock:
+            return {
+                'pool_size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': pool.overflow(),
+                'checkouts': self.checkouts,
+                'saturated_checkouts': self.saturated_checkouts,
+                'peak_checked_out': self.peak_checked_out,
+            }
+
+
+pool_stats = {}
+
+
+def create_pooled_engine(url=None, process_type=None, name='primary'):
+    """Create an engine sized for this process type and register its pool metrics under `name`."""
+    process_type = process_type or get_process_type()
+    default_size, default_overflow = POOL_SETTINGS.get(process_type, POOL_SETTINGS['cron'])
+    pool_size = int(os.getenv('ENV_DB_POOL_SIZE', default_size))
+    max_overflow = int(os.getenv('ENV_DB_MAX_OVERFLOW', default_overflow))
+
+    engine = create_engine(
+        url or get_database_url(),
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=int(os.getenv('ENV_DB_POOL_TIMEOUT', '30')),
+        pool_recycle=int(os.getenv('ENV_DB_POOL_RECYCLE', '1800')),
+        pool_pre_ping=True,
+        pool_reset_on_return='rollback',
+        connect_args={'application_name': f"tg_community_manager:{process_type}"},
+    )
+
+    stats = PoolStats(engine, pool_size, max_overflow)
+    event.listen(engine, 'checkout', stats.on_checkout)
+    pool_stats[name] = stats
+
+    logger.debug(f"DB pool '{name}' for {process_type}: pool_size={pool_size}, max_overflow={max_overflow}")
+    return engine
+
+
+def get_pool_stats():
+    """Return {engine name: pool metrics} for every engine created in this process."""
+    return {name: stats.as_dict() for name, stats in pool_stats.items()}
@@ -0,0 +1,199 @@
+import asyncio
+import math
+import os
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import update
+
+import src.helpers.db_helper as db_helper
+import src.helpers.logging_helper as logging_helper
+import src.helpers.chat_helper as chat_helper
+
+logger = logging_helper.get_logger()
+
+# Delayed message deletions (send_message(delete_after=...), delete_message(delay_seconds=...),
+# schedule_message_deletion) are rows in tg_message_deletion plus an entry in one in-process timing wheel.
+# The dispatcher runs the wheel: every DB_POLL_SECONDS (and at startup) it loads the scheduled rows due within the
+# next LOOKAHEAD_SECONDS, which covers rows written by other processes (crons, the CAS listener) and rows pending
+# before a restart, and it deletes what is due with one deleteMessages call per chat.
+
+WHEEL_SLOTS = 3600  # one turn of the wheel is an hour at one-second ticks, later deletions wait whole turns
+TICK_SECONDS = 1.0
+DB_POLL_SECONDS = int(os.getenv('ENV_DELETION_POLL_INTERVAL', '60'))
+LOOKAHEAD_SECONDS = 2 * DB_POLL_SECONDS
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel: `slots` buckets visited one per tick. An item due in n ticks goes into bucket
+    (position + n) % slots with (n - 1) // slots remaining turns, so adding is O(1) and a tick only looks
+    at one bucket, however many items are waiting.
+    """
+
+    def __init__(self, slots=WHEEL_SLOTS, tick_seconds=TICK_SECONDS):
+        self.buckets = [[] for _ in range(slots)]
+        self.tick_seconds = tick_seconds
+        self.position = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, delay_seconds, item):
+        ticks = max(1, math.ceil(delay_seconds / self.tick_seconds))
+        self.buckets[(self.position + ticks) % len(self.buckets)].append([(ticks - 1) // len(self.buckets), item])
+        self.size += 1
+
+    def advance(self):
+        """Move one tick forward and return the items that became due."""
+        self.position = (self.position + 1) % len(self.buckets)
+        bucket = self.buckets[self.position]
+        due = [item for turns, item in bucket if turns == 0]
+        if due:
+            bucket[:] = [entry for entry in bucket if entry[0] > 0]
+            self.size -= len(due)
+        for entry in bucket:
+            entry[0] -= 1
+        return due
+
+
+class DeletionScheduler:
+    def __init__(self):
+        self.wheel = TimingWheel()
+        self.scheduled_ids = set()  # tg_message_deletion ids in the wheel
+        self.running = False
+        self.deleted = 0
+
+    def add(self, deletion_id, chat_id, message_id, delete_at):
+        if deletion_id is not None:
+            if deletion_id in self.scheduled_ids:
+                return
+            self.scheduled_ids.add(deletion_id)
+        delay = (delete_at - datetime.now(timezone.utc)).total_seconds()
+        self.wheel.add(delay, (deletion_id, chat_id, message_id))
+
+    def load_pending(self):
+        """
+        Add the scheduled rows due within LOOKAHEAD_SECONDS that aren't in the wheel yet, overdue ones included.
+        Selecting by due time rather than by id also finds rows whose id was allocated before a higher one that
+        committed first. Returns how many were added.
+        """
+        with db_helper.session_scope() as db_session:
+            rows = db_session.query(
+                db_helper.Message_Deletion.id,
+                db_helper.Message_Deletion.chat_id,
+                db_helper.Message_Deletion.message_id,
+                db_helper.Message_Deletion.scheduled_deletion_time
+            ).filter(
+                db_helper.Message_Deletion.status == 'scheduled',
+                db_helper.Message_Deletion.scheduled_deletion_time.isnot(None),
+                db_helper.Message_Deletion.scheduled_deletion_time <= datetime.now(timezone.utc) + timedelta(seconds=LOOKAHEAD_SECONDS)
+            ).all()
+        added = 0
+        for row in rows:
+            if row.id not in self.scheduled_ids:
+                self.add(row.id, row.chat_id, row.message_id, row.scheduled_deletion_time)
+                added += 1
+        return added
+
+    def _claim(self, deletion_ids):
+        """Mark the rows deleted and return the ids that were still scheduled (not cancelled or done elsewhere)."""
+        with db_helper.session_scope() as db_session:
+            claimed = db_session.execute(
+                update(db_helper.Message_Deletion)
+                .where(db_helper.Message_Deletion.id.in_(deletion_ids), db_helper.Message_Deletion.status == 'scheduled')
+                .values(status='deleted')
+                .returning(db_helper.Message_Deletion.id)
+            ).fetchall()
+            db_session.commit()
+        return {row[0] for row in claimed}
+
+    async def delete_due(self, bot, due):
+        deletion_ids = [deletion_id for deletion_id, _, _ in due if deletion_id is not None]
+        self.scheduled_ids.difference_update(deletion_ids)
+        claimed = self._claim(deletion_ids) if deletion_ids else set()
+        messages = [
+            (chat_id, message_id) for deletion_id, chat_id, message_id in due
+            if deletion_id is None or deletion_id in claimed
+        ]
+        if messages:
+            self.deleted += await chat_helper.delete_messages(bot, messages)
+
+    async def run(self, bot):
+        """Tick forever. Ticks missed while a batch was being deleted are caught up at once."""
+        if self.running:
+            return
+        self.running = True
+        try:
+            logger.info(f"Message deletion scheduler started with {self.load_pending()} pending deletions")
+        except Exception:
+            logger.error(f"Error loading pending message deletions: {traceback.format_exc()}")
+
+        started_at = time.monotonic()
+        ticks = 0
+        last_poll = started_at
+        while True:
+            try:
+                await asyncio.sleep(max(0.0, started_at + (ticks + 1) * TICK_SECONDS - time.monotonic()))
+                due = []
+                while started_at + (ticks + 1) * TICK_SECONDS <= time.monotonic():
+                    due.extend(self.wheel.advance())
+                    ticks += 1
+                if due:
+                    await self.delete_due(bot, due)
+                if time.monotonic() - last_poll >= DB_POLL_SECONDS:
+                    last_poll = time.monotonic()
+                    self.load_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.error(f"Error in message deletion scheduler: {traceback.format_exc()}")
+
+    def stats(self):
+        return {'pending': len(self.wheel), 'deleted': self.deleted, 'running': self.running}
+
+
+scheduler = DeletionScheduler()
+
+
+def schedule_deletion(chat_id, message_id, delay_seconds=None, user_id=None, trigger_id=None):
+    """
+    Persist a deletion and, when delay_seconds is given and this process runs the wheel (the dispatcher), put it
+    on the wheel; other processes leave it to the dispatcher's next poll. Without delay_seconds the row only
+    waits for delete_scheduled_messages. Chats without a tg_chat row (private chats) can't be persisted; their
+    deletions live only in the dispatcher's wheel and are dropped anywhere else.
+    """
+    delete_at = datetime.now(timezone.utc) + timedelta(seconds=delay_seconds) if delay_seconds is not None else None
+    deletion_id = None
+    try:
+        with db_helper.session_scope() as db_session:
+            deletion = db_helper.Message_Deletion(
+                chat_id=chat_id,
+                user_id=user_id,
+                message_id=message_id,
+                trigger_id=trigger_id,
+                status='scheduled',
+                scheduled_deletion_time=delete_at
+            )
+            db_session.add(deletion)
+            db_session.commit()
+            deletion_id = deletion.id
+    except Exception:
+        if delete_at is None:
+            logger.error(f"Error scheduling message {message_id} in chat {chat_id} for deletion: {traceback.format_exc()}")
+            return False
+        if not scheduler.running:
+            logger.warning(f"Deletion of message {message_id} in chat {chat_id} could not be persisted and this "
+                           f"process doesn't run the deletion scheduler, the message won't be deleted")
+            return False
+        logger.warning(f"Deletion of message {message_id} in chat {chat_id} not persisted, keeping it in memory only")
+
+    if delete_at is not None and scheduler.running:
+        scheduler.add(deletion_id, chat_id, message_id, delete_at)
+    return True
+
+
+def get_stats():
+    return scheduler.stats()
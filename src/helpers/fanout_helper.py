@@ -0,0 +1,538 @@
+import asyncio
+import os
+import random
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, or_, text, update
+from sqlalchemy.dialects.postgresql import insert
+from telegram import ChatPermissions
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter
+
+import src.helpers.db_helper as db_helper
+import src.helpers.logging_helper as logging_helper
+import src.helpers.chat_helper as chat_helper
+import src.helpers.user_helper as user_helper
+
+logger = logging_helper.get_logger()
+
+# Runs a global mute / ban / unmute / unban as a persisted job: one tg_moderation_job row plus one
+# tg_moderation_job_chat row per chat, worked through by parallel workers that share one rate limiter.
+# A job interrupted by a restart is picked up again by resume_jobs once its lease has expired.
+#
+# run_fanout works in two phases: the chats the user is known to be in (tg_user_status) right away, then every
+# other active chat as a background job that only gets the rate limit while no urgent job is running.
+#
+# Requests are coordinated per user: a request already covered by an unfinished or recent job (a second mute,
+# a mute after a ban) only gets its reason recorded on that job, and a ban cancels the user's unfinished mutes.
+
+FANOUT_WORKERS = int(os.getenv('ENV_FANOUT_WORKERS', '8'))
+FANOUT_BACKGROUND_WORKERS = int(os.getenv('ENV_FANOUT_BACKGROUND_WORKERS', '2'))
+BOT_API_RATE_PER_SECOND = float(os.getenv('ENV_BOT_API_RATE_PER_SECOND', '25'))  # Telegram allows ~30/s per bot
+PER_CHAT_INTERVAL_SECONDS = float(os.getenv('ENV_FANOUT_PER_CHAT_INTERVAL', '1'))
+MAX_ATTEMPTS = int(os.getenv('ENV_FANOUT_MAX_ATTEMPTS', '5'))
+DEDUP_SECONDS = int(os.getenv('ENV_MODERATION_DEDUP_SECONDS', '600'))
+LEASE_SECONDS = 120
+LEASE_RENEW_SECONDS = LEASE_SECONDS / 4
+PROGRESS_FLUSH_SIZE = 50
+
+ACTIONS = ('mute', 'ban', 'unmute', 'unban')
+FINISHED_STATUSES = ('done', 'cancelled')
+
+# The user's latest job among these decides whether a new request of the action is already covered
+RELATED_ACTIONS = {
+    'mute': ('mute', 'ban', 'unmute', 'unban'),
+    'ban': ('ban', 'unban'),
+    'unmute': ('mute', 'unmute'),
+    'unban': ('ban', 'unban'),
+}
+# Unfinished jobs of these actions are cancelled by a new request of the action
+SUPERSEDED_ACTIONS = {
+    'mute': ('unmute',),
+    'ban': ('mute', 'unban'),
+    'unmute': ('mute',),
+    'unban': ('ban',),
+}
+
+
+class RateLimiter:
+    """
+    Spaces Bot API calls out to `rate` per second for the whole process, and calls to the same chat to one per
+    `per_chat_interval`. A RetryAfter pauses every caller, since Telegram's flood control applies to the bot.
+    Background callers wait while any urgent job is running (urgent_jobs > 0).
+    """
+
+    def __init__(self, rate, per_chat_interval):
+        self.interval = 1 / rate
+        self.per_chat_interval = per_chat_interval
+        self.next_slot = 0.0
+        self.chat_next_slot = {}
+        self.paused_until = 0.0
+        self.urgent_jobs = 0
+
+    async def acquire(self, chat_id, background=False):
+        while background and self.urgent_jobs:
+            await asyncio.sleep(0.5)
+
+        now = time.monotonic()
+        global_slot = max(now, self.next_slot, self.paused_until)
+        slot = max(global_slot, self.chat_next_slot.get(chat_id, 0.0))
+        # Counted from the slot actually used: a call held back by its chat must not leave its global slot to a
+        # later caller, which would then fire together with it
+        self.next_slot = slot + self.interval
+        self.chat_next_slot[chat_id] = slot + self.per_chat_interval
+        if len(self.chat_next_slot) > 10000:
+            self.chat_next_slot = {cid: t for cid, t in self.chat_next_slot.items() if t > now}
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+        # A RetryAfter may have arrived while we were waiting for our slot
+        while time.monotonic() < self.paused_until:
+            await asyncio.sleep(self.paused_until - time.monotonic() + random.uniform(0, 0.5))
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+rate_limiter = RateLimiter(BOT_API_RATE_PER_SECOND, PER_CHAT_INTERVAL_SECONDS)
+
+# action -> {'jobs', 'last_seconds', 'total_seconds', 'max_seconds'} for the jobs finished by this process
+fanout_stats = {}
+# requests of this process that were merged into an existing job / jobs they cancelled
+coordinator_stats = {'merged': 0, 'cancelled': 0}
+
+_running_job_ids = set()
+_cancelled_job_ids = set()  # running here, cancelled by a later request; their workers stop at the next chat
+
+
+def get_stats():
+    stats = {
+        action: dict(stats, avg_seconds=round(stats['total_seconds'] / stats['jobs'], 2))
+        for action, stats in fanout_stats.items()
+    }
+    stats['_coordinator'] = dict(coordinator_stats)
+    return stats
+
+
+def retry_after_seconds(error):
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+
+async def _call_action(bot, job, chat_id):
+    if job.action == 'mute':
+        await bot.restrict_chat_member(chat_id=chat_id, user_id=job.user_id, permissions=ChatPermissions.no_permissions(), until_date=job.until_date)
+    elif job.action == 'unmute':
+        await bot.restrict_chat_member(chat_id, job.user_id, permissions=chat_helper.DEFAULT_MEMBER_PERMISSIONS)
+    elif job.action == 'ban':
+        await bot.ban_chat_member(chat_id, job.user_id)
+    elif job.action == 'unban':
+        await bot.unban_chat_member(chat_id, job.user_id)
+
+
+def _handle_chat_migration(chat_id, new_chat_id):
+    """A group became a supergroup: move the chat (and everything referencing it) to the new id."""
+    chat_helper.set_chat_migrated(chat_id, new_chat_id)
+    with db_helper.session_scope() as db_session:
+        if db_session.query(db_helper.Chat.id).filter(db_helper.Chat.id == new_chat_id).first():
+            logger.info(f"Cannot update chat id from {chat_id} to {new_chat_id} as the new id already exists")
+            return
+        updated = db_session.query(db_helper.Chat).filter(db_helper.Chat.id == chat_id).update({'id': new_chat_id}, synchronize_session=False)
+        db_session.commit()
+        if updated:
+            logger.info(f"Updated chat id from {chat_id} to {new_chat_id}")
+        else:
+            logger.error(f"Could not find chat with id {chat_id} to update")
+
+
+async def _apply_in_chat(bot, job, chat_id):
+    """Run the job's action in one chat. Returns (status, attempts, error)."""
+    last_error = None
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        await rate_limiter.acquire(chat_id, background=job.background)
+        try:
+            await _call_action(bot, job, chat_id)
+            return 'done', attempt, None
+        except RetryAfter as e:
+            retry_after = retry_after_seconds(e)
+            logger.warning(f"Rate limit hit during global {job.action} in chat {chat_id}, pausing for {retry_after}s")
+            rate_limiter.pause(retry_after + random.uniform(0, 1))
+            last_error = f"RetryAfter {retry_after}s"
+        except ChatMigrated as e:
+            _handle_chat_migration(chat_id, e.new_chat_id)
+            chat_id = e.new_chat_id
+        except Forbidden as e:
+            # The bot was kicked or left: later jobs skip the chat until it is added back (my_chat_member)
+            chat_helper.set_bot_capability(chat_id, 'left')
+            return 'skipped', attempt, e.message
+        except BadRequest as e:
+            # Not enough rights, chat gone, user never joined... retrying won't help
+            return 'skipped', attempt, e.message
+        except NetworkError as e:
+            # Timeouts and connection errors: back off with jitter
+            last_error = e.message
+            await asyncio.sleep(min(30, 2 ** attempt) * random.uniform(0.5, 1.5))
+        except Exception as e:
+            logger.error(f"Unexpected error during global {job.action} of user {job.user_id} in chat {chat_id}: {traceback.format_exc()}")
+            return 'failed', attempt, str(e)
+    return 'failed', MAX_ATTEMPTS, f"gave up after {MAX_ATTEMPTS} attempts, last error: {last_error}"
+
+
+def _claim_job(job_id, owned=False):
+    """
+    Take the job's lease and return (id, action, user_id, reason, until_date, started_at, background); None if
+    another process holds the lease or the job is done. owned: the lease was taken by create_job in this process.
+    """
+    now = datetime.now(timezone.utc)
+    conditions = [db_helper.Moderation_Job.id == job_id, db_helper.Moderation_Job.status.notin_(FINISHED_STATUSES)]
+    if not owned:
+        conditions.append(or_(db_helper.Moderation_Job.lease_until.is_(None), db_helper.Moderation_Job.lease_until < now))
+    with db_helper.session_scope() as db_session:
+        job = db_session.execute(
+            update(db_helper.Moderation_Job)
+            .where(*conditions)
+            .values(
+                status='running',
+                lease_until=now + timedelta(seconds=LEASE_SECONDS),
+                started_at=func.coalesce(db_helper.Moderation_Job.started_at, now)
+            )
+            .returning(
+                db_helper.Moderation_Job.id,
+                db_helper.Moderation_Job.action,
+                db_helper.Moderation_Job.user_id,
+                db_helper.Moderation_Job.reason,
+                db_helper.Moderation_Job.until_date,
+                db_helper.Moderation_Job.started_at,
+                db_helper.Moderation_Job.background
+            )
+        ).first()
+        db_session.commit()
+        return job
+
+
+def _pending_chat_ids(job_id):
+    with db_helper.session_scope() as db_session:
+        return [row[0] for row in db_session.query(db_helper.Moderation_Job_Chat.chat_id).filter(
+            db_helper.Moderation_Job_Chat.job_id == job_id,
+            db_helper.Moderation_Job_Chat.status.in_(('pending', 'failed'))
+        ).all()]
+
+
+def _flush_progress(job_id, results):
+    """Store per-chat results and renew the lease. Returns False if the job was cancelled meanwhile."""
+    if not results:
+        return True
+    now = datetime.now(timezone.utc)
+    with db_helper.session_scope() as db_session:
+        for chat_id, status, attempts, error in results:
+            db_session.query(db_helper.Moderation_Job_Chat).filter(
+                db_helper.Moderation_Job_Chat.job_id == job_id,
+                db_helper.Moderation_Job_Chat.chat_id == chat_id
+            ).update({
+                'status': status,
+                'attempts': db_helper.Moderation_Job_Chat.attempts + attempts,
+                'error': error,
+                'updated_at': now
+            }, synchronize_session=False)
+        running = db_session.query(db_helper.Moderation_Job).filter(
+            db_helper.Moderation_Job.id == job_id,
+            db_helper.Moderation_Job.status == 'running'
+        ).update({'lease_until': now + timedelta(seconds=LEASE_SECONDS)}, synchronize_session=False)
+        db_session.commit()
+    results.clear()
+    return bool(running)
+
+
+def _renew_lease(job_id):
+    """Extend the lease of a running job. Returns False if the job is no longer running (cancelled elsewhere)."""
+    with db_helper.session_scope() as db_session:
+        running = db_session.query(db_helper.Moderation_Job).filter(
+            db_helper.Moderation_Job.id == job_id,
+            db_helper.Moderation_Job.status == 'running'
+        ).update({'lease_until': datetime.now(timezone.utc) + timedelta(seconds=LEASE_SECONDS)}, synchronize_session=False)
+        db_session.commit()
+    return bool(running)
+
+
+async def _keep_lease(job_id):
+    """
+    Renew the lease for as long as the job runs here. Progress flushes alone are not enough: a RetryAfter pause or a
+    background job waiting behind urgent ones can go longer than LEASE_SECONDS without 50 results.
+    """
+    while True:
+        await asyncio.sleep(LEASE_RENEW_SECONDS)
+        try:
+            if not _renew_lease(job_id):
+                _cancelled_job_ids.add(job_id)
+                return
+        except Exception:
+            logger.error(f"Error renewing the lease of moderation job {job_id}: {traceback.format_exc()}")
+
+
+def _finish_job(job_id):
+    """Mark the job done (unless it was cancelled), fill in its counters and return them."""
+    with db_helper.session_scope() as db_session:
+        counts = dict(db_session.query(db_helper.Moderation_Job_Chat.status, func.count()).filter(
+            db_helper.Moderation_Job_Chat.job_id == job_id
+        ).group_by(db_helper.Moderation_Job_Chat.status).all())
+        job = db_session.query(db_helper.Moderation_Job).filter(db_helper.Moderation_Job.id == job_id).one()
+        if job.status != 'cancelled':
+            job.status = 'done'
+            job.finished_at = datetime.now(timezone.utc)
+        job.lease_until = None
+        job.chats_done = counts.get('done', 0)
+        job.chats_skipped = counts.get('skipped', 0)
+        job.chats_failed = counts.get('failed', 0)
+        db_session.commit()
+        return {
+            'job_id': job_id,
+            'done': job.chats_done,
+            'skipped': job.chats_skipped,
+            'failed': job.chats_failed,
+            'cancelled': job.status == 'cancelled',
+            'seconds': (job.finished_at - job.started_at).total_seconds(),
+        }
+
+
+def _add_job(db_session, action, user_id, chat_ids, reason=None, until_date=None, background=False):
+    """
+    Add a job for chat_ids to the session and return its id. An urgent job is leased to the creating process,
+    so nobody else resumes it meanwhile; a background job is left unleased for whichever process claims it first.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown moderation action {action}")
+    chat_ids = list(dict.fromkeys(chat_ids))
+    job = db_helper.Moderation_Job(
+        action=action,
+        user_id=user_id,
+        reason=reason,
+        until_date=until_date,
+        chats_total=len(chat_ids),
+        background=background,
+        lease_until=None if background else datetime.now(timezone.utc) + timedelta(seconds=LEASE_SECONDS)
+    )
+    db_session.add(job)
+    db_session.flush()
+    if chat_ids:
+        db_session.execute(insert(db_helper.Moderation_Job_Chat), [{'job_id': job.id, 'chat_id': chat_id} for chat_id in chat_ids])
+    return job.id
+
+
+def create_job(action, user_id, chat_ids, reason=None, until_date=None, background=False):
+    """Persist a job for chat_ids, without coordination with the user's other jobs (see run_fanout)."""
+    with db_helper.session_scope() as db_session:
+        job_id = _add_job(db_session, action, user_id, chat_ids, reason, until_date, background)
+        db_session.commit()
+        return job_id
+
+
+def _covers(job, action, until_date):
+    """Whether an unfinished or recent job makes a new request of `action` unnecessary."""
+    if job.action == 'ban' and action == 'mute':
+        return True
+    if job.action != action:
+        return False
+    if action != 'mute' or job.until_date is None:
+        return True
+    # A mute that ends (noticeably) later than the one already applied has to run again
+    return until_date is not None and job.until_date >= until_date - timedelta(seconds=DEDUP_SECONDS)
+
+
+def _plan_fanout(action, user_id, urgent_chat_ids, other_chat_ids, reason, until_date):
+    """
+    Decide, under a per-user lock, whether a global action has to run. Returns (job_id, background_job_id,
+    covering_job_id): new jobs to run, or the existing job the request was merged into.
+    """
+    now = datetime.now(timezone.utc)
+    with db_helper.session_scope() as db_session:
+        # Transaction-level lock, released by the commit: safe behind PgBouncer in transaction mode
+        db_session.execute(
+            text("SELECT pg_advisory_xact_lock(hashtextextended('tg_moderation_job:' || :user_id, 0))"),
+            {'user_id': str(user_id)}
+        )
+
+        latest = db_session.query(db_helper.Moderation_Job).filter(
+            db_helper.Moderation_Job.user_id == user_id,
+            db_helper.Moderation_Job.action.in_(RELATED_ACTIONS[action]),
+            db_helper.Moderation_Job.status != 'cancelled',
+            or_(db_helper.Moderation_Job.status != 'done', db_helper.Moderation_Job.finished_at > now - timedelta(seconds=DEDUP_SECONDS))
+        ).order_by(db_helper.Moderation_Job.id.desc()).first()
+
+        if latest is not None and _covers(latest, action, until_date):
+            latest.merged_requests = list(latest.merged_requests or []) + [
+                {'action': action, 'reason': reason, 'requested_at': now.isoformat()}
+            ]
+            db_session.commit()
+            return None, None, latest.id
+
+        superseded_ids = [row[0] for row in db_session.query(db_helper.Moderation_Job.id).filter(
+            db_helper.Moderation_Job.user_id == user_id,
+            db_helper.Moderation_Job.action.in_(SUPERSEDED_ACTIONS[action]),
+            db_helper.Moderation_Job.status.notin_(FINISHED_STATUSES)
+        ).all()]
+        if superseded_ids:
+            db_session.query(db_helper.Moderation_Job).filter(db_helper.Moderation_Job.id.in_(superseded_ids)).update(
+                {'status': 'cancelled', 'finished_at': now, 'lease_until': None}, synchronize_session=False
+            )
+            db_session.query(db_helper.Moderation_Job_Chat).filter(
+                db_helper.Moderation_Job_Chat.job_id.in_(superseded_ids),
+                db_helper.Moderation_Job_Chat.status.in_(('pending', 'failed'))
+            ).update({'status': 'skipped', 'error': f"superseded by {action}", 'updated_at': now}, synchronize_session=False)
+
+        job_id = _add_job(db_session, action, user_id, urgent_chat_ids, reason, until_date) if urgent_chat_ids else None
+        background_job_id = None
+        if other_chat_ids:
+            background_job_id = _add_job(db_session, action, user_id, other_chat_ids, reason, until_date, background=True)
+        db_session.commit()
+
+    if superseded_ids:
+        coordinator_stats['cancelled'] += len(superseded_ids)
+        _cancelled_job_ids.update(job for job in superseded_ids if job in _running_job_ids)
+        logger.info(f"Global {action} of user {user_id} cancelled the unfinished jobs {superseded_ids}")
+    return job_id, background_job_id, None
+
+
+async def run_job(bot, job_id, owned=False, workers=None):
+    """Work through the job's remaining chats. Returns a summary dict, None if the job is held elsewhere."""
+    job = _claim_job(job_id, owned)
+    if job is None:
+        return None
+
+    if job.action == 'mute' and job.until_date is not None and job.until_date <= datetime.now(timezone.utc) + timedelta(seconds=30):
+        # Telegram treats an until_date less than 30s away as "forever"; the mute is over anyway
+        logger.info(f"Global mute job {job_id} of user {job.user_id} expired before it could finish")
+        return _finish_job(job_id)
+
+    _running_job_ids.add(job_id)
+    lease_keeper = asyncio.create_task(_keep_lease(job_id))
+    try:
+        return await _run_claimed_job(bot, job, workers)
+    finally:
+        lease_keeper.cancel()
+        _running_job_ids.discard(job_id)
+        _cancelled_job_ids.discard(job_id)
+
+
+async def _run_claimed_job(bot, job, workers):
+    job_id = job.id
+    cancelled = False
+
+    # Chats where the bot is known not to be able to do this are skipped without calling Telegram
+    pending_chat_ids = _pending_chat_ids(job_id)
+    ineligible = chat_helper.get_ineligible_chats(pending_chat_ids, job.action)
+    results = [(chat_id, 'skipped', 0, reason) for chat_id, reason in ineligible.items()]
+    queue = asyncio.Queue()
+    for chat_id in pending_chat_ids:
+        if chat_id not in ineligible:
+            queue.put_nowait(chat_id)
+
+    async def worker():
+        nonlocal cancelled
+        while not cancelled and job_id not in _cancelled_job_ids:
+            try:
+                chat_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                status, attempts, error = await _apply_in_chat(bot, job, chat_id)
+            except Exception as e:
+                logger.error(f"Error during global {job.action} of user {job.user_id} in chat {chat_id}: {traceback.format_exc()}")
+                status, attempts, error = 'failed', 1, str(e)
+            results.append((chat_id, status, attempts, error))
+            if len(results) >= PROGRESS_FLUSH_SIZE and not _flush_progress(job_id, results):
+                cancelled = True  # by a request handled in another process
+
+    if workers is None:
+        workers = FANOUT_BACKGROUND_WORKERS if job.background else FANOUT_WORKERS
+    if not job.background:
+        rate_limiter.urgent_jobs += 1
+    try:
+        await asyncio.gather(*(worker() for _ in range(workers)))
+    finally:
+        if not job.background:
+            rate_limiter.urgent_jobs -= 1
+    _flush_progress(job_id, results)
+    summary = _finish_job(job_id)
+
+    stats_key = f"{job.action}:background" if job.background else job.action
+    stats = fanout_stats.setdefault(stats_key, {'jobs': 0, 'last_seconds': 0.0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+    stats['jobs'] += 1
+    stats['last_seconds'] = round(summary['seconds'], 2)
+    stats['total_seconds'] += summary['seconds']
+    stats['max_seconds'] = round(max(stats['max_seconds'], summary['seconds']), 2)
+
+    logger.info(
+        f"Global {job.action}{' (background)' if job.background else ''} of user {job.user_id} finished in {summary['seconds']:.1f}s: {summary['done']} done, "
+        f"{summary['skipped']} skipped, {summary['failed']} failed (job {job_id}"
+        f"{', cancelled by a later request' if summary['cancelled'] else ''}). Reason: {job.reason}"
+    )
+    return summary
+
+
+def get_active_chat_ids():
+    with db_helper.session_scope() as db_session:
+        return [row[0] for row in db_session.query(db_helper.Chat.id).filter(
+            db_helper.Chat.id != 0,
+            db_helper.Chat.active == True
+        ).all()]
+
+
+# Background jobs started by this process; asyncio only keeps weak references to tasks
+_background_tasks = set()
+
+
+def _start_in_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def run_fanout(bot, action, user_id, known_chat_ids=None, exclude_chat_ids=(), reason=None, until_date=None):
+    """
+    Apply action to user_id in every active chat but exclude_chat_ids. Waits for the chats the user is known to be
+    in (known_chat_ids, by default get_user_chat_ids) and returns that phase's summary, None if there are none or
+    the request was merged into an unfinished or recent job of the user.
+    The other active chats are handled by a background job. Both jobs are persisted before anything runs, so
+    neither is lost on a restart.
+    """
+    excluded = set(exclude_chat_ids)
+    active_chat_ids = [chat_id for chat_id in get_active_chat_ids() if chat_id not in excluded]
+    if known_chat_ids is None:
+        known_chat_ids = user_helper.get_user_chat_ids(user_id)
+    known = set(known_chat_ids)
+    urgent_chat_ids = [chat_id for chat_id in active_chat_ids if chat_id in known]
+    other_chat_ids = [chat_id for chat_id in active_chat_ids if chat_id not in known]
+
+    job_id, background_job_id, covering_job_id = _plan_fanout(action, user_id, urgent_chat_ids, other_chat_ids, reason, until_date)
+    if covering_job_id is not None:
+        coordinator_stats['merged'] += 1
+        logger.info(f"Global {action} of user {user_id} is already covered by job {covering_job_id}, reason recorded there: {reason}")
+        return None
+
+    summary = await run_job(bot, job_id, owned=True) if job_id is not None else None
+    if background_job_id is not None:
+        _start_in_background(run_job(bot, background_job_id))
+    return summary
+
+
+async def resume_jobs(bot):
+    """
+    Start every unfinished job nobody holds (its process went away, or a background job not claimed yet). Jobs
+    running in this process are skipped even if their lease looks expired.
+    """
+    try:
+        with db_helper.session_scope() as db_session:
+            job_ids = [row[0] for row in db_session.query(db_helper.Moderation_Job.id).filter(
+                db_helper.Moderation_Job.status.notin_(FINISHED_STATUSES),
+                or_(db_helper.Moderation_Job.lease_until.is_(None), db_helper.Moderation_Job.lease_until < datetime.now(timezone.utc))
+            ).order_by(db_helper.Moderation_Job.background, db_helper.Moderation_Job.id).all()]
+        job_ids = [job_id for job_id in job_ids if job_id not in _running_job_ids]
+        for job_id in job_ids:
+            logger.info(f"Resuming moderation job {job_id}")
+            _start_in_background(run_job(bot, job_id))
+        return len(job_ids)
+    except Exception:
+        logger.error(f"Error resuming moderation jobs: {traceback.format_exc()}")
+        return 0
@@ -0,0 +1,217 @@
+import json
+import os
+import threading
+import traceback
+from collections import OrderedDict
+from time import time
+
+from sqlalchemy import or_
+
+import src.helpers.db_helper as db_helper
+import src.helpers.logging_helper as logging_helper
+import src.helpers.chat_helper as chat_helper
+
+logger = logging_helper.get_logger()
+
+# Per-chat compiled keyword matchers for auto-reply triggers and like/dislike words. A matcher is built on first
+# use and dropped by invalidate() when the chat's config or auto replies change (see the tg_chat_config NOTIFY
+# listener in chat_helper); MATCHER_MAX_AGE_SECONDS is only a safety net.
+MATCHER_MAX_CHATS = int(os.getenv('ENV_KEYWORD_MATCHER_MAX_CHATS', '5000'))
+MATCHER_MAX_AGE_SECONDS = 86400
+
+# How a keyword has to sit in the text to count
+WORD = 'word'  # between \b boundaries, like re.findall(r'\b' + re.escape(keyword) + r'\b', text)
+HASHTAG = 'hashtag'  # a whole whitespace separated token, like `keyword in text.split()`
+SUBSTRING = 'substring'  # anywhere
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == '_'  # what re's \w matches in str patterns
+
+
+def _is_boundary(text, position):
+    before = position > 0 and _is_word_char(text[position - 1])
+    after = position < len(text) and _is_word_char(text[position])
+    return before != after
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over lowercased keywords: one pass over the text finds every keyword occurrence,
+    however many keywords there are. Each keyword carries a mode (WORD, HASHTAG or SUBSTRING) and a value;
+    match() returns the values of the keywords found.
+    """
+
+    def __init__(self, keywords):
+        self.goto = [{}]  # state -> {char: next state}
+        self.fail = [0]
+        self.outputs = [[]]  # state -> [(keyword length, mode, value)] of the keywords ending here
+        for keyword, mode, value in keywords:
+            keyword = keyword.lower()
+            if not keyword or (mode == HASHTAG and any(char.isspace() for char in keyword)):
+                continue  # a keyword with whitespace is never a whole token
+            state = 0
+            for char in keyword:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                state = next_state
+            self.outputs[state].append((len(keyword), mode, value))
+
+        # Breadth-first, so the failure state of a node is always done before the node itself
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def __bool__(self):
+        return len(self.goto) > 1
+
+    def match(self, text):
+        """Set of the values of the keywords found in text (case-insensitive)."""
+        text = text.lower()
+        found = set()
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, mode, value in self.outputs[state]:
+                if value in found:
+                    continue
+                start = end - length
+                if mode == WORD:
+                    if not (_is_boundary(text, start) and _is_boundary(text, end)):
+                        continue
+                elif mode == HASHTAG:
+                    if (start > 0 and not text[start - 1].isspace()) or (end < len(text) and not text[end].isspace()):
+                        continue
+                found.add(value)
+        return found
+
+    def first(self, text):
+        """Lowest value found in text, None if there is none."""
+        found = self.match(text) if self else None
+        return min(found) if found else None
+
+
+_matchers = OrderedDict()  # (kind, chat_id) -> (built_at, matcher), least recently used first
+_lock = threading.Lock()
+# chat_id -> bumped by invalidate(), a matcher built from data read before the change must not be stored
+_generations = {}
+_clear_count = 0  # bumped by clear(), the same for every chat
+
+
+def _get(kind, chat_id, build):
+    key = (kind, chat_id)
+    with _lock:
+        entry = _matchers.get(key)
+        if entry is not None and time() - entry[0] < MATCHER_MAX_AGE_SECONDS:
+            _matchers.move_to_end(key)
+            return entry[1]
+        generation = (_clear_count, _generations.get(chat_id, 0))
+
+    matcher = build(chat_id)
+    with _lock:
+        if (_clear_count, _generations.get(chat_id, 0)) != generation:
+            return matcher  # invalidated while building, the next lookup builds again
+        _matchers[key] = (time(), matcher)
+        while len(_matchers) > MATCHER_MAX_CHATS:
+            _matchers.popitem(last=False)
+    return matcher
+
+
+def _build_auto_reply_matcher(chat_id):
+    """Matcher whose values are indexes into `replies` (enabled auto replies by id), so first() keeps the old order."""
+    with db_helper.session_scope() as db_session:
+        rows = db_session.query(
+            db_helper.Auto_Reply.id,
+            db_helper.Auto_Reply.trigger,
+            db_helper.Auto_Reply.reply,
+            db_helper.Auto_Reply.reply_delay,
+            db_helper.Auto_Reply.last_reply_time
+        ).filter(
+            db_helper.Auto_Reply.chat_id == chat_id,
+            or_(db_helper.Auto_Reply.enabled == True, db_helper.Auto_Reply.enabled == None)
+        ).order_by(db_helper.Auto_Reply.id).all()
+
+    keywords = []
+    replies = []
+    for row in rows:
+        try:
+            triggers = json.loads(row.trigger)
+        except json.JSONDecodeError:
+            logger.warning(f"Failed to parse auto-reply trigger: {row.trigger}")
+            continue
+        index = len(replies)
+        replies.append({
+            'id': row.id,
+            'triggers': triggers,
+            'reply': row.reply,
+            'reply_delay': row.reply_delay,
+            'last_reply_time': row.last_reply_time
+        })
+        keywords.extend((trigger, HASHTAG if trigger.startswith('#') else WORD, index)
+                        for trigger in triggers if isinstance(trigger, str))
+    matcher = KeywordMatcher(keywords)
+    matcher.replies = replies
+    return matcher
+
+
+def _build_rating_word_matcher(chat_id):
+    """Matcher with value 0 for like words and 1 for dislike words, so first() prefers likes like before."""
+    keywords = [(word, SUBSTRING, 0) for word in chat_helper.get_chat_config(chat_id, 'like_words') or () if word]
+    keywords += [(word, SUBSTRING, 1) for word in chat_helper.get_chat_config(chat_id, 'dislike_words') or () if word]
+    return KeywordMatcher(keywords)
+
+
+def get_auto_reply_matcher(chat_id):
+    """Compiled auto-reply triggers of the chat; matcher.replies holds the replies its values point to."""
+    return _get('auto_reply', chat_id, _build_auto_reply_matcher)
+
+
+def get_rating_word_matcher(chat_id):
+    return _get('rating_words', chat_id, _build_rating_word_matcher)
+
+
+def match_auto_replies(chat_id, text):
+    """Auto replies (by id) with a trigger in text."""
+    try:
+        matcher = get_auto_reply_matcher(chat_id)
+        return [matcher.replies[index] for index in sorted(matcher.match(text))] if matcher else []
+    except Exception:
+        logger.error(f"Error matching auto replies in chat {chat_id}: {traceback.format_exc()}")
+        return []
+
+
+def match_rating_word(chat_id, text):
+    """+1 if text contains a like word, -1 if it contains a dislike word (and no like word), None otherwise."""
+    try:
+        value = get_rating_word_matcher(chat_id).first(text)
+        return None if value is None else (+1 if value == 0 else -1)
+    except Exception:
+        logger.error(f"Error matching like/dislike words in chat {chat_id}: {traceback.format_exc()}")
+        return None
+
+
+def invalidate(chat_id):
+    with _lock:
+        _generations[chat_id] = _generations.get(chat_id, 0) + 1
+        for kind in ('auto_reply', 'rating_words'):
+            _matchers.pop((kind, chat_id), None)
+
+
+def clear():
+    global _clear_count
+    with _lock:
+        _clear_count += 1
+        _matchers.clear()
@@ -0,0 +1,149 @@
+import bisect
+import os
+import threading
+import traceback
+from collections import OrderedDict
+
+from sqlalchemy import func
+
+import src.helpers.db_helper as db_helper
+import src.helpers.logging_helper as logging_helper
+
+logger = logging_helper.get_logger()
+
+# Leaderboards are loaded from the rating totals on first use and then kept up to date by change_rating.
+# A chat that belongs to a group shares the group's leaderboard, exactly like its ratings.
+LEADERBOARD_MAX_SCOPES = int(os.getenv('ENV_LEADERBOARD_MAX_SCOPES', '500'))
+
+
+class Leaderboard:
+    """
+    Ratings of one chat or chat group, highest first (ties broken by user id).
+
+    `order` is a sorted list of (-total, user_id), so top-N is a slice and the rank of a user a binary search.
+    An update is a binary search plus a list insert/delete (a memmove, microseconds even for 100k users).
+    """
+
+    def __init__(self, totals):
+        self.totals = dict(totals)
+        self.order = sorted((-total, user_id) for user_id, total in self.totals.items())
+
+    def __len__(self):
+        return len(self.order)
+
+    def update(self, user_id, total):
+        old_total = self.totals.get(user_id)
+        if old_total is not None:
+            del self.order[bisect.bisect_left(self.order, (-old_total, user_id))]
+        self.totals[user_id] = total
+        bisect.insort(self.order, (-total, user_id))
+
+    def top(self, limit):
+        """[(user_id, total)] of the `limit` highest rated users."""
+        return [(user_id, -negated_total) for negated_total, user_id in self.order[:limit]]
+
+    def rank(self, user_id):
+        """1-based position of the user, None if the user has never been rated here."""
+        total = self.totals.get(user_id)
+        if total is None:
+            return None
+        return bisect.bisect_left(self.order, (-total, user_id)) + 1
+
+
+_leaderboards = OrderedDict()  # scope -> Leaderboard, least recently used first
+_lock = threading.Lock()
+
+
+def get_scope(chat_id, group_id=None):
+    """('group', group_id) for a grouped chat, ('chat', chat_id) otherwise."""
+    if group_id is None:
+        with db_helper.session_scope() as db_session:
+            group_id = db_session.query(db_helper.Chat.group_id).filter(db_helper.Chat.id == chat_id).scalar()
+    return ('group', group_id) if group_id is not None else ('chat', chat_id)
+
+
+def _load_totals(scope):
+    kind, scope_id = scope
+    with db_helper.session_scope() as db_session:
+        if kind == 'group':
+            rows = db_session.query(db_helper.User_Group_Rating_Total.user_id, db_helper.User_Group_Rating_Total.total).filter(
+                db_helper.User_Group_Rating_Total.group_id == scope_id
+            ).all()
+        else:
+            rows = db_session.query(db_helper.User_Rating_Total.user_id, db_helper.User_Rating_Total.total).filter(
+                db_helper.User_Rating_Total.chat_id == scope_id
+            ).all()
+    return dict(rows)
+
+
+def _load_ledger_totals(scope):
+    """Same as _load_totals, but summed from the tg_user_rating ledger."""
+    kind, scope_id = scope
+    with db_helper.session_scope() as db_session:
+        query = db_session.query(db_helper.User_Rating.user_id, func.sum(db_helper.User_Rating.change_value))
+        if kind == 'group':
+            query = query.join(db_helper.Chat, db_helper.Chat.id == db_helper.User_Rating.chat_id).filter(db_helper.Chat.group_id == scope_id)
+        else:
+            query = query.filter(db_helper.User_Rating.chat_id == scope_id)
+        rows = query.group_by(db_helper.User_Rating.user_id).all()
+    return {user_id: int(total) for user_id, total in rows}
+
+
+def get_leaderboard(scope):
+    with _lock:
+        leaderboard = _leaderboards.get(scope)
+        if leaderboard is not None:
+            _leaderboards.move_to_end(scope)
+            return leaderboard
+
+    leaderboard = Leaderboard(_load_totals(scope))
+    with _lock:
+        _leaderboards[scope] = leaderboard
+        while len(_leaderboards) > LEADERBOARD_MAX_SCOPES:
+            _leaderboards.popitem(last=False)
+    return leaderboard
+
+
+def apply_rating_change(scope, user_id, total):
+    """Record a committed rating total. Leaderboards that aren't loaded are skipped, they load the new value later."""
+    with _lock:
+        leaderboard = _leaderboards.get(scope)
+        if leaderboard is not None:
+            leaderboard.update(user_id, total)
+
+
+def get_top(chat_id, limit=10):
+    return get_leaderboard(get_scope(chat_id)).top(limit)
+
+
+def get_rank(chat_id, user_id):
+    """(rank, number of rated users) of the user in the chat's leaderboard; rank is None if never rated."""
+    leaderboard = get_leaderboard(get_scope(chat_id))
+    return leaderboard.rank(user_id), len(leaderboard)
+
+
+def verify_leaderboards():
+    """
+    Compare every loaded leaderboard with sums over the raw tg_user_rating ledger and replace the ones that
+    drifted. Returns (checked, replaced).
+    """
+    with _lock:
+        scopes = list(_leaderboards)
+
+    replaced = 0
+    for scope in scopes:
+        try:
+            ledger_totals = _load_ledger_totals(scope)
+            with _lock:
+                leaderboard = _leaderboards.get(scope)
+                if leaderboard is None or leaderboard.totals == ledger_totals:
+                    continue
+                differing = {user_id for user_id in leaderboard.totals.keys() | ledger_totals.keys()
+                             if leaderboard.totals.get(user_id) != ledger_totals.get(user_id)}
+                _leaderboards[scope] = Leaderboard(ledger_totals)
+            replaced += 1
+            logger.warning(f"Leaderboard {scope} differed from the rating ledger for {len(differing)} users "
+                           f"(e.g. {sorted(differing)[:10]}), reloaded from the ledger")
+        except Exception:
+            logger.error(f"Error verifying leaderboard {scope}: {traceback.format_exc()}")
+    return len(scopes), replaced
@@ -1,7 +1,10 @@
 import datetime
+import os
 import traceback
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy import func
+import sqlalchemy as sa
+from pgvector.sqlalchemy import Vector
 
 import src.helpers.db_helper as db_helper
 import src.helpers.logging_helper as logging_helper
@@ -12,6 +15,109 @@ logger = logging_helper.get_logger()
 # with spam detection part of the code. That will easier to filter and manually verify in batch. Not
 # going to use it in the prediction itself.
 
+# Columns that are merged on conflict: a NULL in the new values keeps whatever is already stored.
+MERGED_COLUMNS = (
+    'message_content', 'user_id', 'user_nickname', 'user_current_rating',
+    'is_spam', 'action_type', 'reporting_id', 'reporting_id_nickname',
+    'reason_for_action', 'embedding', 'manually_verified', 'is_forwarded',
+    'reply_to_message_id', 'spam_prediction_probability', 'raw_message',
+    'image_description', 'image_description_embedding',
+    'has_video', 'has_document', 'has_photo', 'forwarded_from_channel', 'has_link', 'entity_count',
+    'media_group_id'
+)
+
+_upsert_stmt = None
+
+# Near-duplicate spam sweep: cosine distance radius and the maximum number of neighbours fetched from the HNSW index
+NEAR_DUPLICATE_MAX_DISTANCE = float(os.getenv('ENV_SPAM_NEAR_DUPLICATE_MAX_DISTANCE', '0.05'))
+NEAR_DUPLICATE_LIMIT = int(os.getenv('ENV_SPAM_NEAR_DUPLICATE_LIMIT', '200'))
+
+# Same expression as the HNSW index on tg_message_log.embedding, for either storage type
+_embedding_type = f"{db_helper.EMBEDDING_STORAGE}({db_helper.EMBEDDING_DIMENSIONS})"
+_near_duplicate_stmt = sa.text(f"""
+    SELECT chat_id, message_id, user_id, created_at, distance
+    FROM (
+        SELECT chat_id, message_id, user_id, created_at,
+               (embedding::{_embedding_type}) <=> (:embedding)::{_embedding_type} AS distance
+        FROM tg_message_log
+        WHERE embedding IS NOT NULL
+          AND user_id <> :exclude_user_id
+        ORDER BY distance
+        LIMIT :limit
+    ) nearest
+    WHERE distance <= :max_distance
+    ORDER BY distance
+""").bindparams(sa.bindparam('embedding', type_=Vector(db_helper.EMBEDDING_DIMENSIONS)))
+
+
+def _get_upsert_stmt():
+    """
+    Build (once) the INSERT ... ON CONFLICT statement used by insert_or_update_message_log.
+
+    Every value is a bind parameter, so the statement is built a single time and SQLAlchemy reuses
+    its compiled form for every call. Missing fields are merged server-side with
+    COALESCE(EXCLUDED.col, tg_message_log.col) instead of reading the existing row first.
+
+    tg_message_log is partitioned by created_at, so the statement first claims (message_id, chat_id) in
+    tg_message_log_key. That returns the created_at of an already logged message, which routes the
+    conflict to the right partition.
+    """
+    global _upsert_stmt
+    if _upsert_stmt is not None:
+        return _upsert_stmt
+
+    table = db_helper.Message_Log.__table__
+    key_table = db_helper.Message_Log_Key.__table__
+    params = {
+        name: sa.bindparam(name, type_=table.c[name].type)
+        for name in MERGED_COLUMNS + ('message_id', 'chat_id', 'message_timestamp', 'created_at')
+    }
+
+    key_insert = insert(key_table).values(
+        message_id=params['message_id'],
+        chat_id=params['chat_id'],
+        created_at=params['created_at']
+    )
+    # The no-op update makes RETURNING yield the stored created_at when the key already exists
+    message_key = key_insert.on_conflict_do_update(
+        index_elements=['message_id', 'chat_id'],
+        set_={'message_id': key_insert.excluded.message_id}
+    ).returning(key_table.c.created_at).cte('message_key')
+
+    values = dict(params)
+    values['created_at'] = message_key.c.created_at
+    # user_id is NOT NULL, so a call that omits it can only update an existing row. Take the stored
+    # value in that case; for a brand new row this stays NULL and the insert fails as before.
+    values['user_id'] = func.coalesce(
+        params['user_id'],
+        sa.select(table.c.user_id).where(
+            table.c.message_id == params['message_id'],
+            table.c.chat_id == params['chat_id'],
+            table.c.created_at == message_key.c.created_at
+        ).scalar_subquery()
+    )
+    # manually_verified is NOT NULL with a False default
+    values['manually_verified'] = func.coalesce(params['manually_verified'], sa.false())
+
+    insert_stmt = insert(table).from_select(
+        list(values.keys()),
+        sa.select(*values.values()).select_from(message_key)
+    )
+
+    set_ = {
+        name: func.coalesce(insert_stmt.excluded[name], table.c[name])
+        for name in MERGED_COLUMNS
+    }
+    # EXCLUDED.manually_verified already carries the insert default, so merge with the raw parameter
+    set_['manually_verified'] = func.coalesce(params['manually_verified'], table.c.manually_verified)
+
+    _upsert_stmt = insert_stmt.on_conflict_do_update(
+        index_elements=['message_id', 'chat_id', 'created_at'],
+        set_=set_
+    ).returning(table.c.id)
+    return _upsert_stmt
+
+
 #TODO:MED: Add photo_descroption parameter (that we will get through recognition pf photo) to the message log. It will be used for spam detection and for manual verification. We can use it in the future for other things as well.
 def insert_or_update_message_log(
     chat_id,                 # mandatory
@@ -39,8 +145,13 @@ def insert_or_update_message_log(
     has_photo=None,
     forwarded_from_channel=None,
     has_link=None,
-    entity_count=None
+    entity_count=None,
+    media_group_id=None
 ):
+    """
+    Insert a message log row or update the existing (message_id, chat_id) row in one statement.
+    Parameters left as None keep their stored values.
+    """
     try:
         # Convert spam_prediction_probability to float if provided.
         if spam_prediction_probability is not None:
@@ -50,99 +161,45 @@ def insert_or_update_message_log(
                 logger.error(f"Invalid spam_prediction_probability value: {spam_prediction_probability}. Error: {e}")
                 spam_prediction_probability = None
 
-        # Respect database defaults for nullable=False boolean fields
-        if is_spam is None:
-            is_spam_present = False
-        else:
-            is_spam_present = True
+        # Albums are looked up by media_group_id, so take it from the raw message when not passed explicitly
+        if media_group_id is None and isinstance(raw_message, dict):
+            media_group_id = raw_message.get('media_group_id')
 
-        if manually_verified is None:
-            manually_verified_present = False
-        else:
-            manually_verified_present = True
+        now = datetime.datetime.now()
+        params = {
+            'message_id': message_id,
+            'chat_id': chat_id,
+            'message_content': message_content,
+            'user_id': user_id,
+            'user_nickname': user_nickname,
+            'user_current_rating': user_current_rating,
+            'message_timestamp': now,
+            'is_spam': is_spam,
+            'action_type': action_type,
+            'reporting_id': reporting_id,
+            'reporting_id_nickname': reporting_id_nickname,
+            'reason_for_action': reason_for_action,
+            'created_at': now,
+            'embedding': embedding,
+            'manually_verified': manually_verified,
+            'is_forwarded': is_forwarded,
+            'reply_to_message_id': reply_to_message_id,
+            'spam_prediction_probability': spam_prediction_probability,
+            'raw_message': raw_message,
+            'image_description': image_description,
+            'image_description_embedding': image_description_embedding,
+            # New spam detection features
+            'has_video': has_video,
+            'has_document': has_document,
+            'has_photo': has_photo,
+            'forwarded_from_channel': forwarded_from_channel,
+            'has_link': has_link,
+            'entity_count': entity_count,
+            'media_group_id': str(media_group_id) if media_group_id is not None else None
+        }
 
         with db_helper.session_scope() as db_session:
-            # Build a dictionary for the values to insert.
-            insert_values = {
-                'message_id': message_id,
-                'chat_id': chat_id,
-                'message_content': message_content,
-                'user_id': user_id,
-                'user_nickname': user_nickname,
-                'user_current_rating': user_current_rating,
-                'message_timestamp': datetime.datetime.now(),
-                'is_spam': is_spam,
-                'action_type': action_type,
-                'reporting_id': reporting_id,
-                'reporting_id_nickname': reporting_id_nickname,
-                'reason_for_action': reason_for_action,
-                'created_at': datetime.datetime.now(),
-                'embedding': embedding,
-                'manually_verified': manually_verified,
-                'is_forwarded': is_forwarded,
-                'reply_to_message_id': reply_to_message_id,
-                'spam_prediction_probability': spam_prediction_probability,
-                'raw_message': raw_message,
-                'image_description': image_description,
-                'image_description_embedding': image_description_embedding,
-                # New spam detection features
-                'has_video': has_video,
-                'has_document': has_document,
-                'has_photo': has_photo,
-                'forwarded_from_channel': forwarded_from_channel,
-                'has_link': has_link,
-                'entity_count': entity_count
-            }
-
-            if not is_spam_present:
-                insert_values.pop('is_spam')
-            if not manually_verified_present:
-                insert_values.pop('manually_verified')
-
-            # Try to get an existing row.
-            existing = db_session.query(db_helper.Message_Log).filter_by(
-                message_id=message_id, chat_id=chat_id
-            ).one_or_none()
-
-            # If a row exists, for any key that is still None, fill in from the existing row.
-            if existing is not None:
-                for key in (
-                    'user_id', 'user_nickname', 'user_current_rating', 'message_content',
-                    'action_type', 'reporting_id', 'reporting_id_nickname',
-                    'reason_for_action', 'is_spam', 'manually_verified', 'is_forwarded',
-                    'reply_to_message_id', 'spam_prediction_probability', 'embedding', 'raw_message',
-                    'image_description', 'image_description_embedding',
-                    'has_video', 'has_document', 'has_photo', 'forwarded_from_channel', 'has_link', 'entity_count'
-                ):
-                    if insert_values.get(key) is None:
-                        insert_values[key] = getattr(existing, key)
-            else:
-                # If no row exists, then a required field like user_id must be provided.
-                if insert_values.get('user_id') is None:
-                    raise ValueError("user_id must be provided when inserting a new message log row.")
-
-            # Build the update dictionary using only keys whose value is not None.
-            update_dict = {}
-            for key in (
-                'message_content', 'user_id', 'user_nickname', 'user_current_rating',
-                'is_spam', 'action_type', 'reporting_id', 'reporting_id_nickname',
-                'reason_for_action', 'embedding', 'manually_verified', 'is_forwarded',
-                'reply_to_message_id', 'spam_prediction_probability', 'raw_message',
-                'image_description', 'image_description_embedding',
-                'has_video', 'has_document', 'has_photo', 'forwarded_from_channel', 'has_link', 'entity_count'
-            ):
-                if insert_values.get(key) is not None:
-                    update_dict[key] = insert_values.get(key)
-
-            # Prepare the insert statement with a RETURNING clause.
-            insert_stmt = insert(db_helper.Message_Log).values(**insert_values).returning(db_helper.Message_Log.id)
-            # Use on_conflict_do_update with our update dictionary.
-            on_conflict_stmt = insert_stmt.on_conflict_do_update(
-                index_elements=['message_id', 'chat_id'],
-                set_=update_dict
-            ).returning(db_helper.Message_Log.id)
-            result = db_session.execute(on_conflict_stmt)
-            db_session.commit()
+            result = db_session.execute(_get_upsert_stmt(), params)
             row = result.fetchone()
             if row:
                 return row[0]
@@ -156,6 +213,70 @@ def insert_or_update_message_log(
 
 
 
+def relabel_user_messages(user_id, is_spam, manually_verified, reason_for_action=None, chat_id=None, only_unverified=False):
+    """
+    Set is_spam / manually_verified (and reason_for_action, if given) on the logged messages of user_id in one
+    UPDATE ... RETURNING: all of them, only those in chat_id, or only those not manually verified yet.
+    Returns [{chat_id, message_id, created_at}] of the relabeled rows, [] on error.
+    """
+    table = db_helper.Message_Log.__table__
+    values = {'is_spam': is_spam, 'manually_verified': manually_verified}
+    if reason_for_action is not None:
+        values['reason_for_action'] = reason_for_action
+    stmt = sa.update(table).where(table.c.user_id == user_id)
+    if chat_id is not None:
+        stmt = stmt.where(table.c.chat_id == chat_id)
+    if only_unverified:
+        stmt = stmt.where(table.c.manually_verified == False)
+    stmt = stmt.values(**values).returning(table.c.chat_id, table.c.message_id, table.c.created_at)
+    try:
+        with db_helper.session_scope() as db_session:
+            rows = db_session.execute(stmt).fetchall()
+            db_session.commit()
+            return [dict(row._mapping) for row in rows]
+    except Exception as e:
+        logger.error(f"Error relabeling messages of user {user_id}: {traceback.format_exc()}")
+        return []
+
+
+def relabel_messages(messages, is_spam, manually_verified):
+    """
+    Set is_spam / manually_verified on the given logged messages in one UPDATE ... FROM (VALUES ...).
+    `messages` are dicts with chat_id, message_id, created_at (routes the update to its partition) and
+    optionally reason_for_action. Returns the number of rows updated.
+    """
+    if not messages:
+        return 0
+    table = db_helper.Message_Log.__table__
+    relabeled = sa.values(
+        sa.column('chat_id', sa.BigInteger),
+        sa.column('message_id', sa.BigInteger),
+        sa.column('created_at', sa.DateTime(timezone=True)),
+        sa.column('reason_for_action', sa.Text),
+        name='relabeled'
+    ).data([
+        (message['chat_id'], message['message_id'], message['created_at'], message.get('reason_for_action'))
+        for message in messages
+    ])
+    stmt = sa.update(table).where(
+        table.c.chat_id == relabeled.c.chat_id,
+        table.c.message_id == relabeled.c.message_id,
+        table.c.created_at == relabeled.c.created_at
+    ).values(
+        is_spam=is_spam,
+        manually_verified=manually_verified,
+        reason_for_action=func.coalesce(relabeled.c.reason_for_action, table.c.reason_for_action)
+    )
+    try:
+        with db_helper.session_scope() as db_session:
+            updated = db_session.execute(stmt).rowcount
+            db_session.commit()
+            return updated
+    except Exception as e:
+        logger.error(f"Error relabeling {len(messages)} messages: {traceback.format_exc()}")
+        return 0
+
+
 def get_message_logs(
     chat_id=None,
     message_id=None,
@@ -258,3 +379,30 @@ def get_message_log_by_id(chat_id, message_id):
     except Exception as e:
         logger.error(f"Error retrieving message log by id: {traceback.format_exc()}")
         return None
+
+
+def find_near_duplicate_messages(embedding, exclude_user_id, max_distance=None, limit=None):
+    """
+    Messages of other users whose embedding is within `max_distance` (cosine) of `embedding`.
+
+    The nearest `limit` candidates come from the HNSW index on tg_message_log.embedding, the radius is applied
+    on top of them. Returns a list of dicts with chat_id, message_id, user_id, created_at and distance, closest first.
+    """
+    max_distance = NEAR_DUPLICATE_MAX_DISTANCE if max_distance is None else max_distance
+    limit = NEAR_DUPLICATE_LIMIT if limit is None else limit
+    try:
+        # A lagging replica only means a message logged in the last moments is swept by the next /spam
+        with db_helper.read_replica(), db_helper.session_scope() as db_session:
+            # ef_search bounds the candidate list of the index scan, it must be at least the LIMIT
+            db_session.execute(sa.text("SELECT set_config('hnsw.ef_search', :ef_search, true)"),
+                               {'ef_search': str(max(limit, 40))})
+            rows = db_session.execute(_near_duplicate_stmt, {
+                'embedding': embedding,
+                'exclude_user_id': exclude_user_id,
+                'limit': limit,
+                'max_distance': max_distance
+            }).fetchall()
+            return [dict(row._mapping) for row in rows]
+    except Exception as e:
+        logger.error(f"Error finding near-duplicate messages: {traceback.format_exc()}")
+        return []
@@ -1,6 +1,7 @@
 from telegram import Bot
 from telegram.request import HTTPXRequest
-from sqlalchemy import func
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert
 import asyncio
 import traceback
 import os
@@ -9,6 +10,7 @@ import src.helpers.db_helper as db_helper
 import src.helpers.user_helper as user_helper
 import src.helpers.logging_helper as logging_helper
 import src.helpers.chat_helper as chat_helper
+import src.helpers.leaderboard_helper as leaderboard_helper
 
 logger = logging_helper.get_logger()
 
@@ -16,6 +18,28 @@ bot = Bot(token=os.getenv('ENV_BOT_KEY'),
           request=HTTPXRequest(http_version="1.1"), #we need this to fix bug https://github.com/python-telegram-bot/python-telegram-bot/issues/3556
           get_updates_request=HTTPXRequest(http_version="1.1")) #we need this to fix bug https://github.com/python-telegram-bot/python-telegram-bot/issues/3556)
 
+def add_to_rating_totals(db_session, user_id, chat_id, group_id, change_value):
+    """
+    Apply change_value to the user's running totals; call it in the transaction that inserts the User_Rating row.
+    Returns the user's new rating in chat_id (the group total when the chat belongs to a group).
+    """
+    totals = []
+    for model, scope_column, scope_id in (
+        (db_helper.User_Rating_Total, 'chat_id', chat_id),
+        (db_helper.User_Group_Rating_Total, 'group_id', group_id),
+    ):
+        if scope_id is None:
+            continue
+        insert_stmt = insert(model).values(user_id=user_id, total=change_value, **{scope_column: scope_id})
+        totals.append(db_session.execute(
+            insert_stmt.on_conflict_do_update(
+                index_elements=['user_id', scope_column],
+                set_={'total': model.total + insert_stmt.excluded.total}
+            ).returning(model.total)
+        ).scalar())
+    return totals[-1]
+
+
 async def change_rating(user_id_or_ids, judge_id, chat_id, change_value, message_id=None, announce=True, delete_message_delay=0):
     try:
         # If we receive a single user_id, convert it to a list
@@ -27,23 +51,12 @@ async def change_rating(user_id_or_ids, judge_id, chat_id, change_value, message
                 return  # Handle error: chat not found
 
             group_id = chat.group_id
+            leaderboard_scope = leaderboard_helper.get_scope(chat_id, group_id)
             messages = []
+            new_totals = {}
+            mentions = user_helper.get_user_mentions(user_ids + [judge_id], chat_id)
 
             for user_id in user_ids:
-                if group_id is None:
-                    # If group_id is null, get ratings only for this specific chat
-                    user_total_rating_query = db_session.query(func.sum(db_helper.User_Rating.change_value)).filter(
-                        db_helper.User_Rating.user_id == user_id,
-                        db_helper.User_Rating.chat_id == chat_id)
-                else:
-                    # If group_id is not null, get ratings for all chats in the group
-                    user_total_rating_query = db_session.query(func.sum(db_helper.User_Rating.change_value)).filter(
-                        db_helper.User_Rating.user_id == user_id,
-                        db_helper.Chat.group_id == group_id,
-                        db_helper.Chat.id == db_helper.User_Rating.chat_id)
-
-                user_total_rating = user_total_rating_query.scalar() or 0
-
                 # Determine the rating action
                 if change_value >= 1:
                     rating_action = "increased"
@@ -52,20 +65,19 @@ async def change_rating(user_id_or_ids, judge_id, chat_id, change_value, message
                 else:
                     rating_action = "not changed"
 
-                user_mention = user_helper.get_user_mention(user_id, chat_id)
-                messages.append(f"{rating_action} reputation of {user_mention}. New value is ({user_total_rating + change_value})")
-
                 user_rating = db_helper.User_Rating(user_id=user_id, chat_id=chat_id, judge_id=judge_id, change_value=change_value)
                 db_session.add(user_rating)
+                user_total_rating = add_to_rating_totals(db_session, user_id, chat_id, group_id, change_value)
+                new_totals[user_id] = user_total_rating
 
-            db_session.commit()
+                user_mention = mentions[user_id]
+                messages.append(f"{rating_action} reputation of {user_mention}. New value is ({user_total_rating})")
 
-            judge_total_rating_query = db_session.query(func.sum(db_helper.User_Rating.change_value)).filter(
-                db_helper.User_Rating.user_id == judge_id,
-                db_helper.User_Rating.chat_id == chat_id)
-            judge_total_rating = judge_total_rating_query.scalar() or 0
+            db_session.commit()
+            for user_id, user_total_rating in new_totals.items():
+                leaderboard_helper.apply_rating_change(leaderboard_scope, user_id, user_total_rating)
 
-            judge_mention = user_helper.get_user_mention(judge_id, chat_id)
+            judge_mention = mentions[judge_id]
 
             # Decide the message format based on the number of user_ids
             if len(user_ids) == 1:
@@ -85,28 +97,38 @@ async def change_rating(user_id_or_ids, judge_id, chat_id, change_value, message
         logger.error(f"Error changing rating: {traceback.format_exc()}")
 
 
-def get_rating(user_id, chat_id):
+def get_ratings(user_ids, chat_id):
+    """
+    {user_id: rating in chat_id} for every id in user_ids, read from the rating totals (summed over the chat's
+    group when it has one). Users without ratings get 0; every value is None if the chat is unknown.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
     try:
         with db_helper.session_scope() as db_session:
-            chat = db_session.query(db_helper.Chat).filter(db_helper.Chat.id == chat_id).first()
+            chat = db_session.query(db_helper.Chat.group_id).filter(db_helper.Chat.id == chat_id).one_or_none()
             if chat is None:
                 logger.error(f"Chat {chat_id} not found.")
-                return None  # Handle error: chat not found
+                return {user_id: None for user_id in user_ids}
 
-            # Check if there is a group_id associated with the chat
             if chat.group_id is not None:
-                # Get ratings for all chats in the group
-                user_total_rating_query = db_session.query(func.sum(db_helper.User_Rating.change_value)).join(db_helper.Chat, db_helper.User_Rating.chat_id == db_helper.Chat.id).filter(db_helper.User_Rating.user_id == user_id, db_helper.Chat.group_id == chat.group_id)
+                totals = dict(db_session.query(db_helper.User_Group_Rating_Total.user_id, db_helper.User_Group_Rating_Total.total).filter(
+                    db_helper.User_Group_Rating_Total.group_id == chat.group_id,
+                    db_helper.User_Group_Rating_Total.user_id.in_(user_ids)
+                ).all())
             else:
-                # Get the total rating for the user in the specified chat
-                user_total_rating_query = db_session.query(func.sum(db_helper.User_Rating.change_value)).filter(db_helper.User_Rating.user_id == user_id, db_helper.User_Rating.chat_id == chat_id)
-
-            user_total_rating = user_total_rating_query.scalar() or 0
-            return user_total_rating
+                totals = dict(db_session.query(db_helper.User_Rating_Total.user_id, db_helper.User_Rating_Total.total).filter(
+                    db_helper.User_Rating_Total.chat_id == chat_id,
+                    db_helper.User_Rating_Total.user_id.in_(user_ids)
+                ).all())
+            return {user_id: totals.get(user_id, 0) for user_id in user_ids}
 
     except Exception as e:
-        logger.error(f"Error fetching rating for user_id {user_id}: {traceback.format_exc()}")
-        return None  # Return None if there is an error
+        logger.error(f"Error fetching ratings for user_ids {user_ids}: {traceback.format_exc()}")
+        return {user_id: None for user_id in user_ids}
+
+
+def get_rating(user_id, chat_id):
+    return get_ratings([user_id], chat_id)[user_id]
 
 
 def get_total_rating(user_id):
@@ -114,11 +136,56 @@ def get_total_rating(user_id):
     try:
         with db_helper.session_scope() as db_session:
             user_total_rating = db_session.query(
-                func.sum(db_helper.User_Rating.change_value)
+                func.sum(db_helper.User_Rating_Total.total)
             ).filter(
-                db_helper.User_Rating.user_id == user_id
+                db_helper.User_Rating_Total.user_id == user_id
             ).scalar() or 0
             return user_total_rating
     except Exception as e:
         logger.error(f"Error fetching total rating for user_id {user_id}: {traceback.format_exc()}")
-        return None
\ No newline at end of file
+        return None
+
+
+def rebuild_rating_totals():
+    """
+    Recompute the rating totals from the tg_user_rating ledger and fix the rows that differ. Needed after a chat
+    moves to another group (or out of one); rating changes wait until it's done. Returns {table: rows fixed}.
+    """
+    with db_helper.session_scope() as db_session:
+        # Blocks change_rating for the duration, so no increment can land between the sums and the overwrite
+        db_session.execute(text("LOCK TABLE tg_user_rating IN SHARE MODE"))
+
+        fixed = {}
+        fixed['tg_user_rating_total'] = db_session.execute(text("""
+            INSERT INTO tg_user_rating_total (user_id, chat_id, total)
+            SELECT user_id, chat_id, sum(change_value)
+            FROM tg_user_rating
+            GROUP BY user_id, chat_id
+            ON CONFLICT (user_id, chat_id) DO UPDATE SET total = EXCLUDED.total
+            WHERE tg_user_rating_total.total IS DISTINCT FROM EXCLUDED.total
+        """)).rowcount + db_session.execute(text("""
+            DELETE FROM tg_user_rating_total t
+            WHERE NOT EXISTS (
+                SELECT 1 FROM tg_user_rating r WHERE r.user_id = t.user_id AND r.chat_id = t.chat_id
+            )
+        """)).rowcount
+
+        fixed['tg_user_group_rating_total'] = db_session.execute(text("""
+            INSERT INTO tg_user_group_rating_total (user_id, group_id, total)
+            SELECT r.user_id, c.group_id, sum(r.change_value)
+            FROM tg_user_rating r
+            JOIN tg_chat c ON c.id = r.chat_id
+            WHERE c.group_id IS NOT NULL
+            GROUP BY r.user_id, c.group_id
+            ON CONFLICT (user_id, group_id) DO UPDATE SET total = EXCLUDED.total
+            WHERE tg_user_group_rating_total.total IS DISTINCT FROM EXCLUDED.total
+        """)).rowcount + db_session.execute(text("""
+            DELETE FROM tg_user_group_rating_total t
+            WHERE NOT EXISTS (
+                SELECT 1 FROM tg_user_rating r JOIN tg_chat c ON c.id = r.chat_id
+                WHERE r.user_id = t.user_id AND c.group_id = t.group_id
+            )
+        """)).rowcount
+
+        db_session.commit()
+        return fixed
@@ -0,0 +1,288 @@
+import asyncio
+import heapq
+import select
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+from datetime import time as dt_time
+
+import psycopg2
+import psycopg2.extensions
+from sqlalchemy import update
+
+import src.helpers.db_helper as db_helper
+import src.helpers.db_pool_helper as db_pool_helper
+import src.helpers.logging_helper as logging_helper
+import src.helpers.chat_helper as chat_helper
+import src.helpers.fanout_helper as fanout_helper
+
+logger = logging_helper.get_logger()
+
+# Scheduled messages (tg_scheduled_message_config) are sent by the dispatcher. The next due time of every active
+# config is kept in a min-heap and a single JobQueue job is armed for the earliest one, so nothing polls the table.
+# The heap is rebuilt from the table only when a config changes (NOTIFY tg_scheduled_message_config from a trigger).
+# All times are UTC.
+CONFIG_CHANNEL = 'tg_scheduled_message_config'
+JOB_NAME = 'tg_send_scheduled_messages'
+ERROR_THRESHOLD = 3  # failed sends in a row before a config is set to 'error'
+RETRY_SECONDS = 60
+MAX_LOOKAHEAD_DAYS = 2000  # enough for any day of the week / day of the month combination that can happen at all
+
+
+def next_due(config, now):
+    """
+    Earliest time at or after max(now, last_sent + frequency) that falls on the configured day of the week and
+    day of the month and is not before the configured time of day. None if the constraints never match.
+    """
+    candidate = now
+    if config['last_sent'] is not None:
+        candidate = max(candidate, config['last_sent'] + timedelta(seconds=config['frequency_seconds']))
+
+    for _ in range(MAX_LOOKAHEAD_DAYS):
+        day_matches = (
+            (config['day_of_the_week'] is None or candidate.weekday() == config['day_of_the_week'])
+            and (config['day_of_the_month'] is None or candidate.day == config['day_of_the_month'])
+        )
+        if day_matches:
+            time_of_the_day = config['time_of_the_day']
+            if time_of_the_day is None or candidate.time() >= time_of_the_day:
+                return candidate
+            return datetime.combine(candidate.date(), time_of_the_day, tzinfo=timezone.utc)
+        candidate = datetime.combine(candidate.date() + timedelta(days=1), dt_time(0), tzinfo=timezone.utc)
+    return None
+
+
+class ScheduledMessageQueue:
+    def __init__(self):
+        self.configs = {}  # config id -> schedule fields of an active config
+        self.due = {}  # config id -> next due time; heap entries that don't match are stale
+        self.heap = []  # (due_at, config_id)
+        self.job_queue = None
+        self.armed_at = None
+        self.sent = 0
+        self.failed = 0
+        self.reloads = 0
+
+    def _push(self, config_id, now):
+        if config_id not in self.configs:
+            return  # deactivated by a reload while it was being sent
+        due_at = next_due(self.configs[config_id], now)
+        if due_at is None:
+            self.due.pop(config_id, None)
+            logger.warning(f"Scheduled message config {config_id} can never be due, check its day/time settings")
+            return
+        self.due[config_id] = due_at
+        heapq.heappush(self.heap, (due_at, config_id))
+
+    @staticmethod
+    def _load_configs(*conditions):
+        """Schedule fields of the active configs matching conditions, as dicts by id."""
+        with db_helper.session_scope() as db_session:
+            rows = db_session.query(
+                db_helper.Scheduled_Message_Config.id,
+                db_helper.Scheduled_Message_Config.frequency_seconds,
+                db_helper.Scheduled_Message_Config.last_sent,
+                db_helper.Scheduled_Message_Config.time_of_the_day,
+                db_helper.Scheduled_Message_Config.day_of_the_week,
+                db_helper.Scheduled_Message_Config.day_of_the_month,
+                db_helper.Scheduled_Message_Config.error_count
+            ).filter(db_helper.Scheduled_Message_Config.status == 'active', *conditions).all()
+        return {row.id: row._asdict() for row in rows}
+
+    def reload(self):
+        """Rebuild the heap from the active configs."""
+        try:
+            configs = self._load_configs()
+        except Exception:
+            logger.error(f"Error loading scheduled message configs: {traceback.format_exc()}")
+            return
+
+        now = datetime.now(timezone.utc)
+        self.configs = configs
+        self.due = {}
+        self.heap = []
+        for config_id in self.configs:
+            self._push(config_id, now)
+        self.reloads += 1
+        logger.info(f"Loaded {len(self.configs)} scheduled message configs")
+        self._arm()
+
+    def _arm(self):
+        """Point the JobQueue job at the earliest due time."""
+        while self.heap and self.due.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        due_at = self.heap[0][0] if self.heap else None
+        if self.job_queue is None or due_at == self.armed_at:
+            return
+        for job in self.job_queue.get_jobs_by_name(JOB_NAME):
+            job.schedule_removal()
+        self.armed_at = due_at
+        if due_at is not None:
+            self.job_queue.run_once(self._send_due, when=max(due_at, datetime.now(timezone.utc)), name=JOB_NAME)
+
+    async def _send_due(self, context):
+        self.armed_at = None
+        now = datetime.now(timezone.utc)
+        while self.heap and self.heap[0][0] <= now:
+            due_at, config_id = heapq.heappop(self.heap)
+            if self.due.get(config_id) != due_at:
+                continue
+            del self.due[config_id]
+            await self._send(context.bot, config_id)
+        self._arm()
+
+    def _claim(self, config_id, last_sent, now):
+        """
+        Move last_sent forward unless another process (or an edit) got there first. Returns (chat_id, content,
+        parse_mode), or None if the config is no longer ours to send.
+        """
+        config = db_helper.Scheduled_Message_Config
+        content = db_helper.Scheduled_Message_Content
+        with db_helper.session_scope() as db_session:
+            row = db_session.execute(
+                update(config)
+                .where(
+                    config.id == config_id,
+                    config.status == 'active',
+                    config.last_sent.is_not_distinct_from(last_sent),
+                    config.message_content_id == content.id
+                )
+                .values(last_sent=now)
+                .returning(config.chat_id, content.content, content.parse_mode)
+            ).fetchone()
+            db_session.commit()
+        return row
+
+    def _refresh(self, config_id, now):
+        try:
+            config = self._load_configs(db_helper.Scheduled_Message_Config.id == config_id).get(config_id)
+        except Exception:
+            logger.error(f"Error reloading scheduled message ID {config_id}: {traceback.format_exc()}")
+            self.due[config_id] = now + timedelta(seconds=RETRY_SECONDS)
+            heapq.heappush(self.heap, (self.due[config_id], config_id))
+            return
+        if config is None:
+            self.configs.pop(config_id, None)
+            return
+        self.configs[config_id] = config
+        self._push(config_id, now)
+
+    def _record_failure(self, config_id, last_sent, error):
+        """Put last_sent back so the message is still due, and give up on the config after ERROR_THRESHOLD failures."""
+        with db_helper.session_scope() as db_session:
+            config = db_session.get(db_helper.Scheduled_Message_Config, config_id)
+            config.last_sent = last_sent
+            config.error_count += 1
+            config.error_message = str(error)
+            if config.error_count >= ERROR_THRESHOLD:
+                config.status = 'error'
+                logger.error(f"Scheduled message ID {config_id} set to 'error' status after {ERROR_THRESHOLD} failures.")
+            db_session.commit()
+            return config.status == 'active'
+
+    async def _send(self, bot, config_id):
+        config = self.configs.get(config_id)
+        if config is None:
+            return
+        now = datetime.now(timezone.utc)
+        last_sent = config['last_sent']
+        try:
+            claimed = self._claim(config_id, last_sent, now)
+        except Exception:
+            logger.error(f"Error claiming scheduled message ID {config_id}: {traceback.format_exc()}")
+            self.due[config_id] = now + timedelta(seconds=RETRY_SECONDS)
+            heapq.heappush(self.heap, (self.due[config_id], config_id))
+            return
+        if claimed is None:
+            # last_sent moved (another sender) or the config was switched off; writes to last_sent don't notify,
+            # so re-read the row and schedule it from what is stored now
+            logger.info(f"Scheduled message ID {config_id} changed since it was loaded, skipping this run")
+            self._refresh(config_id, now)
+            return
+
+        chat_id, content, parse_mode = claimed
+        config['last_sent'] = now
+        logger.info(f"Sending message ID {config_id}: {content[:50]}...")
+        try:
+            await fanout_helper.rate_limiter.acquire(chat_id)
+            await chat_helper.send_message(bot, chat_id, content, parse_mode=parse_mode)
+            self.sent += 1
+            if config['error_count']:
+                with db_helper.session_scope() as db_session:
+                    db_session.query(db_helper.Scheduled_Message_Config).filter(
+                        db_helper.Scheduled_Message_Config.id == config_id
+                    ).update({'error_count': 0, 'error_message': None})
+                    db_session.commit()
+                config['error_count'] = 0
+            self._push(config_id, now)
+        except Exception as e:
+            logger.error(f"Error sending scheduled message ID {config_id}: {traceback.format_exc()}")
+            self.failed += 1
+            config['last_sent'] = last_sent
+            config['error_count'] += 1
+            try:
+                still_active = self._record_failure(config_id, last_sent, e)
+            except Exception:
+                logger.error(f"Error recording the failure of scheduled message ID {config_id}: {traceback.format_exc()}")
+                still_active = True
+            if still_active:
+                self.due[config_id] = now + timedelta(seconds=RETRY_SECONDS)
+                heapq.heappush(self.heap, (self.due[config_id], config_id))
+            else:
+                self.configs.pop(config_id, None)
+
+    def stats(self):
+        return {
+            'configs': len(self.configs),
+            'next_due': self.armed_at.isoformat() if self.armed_at else None,
+            'sent': self.sent,
+            'failed': self.failed,
+            'reloads': self.reloads,
+        }
+
+
+queue = ScheduledMessageQueue()
+
+
+def _listen_for_config_changes(loop):
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(db_pool_helper.get_database_url())
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {CONFIG_CHANNEL}")
+            # Changes may have been missed while not listening
+            loop.call_soon_threadsafe(queue.reload)
+
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    # One reload for a whole burst of changes
+                    conn.notifies.clear()
+                    loop.call_soon_threadsafe(queue.reload)
+        except Exception:
+            logger.error(f"Scheduled message config listener failed, reconnecting: {traceback.format_exc()}")
+            time.sleep(5)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def start(job_queue):
+    """
+    Send scheduled messages from this process. Loads the configs through the listener, which also reloads them
+    on every change; like the chat config listener it needs a direct (session-level) Postgres connection.
+    """
+    queue.job_queue = job_queue
+    loop = asyncio.get_running_loop()
+    thread = threading.Thread(target=_listen_for_config_changes, args=(loop,), name='scheduled-message-listener', daemon=True)
+    thread.start()
+    return thread
+
+
+def get_stats():
+    return queue.stats()
@@ -1,5 +1,5 @@
 from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy import func
+from sqlalchemy import func, select, case, exists
 import traceback
 import os
 from datetime import datetime, timezone
@@ -97,6 +97,132 @@ def extract_user_id_from_command(message, command_parts, allow_reply=True):
         logger.error(f"Error extracting user ID from command: {e}. Traceback: {traceback.format_exc()}")
         return None
 
+USER_PROFILE_CACHE_SECONDS = int(os.getenv('ENV_USER_PROFILE_CACHE_SECONDS', '60'))
+NAME_FIELDS = ('username', 'first_name', 'last_name')
+
+
+def _user_profile_key(user_id):
+    return f"user_profile:{user_id}"
+
+
+def _rating_column(chat_id):
+    """
+    The user's rating in chat_id from the rating totals (the group total when the chat belongs to a group).
+    NULL when the chat is unknown, like rating_helper.get_rating.
+    """
+    chat_group_id = select(db_helper.Chat.group_id).where(db_helper.Chat.id == chat_id).scalar_subquery()
+    chat_total = select(db_helper.User_Rating_Total.total).where(
+        db_helper.User_Rating_Total.user_id == db_helper.User.id,
+        db_helper.User_Rating_Total.chat_id == chat_id
+    ).scalar_subquery()
+    group_total = select(db_helper.User_Group_Rating_Total.total).where(
+        db_helper.User_Group_Rating_Total.user_id == db_helper.User.id,
+        db_helper.User_Group_Rating_Total.group_id == chat_group_id
+    ).scalar_subquery()
+    return case(
+        (~exists().where(db_helper.Chat.id == chat_id), None),
+        (chat_group_id.is_(None), func.coalesce(chat_total, 0)),
+        else_=func.coalesce(group_total, 0)
+    ).label('rating')
+
+
+def _render_user_mention(user_id, profile, rating, show_user_id, show_account_age):
+    if profile is None:
+        return f"[{user_id}]" if show_user_id else str(user_id)
+    first_name, last_name, username, created_at = profile
+
+    # ───────────── name / username ─────────────
+    full_name = " ".join(p for p in (first_name, last_name) if p)
+
+    # Build base mention with optional user ID
+    if show_user_id:
+        if full_name and username:
+            mention = f"[{user_id}] - {full_name} - @{username}"
+        elif username:
+            mention = f"[{user_id}] - @{username}"
+        elif full_name:
+            mention = f"[{user_id}] - {full_name}"
+        else:
+            mention = f"[{user_id}]"
+    else:
+        if full_name and username:
+            mention = f"{full_name} - @{username}"
+        elif username:
+            mention = f"@{username}"
+        elif full_name:
+            mention = full_name
+        else:
+            mention = f"[{user_id}]"  # Fallback to ID if no name/username
+
+    # ───────────── account age ─────────────
+    if show_account_age:
+        if created_at:
+            days_old = (datetime.now(timezone.utc) - created_at).days
+            mention += f" - [{days_old}d]"
+        else:
+            mention += " - [N/A]"
+
+    # ───────────── rating (optional) ─────────────
+    if rating is not None:
+        mention += f" ({rating})"
+
+    return mention
+
+
+def get_user_mentions(
+    user_ids,
+    chat_id: int | None = None,
+    show_user_id: bool = True,
+    show_account_age: bool = True,
+    show_rating: bool = True
+) -> dict[int, str]:
+    """
+    Bulk version of get_user_mention: {user_id: mention} for every id in user_ids, same display options.
+
+    Names come from a per-user profile cache (USER_PROFILE_CACHE_SECONDS); whatever is missing, plus the
+    ratings in chat_id, is loaded in a single query. Ratings are never cached, so they are always current.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return {}
+    with_rating = show_rating and chat_id is not None
+
+    profiles = {}
+    for user_id in user_ids:
+        profile = cache_helper.get_key(_user_profile_key(user_id))
+        if profile is not None:
+            profiles[user_id] = profile
+    missing_ids = [user_id for user_id in user_ids if user_id not in profiles]
+
+    ratings = {}
+    try:
+        if missing_ids or with_rating:
+            columns = [db_helper.User.id]
+            if missing_ids:
+                columns += [db_helper.User.first_name, db_helper.User.last_name, db_helper.User.username, db_helper.User.created_at]
+            if with_rating:
+                columns.append(_rating_column(chat_id))
+            with db_helper.session_scope() as session:
+                rows = session.execute(
+                    select(*columns).where(db_helper.User.id.in_(user_ids if with_rating else missing_ids))
+                ).all()
+
+            for row in rows:
+                if missing_ids and row.id not in profiles:
+                    profile = (row.first_name, row.last_name, row.username, row.created_at)
+                    profiles[row.id] = profile
+                    cache_helper.set_key(_user_profile_key(row.id), profile, expire=USER_PROFILE_CACHE_SECONDS)
+                if with_rating:
+                    ratings[row.id] = row.rating
+    except Exception:
+        logger.error(f"Error generating mentions for user_ids={user_ids}\n{traceback.format_exc()}")
+
+    return {
+        user_id: _render_user_mention(user_id, profiles.get(user_id), ratings.get(user_id), show_user_id, show_account_age)
+        for user_id in user_ids
+    }
+
+
 def get_user_mention(
     user_id: int,
     chat_id: int | None = None,
@@ -124,63 +250,16 @@ def get_user_mention(
 
     Name and username only (show_user_id=False, show_account_age=False, show_rating=False):
         Nikita Rvachev - @rvnikita
-    """
-    try:
-        with db_helper.session_scope() as session:
-            user = session.query(db_helper.User).filter_by(id=user_id).first()
-            if user is None:
-                return f"[{user_id}]" if show_user_id else str(user_id)
-
-            # ───────────── name / username ─────────────
-            full_name = " ".join(p for p in (user.first_name, user.last_name) if p)
-
-            # Build base mention with optional user ID
-            if show_user_id:
-                if full_name and user.username:
-                    mention = f"[{user.id}] - {full_name} - @{user.username}"
-                elif user.username:
-                    mention = f"[{user.id}] - @{user.username}"
-                elif full_name:
-                    mention = f"[{user.id}] - {full_name}"
-                else:
-                    mention = f"[{user.id}]"
-            else:
-                if full_name and user.username:
-                    mention = f"{full_name} - @{user.username}"
-                elif user.username:
-                    mention = f"@{user.username}"
-                elif full_name:
-                    mention = full_name
-                else:
-                    mention = f"[{user.id}]"  # Fallback to ID if no name/username
-
-            # ───────────── account age ─────────────
-            if show_account_age:
-                if user.created_at:
-                    days_old = (datetime.now(timezone.utc) - user.created_at).days
-                    mention += f" - [{days_old}d]"
-                else:
-                    mention += " - [N/A]"
-
-            # ───────────── rating (optional) ─────────────
-            if show_rating and chat_id is not None:
-                rating = rating_helper.get_rating(user_id, chat_id)
-                if rating is not None:
-                    mention += f" ({rating})"
-
-            return mention
 
-    except Exception:
-        logger.error(
-            f"Error generating mention for user_id={user_id}\n{traceback.format_exc()}"
-        )
-        return f"[{user_id}]" if show_user_id else str(user_id)
+    Use get_user_mentions when mentioning several users.
+    """
+    return get_user_mentions([user_id], chat_id, show_user_id, show_account_age, show_rating)[user_id]
 
 
 def db_upsert_user(user_id, chat_id, username, last_message_datetime, first_name=None, last_name=None, raw_user=None):
     try:
         # Generate a unique cache key for the user's data
-        cache_key = f"user_{user_id}_chat_{chat_id}"
+        cache_key = f"user_upsert:{user_id}:{chat_id}"
 
         # Attempt to retrieve the user's current data from cache
         cached_data = cache_helper.get_key(cache_key)
@@ -235,10 +314,62 @@ def db_upsert_user(user_id, chat_id, username, last_message_datetime, first_name
 
                 # Update the cache with the new data (expires in 1 hour)
                 cache_helper.set_key(cache_key, new_data, expire=3600)
+
+            # Mentions must not show old names. Without a cached copy there is nothing to compare with.
+            if not cached_data or any(cached_data.get(field) != new_data[field] for field in NAME_FIELDS):
+                cache_helper.delete_key(_user_profile_key(user_id))
     except Exception as e:
         logger.error(f"Error: {traceback.format_exc()}")
 
 
+def get_user_chat_ids(user_id):
+    """
+    Chats the user has been seen in, whatever their current status there. tg_user_status is written on every
+    message and join (db_upsert_user, record_chat_member_update); the message log is only read for users
+    that have no status rows at all.
+    """
+    with db_helper.session_scope() as db_session:
+        chat_ids = [row[0] for row in db_session.query(db_helper.User_Status.chat_id).filter(
+            db_helper.User_Status.user_id == user_id
+        ).all()]
+        if not chat_ids:
+            chat_ids = [row[0] for row in db_session.query(db_helper.Message_Log.chat_id).filter(
+                db_helper.Message_Log.user_id == user_id
+            ).distinct().all()]
+    return chat_ids
+
+
+def record_chat_member_update(chat_member_updated):
+    """
+    Store a user's new status from a chat_member update. Joins through invite links or join requests often come
+    without a service message, so this is the only way such members get into tg_user_status before they write.
+    """
+    user = chat_member_updated.new_chat_member.user
+    chat_id = chat_member_updated.chat.id
+    status = chat_member_updated.new_chat_member.status
+    try:
+        with db_helper.session_scope() as db_session:
+            db_session.execute(insert(db_helper.User).values(
+                id=user.id,
+                first_name=user.first_name,
+                last_name=user.last_name,
+                username=user.username,
+                is_bot=user.is_bot,
+                user_raw=user.to_dict()
+            ).on_conflict_do_nothing(index_elements=['id']))
+            db_session.execute(insert(db_helper.User_Status).values(
+                user_id=user.id,
+                chat_id=chat_id,
+                status=status
+            ).on_conflict_do_update(
+                index_elements=['user_id', 'chat_id'],
+                set_=dict(status=status)
+            ))
+            db_session.commit()
+    except Exception:
+        logger.error(f"Error recording status {status} of user {user.id} in chat {chat_id}: {traceback.format_exc()}")
+
+
 async def get_user_info_text(user_id: int, chat_id: int, include_at_symbol: bool = True, is_dm: bool = False) -> str:
     """
     Generate formatted user info text for /info command and InfoAction.
@@ -277,8 +408,8 @@ async def get_user_info_text(user_id: int, chat_id: int, include_at_symbol: bool
     else:
         rating = rating_helper.get_rating(user_id, chat_id)
 
-    # count messages and find interacted users
-    with db_helper.session_scope() as session:
+    # count messages and find interacted users (aggregates over the whole history, served by the read replica)
+    with db_helper.read_replica(), db_helper.session_scope() as session:
         chat_count = session.query(func.count(db_helper.Message_Log.id)) \
                             .filter(db_helper.Message_Log.user_id == user_id,
                                     db_helper.Message_Log.chat_id == chat_id) \
@@ -345,8 +476,9 @@ async def get_user_info_text(user_id: int, chat_id: int, include_at_symbol: bool
 
         # Format usernames with rating
         prefix = "@" if include_at_symbol else ""
+        interacted_ratings = rating_helper.get_ratings([user.id for user, _, _ in interacted_users], chat_id)
         interacted_usernames = [
-            f"{prefix}{user.username}({rating_helper.get_rating(user.id, chat_id)})"
+            f"{prefix}{user.username}({interacted_ratings[user.id]})"
             for user, interaction_count, spam_count in interacted_users
         ]
 
@@ -0,0 +1,45 @@
+from src.helpers.deletion_helper import TimingWheel
+
+
+def advance(wheel, ticks):
+    """{tick: due items} for the next `ticks` ticks."""
+    due = {}
+    for tick in range(1, ticks + 1):
+        items = wheel.advance()
+        if items:
+            due[tick] = items
+    return due
+
+
+def test_items_fire_on_their_tick():
+    wheel = TimingWheel(slots=10, tick_seconds=1.0)
+    wheel.add(3, 'a')
+    wheel.add(2.5, 'b')  # rounded up to whole ticks
+    wheel.add(7, 'c')
+    assert len(wheel) == 3
+    assert advance(wheel, 10) == {3: ['a', 'b'], 7: ['c']}
+    assert len(wheel) == 0
+
+
+def test_delays_longer_than_a_turn():
+    wheel = TimingWheel(slots=4, tick_seconds=1.0)
+    wheel.add(4, 'one turn')
+    wheel.add(9, 'two turns')
+    wheel.add(1, 'same bucket')
+    assert advance(wheel, 12) == {1: ['same bucket'], 4: ['one turn'], 9: ['two turns']}
+
+
+def test_overdue_fires_on_next_tick():
+    wheel = TimingWheel(slots=4, tick_seconds=1.0)
+    wheel.add(0, 'now')
+    wheel.add(-30, 'late')
+    assert wheel.advance() == ['now', 'late']
+    assert len(wheel) == 0
+
+
+def test_adding_after_advancing():
+    wheel = TimingWheel(slots=4, tick_seconds=0.5)
+    advance(wheel, 3)
+    wheel.add(1, 'a')  # two ticks from the current position
+    wheel.add(2, 'b')
+    assert advance(wheel, 8) == {2: ['a'], 4: ['b']}
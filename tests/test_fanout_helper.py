@@ -0,0 +1,98 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from src.helpers.fanout_helper import DEDUP_SECONDS, RateLimiter, _covers
+
+
+async def call_times(limiter, chat_ids, background=False):
+    started_at = time.monotonic()
+    times = []
+    for chat_id in chat_ids:
+        await limiter.acquire(chat_id, background=background)
+        times.append(time.monotonic() - started_at)
+    return times
+
+
+@pytest.mark.asyncio
+async def test_calls_are_spaced_by_rate():
+    times = await call_times(RateLimiter(rate=20, per_chat_interval=0), [1, 2, 3, 4])
+    assert times[-1] >= 3 * 0.05 - 0.01
+    assert all(later - earlier >= 0.04 for earlier, later in zip(times, times[1:]))
+
+
+@pytest.mark.asyncio
+async def test_same_chat_waits_per_chat_interval():
+    limiter = RateLimiter(rate=1000, per_chat_interval=0.1)
+    times = await call_times(limiter, [1, 2, 1])
+    assert times[1] < 0.05  # another chat only waits for the global interval
+    assert times[2] >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_chat_held_back_keeps_global_spacing():
+    limiter = RateLimiter(rate=10, per_chat_interval=0.3)
+    started_at = time.monotonic()
+    await limiter.acquire(1)
+    fired = []
+
+    async def call(chat_id):
+        await limiter.acquire(chat_id)
+        fired.append(time.monotonic() - started_at)
+
+    # Chat 1 waits for its per-chat interval; the other chats must not fire in the same instant as it
+    await asyncio.gather(call(1), call(2), call(3))
+    fired.sort()
+    assert all(later - earlier >= 0.09 for earlier, later in zip(fired, fired[1:]))
+
+
+@pytest.mark.asyncio
+async def test_pause_delays_every_caller():
+    limiter = RateLimiter(rate=1000, per_chat_interval=0)
+    limiter.pause(0.1)
+    times = await call_times(limiter, [1, 2])
+    assert times[0] >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_background_waits_for_urgent_jobs():
+    limiter = RateLimiter(rate=1000, per_chat_interval=0)
+    limiter.urgent_jobs = 1
+    background = asyncio.create_task(limiter.acquire(1, background=True))
+    await limiter.acquire(2)  # urgent callers go ahead
+    await asyncio.sleep(0.1)
+    assert not background.done()
+    limiter.urgent_jobs = 0
+    await asyncio.wait_for(background, timeout=2)
+
+
+UNTIL = datetime(2026, 10, 20, tzinfo=timezone.utc)
+
+
+def job(action, until_date=None):
+    return SimpleNamespace(action=action, until_date=until_date)
+
+
+def test_ban_covers_mute():
+    assert _covers(job('ban'), 'mute', UNTIL)
+    assert not _covers(job('mute'), 'ban', None)
+
+
+def test_other_action_is_not_covered():
+    assert not _covers(job('ban'), 'unban', None)
+    assert not _covers(job('unmute'), 'mute', UNTIL)
+
+
+def test_same_action_is_covered():
+    assert _covers(job('ban'), 'ban', None)
+    assert _covers(job('mute'), 'mute', UNTIL)  # a permanent mute covers any mute
+
+
+def test_longer_mute_is_not_covered():
+    assert _covers(job('mute', UNTIL), 'mute', UNTIL)
+    assert _covers(job('mute', UNTIL), 'mute', UNTIL + timedelta(seconds=DEDUP_SECONDS))
+    assert not _covers(job('mute', UNTIL), 'mute', UNTIL + timedelta(seconds=DEDUP_SECONDS + 1))
+    assert not _covers(job('mute', UNTIL), 'mute', None)
@@ -0,0 +1,100 @@
+import random
+import re
+
+import pytest
+
+import src.helpers.keyword_helper as keyword_helper
+from src.helpers.keyword_helper import KeywordMatcher, WORD, HASHTAG, SUBSTRING
+
+
+def old_match(keyword, mode, text):
+    """The checks tg_auto_reply / tg_thankyou_message used before the matcher."""
+    keyword, text = keyword.lower(), text.lower()
+    if mode == WORD:
+        return bool(re.findall(r'\b' + re.escape(keyword) + r'\b', text))
+    if mode == HASHTAG:
+        return keyword in text.split()
+    return keyword in text
+
+
+def assert_same_as_old(keywords, text):
+    expected = {value for value, (keyword, mode) in enumerate(keywords) if keyword and old_match(keyword, mode, text)}
+    matcher = KeywordMatcher([(keyword, mode, value) for value, (keyword, mode) in enumerate(keywords)])
+    assert matcher.match(text) == expected, (keywords, text)
+
+
+@pytest.mark.parametrize("keyword, text", [
+    ("привет", "Привет, мир"),
+    ("привет", "приветствую всех"),
+    ("мир", "_мир_"),
+    ("café", "un café!"),
+    ("café", "cafés"),
+    ("straße", "STRASSE"),  # lowercasing, not casefolding, like before
+    ("1", "версия 1.2"),
+    ("ё", "ёлка ё"),
+    ("!", "hi!"),  # a keyword starting with a non-word character needs a word character before it
+    ("!", "hi !"),
+    ("c++", "I like c++ a lot"),
+])
+def test_word_boundaries_match_re(keyword, text):
+    assert_same_as_old([(keyword, WORD)], text)
+
+
+@pytest.mark.parametrize("keyword, text", [
+    ("#успех", "#успех"),
+    ("#успех", "наш #успех сегодня"),
+    ("#успех", "#успех!"),
+    ("#успех", "#успех."),
+    ("#успех", "(#успех)"),
+    ("#успех", "#успехи"),
+    ("#успех", "#УСПЕХ\nи дальше"),
+    ("#a b", "#a b"),  # a keyword with whitespace is never a whole token
+])
+def test_hashtags_match_split(keyword, text):
+    assert_same_as_old([(keyword, HASHTAG)], text)
+
+
+def test_overlapping_keywords():
+    keywords = [("he", SUBSTRING), ("she", SUBSTRING), ("hers", SUBSTRING), ("his", SUBSTRING),
+                ("she", WORD), ("hers", WORD), ("ushers", WORD)]
+    for text in ("ushers", "she hers", "ahishers", "he", "h", ""):
+        assert_same_as_old(keywords, text)
+
+
+def test_trigger_with_whitespace():
+    keywords = [("good morning", WORD), ("morning", WORD), ("good  morning", SUBSTRING)]
+    for text in ("Good morning!", "good  morning", "goodmorning", "a good morning"):
+        assert_same_as_old(keywords, text)
+
+
+def test_first_prefers_lowest_value():
+    matcher = KeywordMatcher([("thanks", SUBSTRING, 1), ("thank", SUBSTRING, 0)])
+    assert matcher.first("thanks a lot") == 0
+    assert matcher.first("nothing") is None
+    assert KeywordMatcher([]).first("anything") is None
+
+
+def test_random_keywords_match_old_checks():
+    rng = random.Random(0)
+    alphabet = "abп_ #!.1Ё\n-İ"
+
+    def random_text(length):
+        return ''.join(rng.choice(alphabet) for _ in range(length))
+
+    for _ in range(5000):
+        keywords = [(random_text(rng.randint(1, 4)), rng.choice((WORD, HASHTAG, SUBSTRING))) for _ in range(rng.randint(1, 6))]
+        assert_same_as_old(keywords, random_text(rng.randint(0, 30)))
+
+
+def test_invalidate_during_build_is_not_lost():
+    chat_id = -100
+
+    def build(chat_id):
+        keyword_helper.invalidate(chat_id)  # e.g. the config NOTIFY arriving while the old config is being read
+        return KeywordMatcher([("old", WORD, 0)])
+
+    stale = keyword_helper._get('test', chat_id, build)
+    fresh = keyword_helper._get('test', chat_id, lambda chat_id: KeywordMatcher([("new", WORD, 0)]))
+    assert stale.match("old") == {0}
+    assert fresh is not stale and fresh.match("new") == {0}
+    assert keyword_helper._get('test', chat_id, build) is fresh
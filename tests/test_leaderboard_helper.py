@@ -0,0 +1,40 @@
+import random
+
+from src.helpers.leaderboard_helper import Leaderboard
+
+
+def expected_order(totals):
+    return sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+
+
+def test_top_and_rank():
+    leaderboard = Leaderboard({1: 5, 2: 10, 3: 5})
+    assert leaderboard.top(2) == [(2, 10), (1, 5)]  # ties broken by user id
+    assert leaderboard.rank(2) == 1
+    assert leaderboard.rank(1) == 2
+    assert leaderboard.rank(3) == 3
+    assert leaderboard.rank(4) is None
+    assert len(leaderboard) == 3
+
+
+def test_update_moves_user():
+    leaderboard = Leaderboard({1: 5, 2: 10})
+    leaderboard.update(1, 11)
+    assert leaderboard.top(10) == [(1, 11), (2, 10)]
+    leaderboard.update(3, -1)
+    assert leaderboard.rank(3) == 3
+    assert len(leaderboard) == 3
+
+
+def test_random_updates_keep_order():
+    rng = random.Random(0)
+    totals = {}
+    leaderboard = Leaderboard({})
+    for _ in range(2000):
+        user_id, total = rng.randint(1, 50), rng.randint(-20, 20)
+        totals[user_id] = total
+        leaderboard.update(user_id, total)
+    order = expected_order(totals)
+    assert leaderboard.top(len(order)) == order
+    for position, (user_id, _) in enumerate(order, 1):
+        assert leaderboard.rank(user_id) == position
@@ -0,0 +1,52 @@
+from datetime import datetime, time, timedelta, timezone
+
+from src.helpers.scheduled_message_helper import next_due
+
+NOW = datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc)  # a Monday
+
+
+def config(**fields):
+    return {
+        'last_sent': None,
+        'frequency_seconds': 3600,
+        'time_of_the_day': None,
+        'day_of_the_week': None,
+        'day_of_the_month': None,
+        **fields,
+    }
+
+
+def test_never_sent_is_due_now():
+    assert next_due(config(), NOW) == NOW
+
+
+def test_frequency_after_last_sent():
+    assert next_due(config(last_sent=NOW - timedelta(minutes=10)), NOW) == NOW + timedelta(minutes=50)
+
+
+def test_overdue_is_due_now():
+    assert next_due(config(last_sent=NOW - timedelta(days=3)), NOW) == NOW
+
+
+def test_time_of_the_day():
+    assert next_due(config(time_of_the_day=time(15)), NOW) == NOW.replace(hour=15)
+    # already past today's time: any moment later the same day matches, like the old `time_of_the_day <= now`
+    assert next_due(config(time_of_the_day=time(9)), NOW) == NOW
+
+
+def test_day_of_the_week():
+    assert next_due(config(day_of_the_week=2, time_of_the_day=time(9)), NOW) == datetime(2026, 10, 21, 9, 0, tzinfo=timezone.utc)
+
+
+def test_day_of_the_week_waits_for_frequency():
+    weekly = config(day_of_the_week=0, frequency_seconds=86400, last_sent=NOW - timedelta(hours=2))
+    assert next_due(weekly, NOW) == datetime(2026, 10, 26, 0, 0, tzinfo=timezone.utc)
+
+
+def test_day_of_the_month():
+    assert next_due(config(day_of_the_month=31), NOW) == datetime(2026, 10, 31, 0, 0, tzinfo=timezone.utc)
+    assert next_due(config(day_of_the_month=31), datetime(2026, 11, 1, tzinfo=timezone.utc)) == datetime(2026, 12, 31, tzinfo=timezone.utc)
+
+
+def test_impossible_day_is_never_due():
+    assert next_due(config(day_of_the_month=32), NOW) is None